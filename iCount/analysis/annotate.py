@@ -57,43 +57,42 @@ def annotate_cross_links(annotation, sites, sites_annotated, subtype='biotype',
     metrics = iCount.Metrics()
 
     excluded_types = excluded_types or []
-    cross_links = pybedtools.BedTool(sites).sort().saveas()
-    annotation = pybedtools.BedTool(annotation).filter(
-        lambda x: x[2] not in excluded_types).sort().saveas()
+    # Cross-links sorted by chromosome and position:
+    cross_links = sorted(pybedtools.BedTool(sites), key=lambda site: (site.chrom, site.start))
+    index = iCount.genomes.compiled.SegmentationIndex(annotation, excluded_types=excluded_types)
 
     LOGGER.info('Calculating overlaps between cross-link and annotation_file...')
-    overlaps = cross_links.intersect(annotation, sorted=True, s=True, wb=True).saveas()
-    try:
-        # this will raise TypeError if overlaps is empty:
-        overlaps[0]
-    except (IndexError, TypeError):
+    by_chrom_strand = {}
+    for i, site in enumerate(cross_links):
+        by_chrom_strand.setdefault((site.chrom, site.strand), []).append(i)
+
+    site_types = {}  # cotainer for all types intersecting with given cross-link
+    for (chrom, strand), site_indexes in by_chrom_strand.items():
+        queries, records = index.batch(
+            chrom, strand,
+            [cross_links[i].start for i in site_indexes],
+            [cross_links[i].stop for i in site_indexes],
+        )
+        types = index.table.values('type', records)
+        if subtype:
+            # Extract subtype attribute:
+            stypes = [re.match(r'.*{} "(.*?)";'.format(subtype), attrs)
+                      for attrs in index.table.attributes(records)]
+            types = ['{} {}'.format(type_, stype.group(1) if stype else '.') for type_, stype in zip(types, stypes)]
+        for query, type_ in zip(queries.tolist(), types):
+            site_types.setdefault(site_indexes[query], []).append(type_)
+
+    if not site_types:
         raise ValueError('No intersections found. This may be caused by '
                          'different naming of chromosomes in annotation and'
                          'cross_links file ("chr1" vs. "1")')
 
+    # Make annotated (with all intersecting types) cross link intervals:
     data = []  # cotainer for final annotated BED file intervals
-    site_types = []  # cotainer for all types intersecting with given cross-link
-    previous_interval = overlaps[0]
-
-    def finalize(types, site):
-        """Make annotated (with all intersecting types) cross link interval."""
-        data.append(create_interval_from_list(
-            site[0:3] + ['; '.join(map(str, sorted(set(types))))] + site[4:6]))
-
-    for interval in overlaps:
-        # Detect new cross link:
-        if interval.start != previous_interval.start or \
-           interval.strand != previous_interval.strand:
-            finalize(site_types, previous_interval)
-            site_types = []
-        if subtype:
-            # Extract subtype attribute:
-            stype = re.match(r'.*{} "(.*?)";'.format(subtype), interval[-1])
-            site_types.append('{} {}'.format(interval[8], stype.group(1) if stype else '.'))
-        else:
-            site_types.append(interval[8])
-        previous_interval = interval
-    finalize(site_types, previous_interval)
+    for i, site in enumerate(cross_links):
+        if i in site_types:
+            data.append(create_interval_from_list(
+                site[0:3] + ['; '.join(map(str, sorted(set(site_types[i]))))] + site[4:6]))
 
     # Produce annotated cross-link file:
     LOGGER.info('Writing results to file...')
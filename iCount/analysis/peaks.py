@@ -57,6 +57,14 @@ When comparing the observed distribution with the random one, FDR values are
 assigned to each position. A cutoff FRD value is chosen and only positions with
 FDR < FDR cutoff are considered as significant.
 
+For large groups, permutations can be replaced by a closed form: with
+``background`` set to ``analytic``, the random distribution is computed from
+the binomial model of random placement of cross-link events in a group (see
+``get_analytic_distrib``). Random distribution depends only on group size,
+number of cross-link events and ``rnd_seed``, so groups can be processed in
+parallel (``workers``) and, with ``cache`` set, permutation backgrounds are
+stored on disk and reused by later runs (and other samples).
+
 One must also know that when considering only scores on single positions
 significant *clusters* of cross-links can be missed. In the upper example, it is
 obvious, that something more significantly is happening on position b than on
@@ -120,8 +128,11 @@ reported in it, no matter the FDR value.
 import os
 import math
 import bisect
+import hashlib
 import logging
-from collections import Counter
+import functools
+import contextlib
+import multiprocessing
 
 import numpy
 import pybedtools
@@ -231,8 +242,165 @@ def cumulative_prob(vals, max_val):
 
 PS_CACHE = {}
 
+# Maximal number of random hits drawn at once when computing background distribution:
+RND_CHUNK_HITS = 2 ** 20
+
+# Default folder (in ``ICOUNT_TMP_ROOT``) and size limit (in bytes) of background distributions cached on disk:
+PEAKS_CACHE_DIR = 'peaks_cache'
+PEAKS_CACHE_SIZE = 2 ** 30
+
+# Cache on disk opened by ``_init_worker_cache`` in worker process:
+_WORKER_CACHE = {}
+
+
+def _rnd_cumulative_probs(rnd_hits, half_window):
+    """
+    Compute ``cumulative_prob`` of SWW scores for each row of random hits.
+
+    Each row of ``rnd_hits`` holds positions of cross-link events in one
+    permutation. Rows are sorted and shifted apart, so that windows of one
+    row never reach into another and all rows can be handled as one sorted
+    array: SWW score of an occupied position is the number of hits between two
+    ``searchsorted`` bounds. Histograms of all rows are then made with a
+    single ``bincount``.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array with a row for each permutation: i-th row is ``cumulative_prob``
+        of i-th permutation, truncated after the largest SWW score in
+        ``rnd_hits`` (all further probabilities are zero).
+
+    """
+    perms, total_hits = rnd_hits.shape
+    rnd_hits = numpy.sort(rnd_hits, axis=1)
+    span = (int(rnd_hits.max()) if rnd_hits.size else 0) + 2 * half_window + 1
+    flat = (rnd_hits + numpy.arange(perms, dtype=rnd_hits.dtype)[:, None] * span).ravel()
+
+    # Each occupied position is counted once, just like keys of Counter:
+    occupied = numpy.ones(flat.shape, dtype=bool)
+    occupied[1:] = flat[1:] != flat[:-1]
+    positions = flat[occupied]
+    scores_sww = (
+        numpy.searchsorted(flat, positions + half_window, side='right') -
+        numpy.searchsorted(flat, positions - half_window, side='left')
+    )
+    rows = numpy.repeat(numpy.arange(perms), total_hits)[occupied]
+
+    width = (int(scores_sww.max()) if scores_sww.size else 0) + 1
+    freqs = numpy.bincount(rows * width + scores_sww, minlength=perms * width)
+    freqs = freqs.reshape(perms, width) / numpy.bincount(rows, minlength=perms)[:, None]
+    # Probability of x cross-links OR MORE, as in ``cumulative_prob``:
+    return numpy.cumsum(freqs[:, ::-1], axis=1)[:, ::-1]
+
+
+def _update_stats(stats, batch):
+    """
+    Add rows of ``batch`` to running (count, mean, sum of squared deviations) ``stats`` of columns.
+
+    Statistics of the whole batch are merged at once (Welford's algorithm,
+    in the variant of Chan et al. for merging partial results). Batch can
+    have more columns than stats: all previously added rows are zero there.
+    """
+    count, mean, sq_dev_sum = stats
+    if batch.shape[1] > len(mean):
+        mean = numpy.pad(mean, (0, batch.shape[1] - len(mean)), mode='constant')
+        sq_dev_sum = numpy.pad(sq_dev_sum, (0, batch.shape[1] - len(sq_dev_sum)), mode='constant')
+    batch = numpy.pad(batch, ((0, 0), (0, len(mean) - batch.shape[1])), mode='constant')
+
+    batch_count = len(batch)
+    batch_mean = numpy.mean(batch, axis=0)
+    delta = batch_mean - mean
+    new_count = count + batch_count
+    mean = mean + delta * batch_count / new_count
+    batch_sq_dev_sum = numpy.sum((batch - batch_mean) ** 2, axis=0)
+    sq_dev_sum = sq_dev_sum + batch_sq_dev_sum + delta ** 2 * count * batch_count / new_count
+    return new_count, mean, sq_dev_sum
+
+
+class _BackgroundCache:
+    """
+    Background distributions stored on disk, shared between processes and runs.
+
+    Each distribution is stored in its own ``.npy`` file, named by the hash of
+    iCount version and the cache key. Files are written to a temporary file
+    and renamed, so readers never see a partial file. Modification time of a
+    file is updated on every hit. When total size of files exceeds
+    ``max_size``, least recently used files are removed, until cache is
+    reduced to 90% of ``max_size``. Removal is done under lock, but readers
+    do not lock: file removed just before it is read counts as a miss.
+
+    Size of cache is scanned when cache is opened and then only increased by
+    files written by this process, so eviction is triggered once per process
+    after enough new files are written (other processes trigger their own).
+    """
 
-def get_avg_rnd_distrib(size, total_hits, half_window, perms=10000):
+    def __init__(self, cache_dir=None, max_size=PEAKS_CACHE_SIZE):
+        """Open (and create, if needed) cache in ``cache_dir``."""
+        self.cache_dir = cache_dir or os.path.join(iCount.TMP_ROOT, PEAKS_CACHE_DIR)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._size = sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        """Return list of (modification time, file name, size) of cached files."""
+        entries = []
+        for fname in os.listdir(self.cache_dir):
+            if fname.endswith('.npy'):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, fname))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, fname, stat.st_size))
+        return entries
+
+    def _fname(self, cache_key):
+        """Return name of file with background of ``cache_key``."""
+        digest = hashlib.sha256('{}\0{!r}'.format(iCount.__version__, cache_key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, digest + '.npy')
+
+    def get(self, cache_key):
+        """Return cached background of ``cache_key`` or None, if it is not cached."""
+        fname = self._fname(cache_key)
+        try:
+            rnd_dist = numpy.load(fname).tolist()
+            os.utime(fname)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return rnd_dist
+
+    def put(self, cache_key, rnd_dist):
+        """Store background ``rnd_dist`` of ``cache_key``, evicting least recently used ones if needed."""
+        fname = self._fname(cache_key)
+        tmp_fname = '{}.{}.tmp'.format(fname, os.getpid())
+        with open(tmp_fname, 'wb') as handle:
+            numpy.save(handle, numpy.array(rnd_dist))
+        self._size += os.path.getsize(tmp_fname)
+        os.replace(tmp_fname, fname)
+
+        if self._size > self.max_size:
+            with iCount.files.file_lock(os.path.join(self.cache_dir, '.lock')):
+                entries = sorted(self._entries())
+                self._size = sum(size for _, _, size in entries)
+                for _, old_fname, size in entries:
+                    if self._size <= 0.9 * self.max_size:
+                        break
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(os.path.join(self.cache_dir, old_fname))
+                    self._size -= size
+
+
+def _background_random_state(rnd_seed, cache_key):
+    """Return random generator for background of ``cache_key``, seeded from ``rnd_seed`` and the key."""
+    digest = hashlib.sha256(repr((rnd_seed,) + tuple(cache_key)).encode()).digest()
+    return numpy.random.RandomState(int.from_bytes(digest[:4], 'little'))  # pylint: disable=no-member
+
+
+def get_avg_rnd_distrib(size, total_hits, half_window, perms=10000, rnd_seed=None, disk_cache=None):
     """
     Return background distribution for given region size and number of hits.
 
@@ -243,7 +411,17 @@ def get_avg_rnd_distrib(size, total_hits, half_window, perms=10000):
     Biol. 16, 130–137 (2009).
     https://www.ncbi.nlm.nih.gov/pmc/articles/PMC2735254/
 
-    Results are cached, so they can be reused.
+    Permutations are drawn in chunks of at most ``RND_CHUNK_HITS`` hits, as
+    rows of one array, and processed together by ``_rnd_cumulative_probs``.
+    Random numbers are drawn in the same order as if permutations were drawn
+    one by one. Mean and standard deviation over permutations are updated
+    after each chunk, so memory does not depend on the number of
+    permutations, only on the largest SWW score.
+
+    Results are cached, so they can be reused. If ``rnd_seed`` is given,
+    permutations are drawn from a random generator seeded by ``rnd_seed`` and
+    parameters of the call, instead of the global one: result then depends
+    only on the parameters, so it can also be stored in ``disk_cache``.
 
     Parameters
     ----------
@@ -255,40 +433,125 @@ def get_avg_rnd_distrib(size, total_hits, half_window, perms=10000):
         Half-window size. The actual window size is: 2 * half_window + 1.
     perms : int
         Number of permutations to make.
+    rnd_seed : int
+        Seed for random generator of this background. If None, global numpy
+        random generator is used.
+    disk_cache : _BackgroundCache
+        Cache on disk, used only if ``rnd_seed`` is given.
 
     Returns
     -------
-    numpy.ndarray
+    list
         Probability to find CWW score i or more on chosen position is equal to
-        i-th element or returned array.
+        i-th element or returned list. List ends with the largest SWW score
+        found in permutations, probability of larger scores is zero.
 
     """
-    cache_key = (size, total_hits, half_window, perms)
+    cache_key = (size, total_hits, half_window, perms, rnd_seed)
+    if cache_key not in PS_CACHE and rnd_seed is not None and disk_cache is not None:
+        rnd_dist_cached = disk_cache.get(cache_key)
+        if rnd_dist_cached is not None:
+            PS_CACHE[cache_key] = rnd_dist_cached
+
     if cache_key not in PS_CACHE:
+        # pylint: disable=no-member
+        random_state = numpy.random if rnd_seed is None else _background_random_state(rnd_seed, cache_key[:4])
+        stats = (0, numpy.zeros(1), numpy.zeros(1))
+        chunk = max(1, RND_CHUNK_HITS // max(total_hits, 1))
+        for first in range(0, perms, chunk):
+            # Draw random distribution of cross-link events in a group with
+            # group size = `size` and number of cross-link events = `total_hits`,
+            # one permutation per row:
+            rnd_hits = random_state.randint(size, size=(min(chunk, perms - first), total_hits))
+            stats = _update_stats(stats, _rnd_cumulative_probs(rnd_hits, half_window))
 
-        rnd_ps = numpy.zeros((perms, total_hits + 1))
-        for i in range(perms):
+        count, mean, sq_dev_sum = stats
+        rnd_dist = mean + numpy.sqrt(sq_dev_sum / max(count, 1))
+        # Adding std, can make probability higher than 1, which is nonsense. Fix:
+        rnd_dist_fixed = numpy.minimum(rnd_dist, 1.0).tolist()
+        PS_CACHE[cache_key] = rnd_dist_fixed
+        if rnd_seed is not None and disk_cache is not None:
+            disk_cache.put(cache_key, rnd_dist_fixed)
 
-            # Draw random distribution of cross-link events in a group with
-            # group size = `size` and number of cross-link events = `total_hits`
-            # pylint: disable=no-member
-            rnd_hits = Counter(numpy.random.randint(size, size=total_hits))
+    return PS_CACHE[cache_key]
 
-            # This is then list. i-th element in list is probability, that there
-            # is equal or more than i crossslinks on some position???
 
-            scores_cww = _sum_within_window_nopos(rnd_hits.items(), half_window=half_window)
-            rnd_ps[i, :] = cumulative_prob(scores_cww, total_hits)
+def _binomial_sf(trials, prob):
+    """Return array with P(X >= k) for k = 0, ..., trials and X ~ Binomial(trials, prob)."""
+    counts = numpy.arange(trials + 1)
+    if prob <= 0:
+        pmf = (counts == 0).astype(float)
+    elif prob >= 1:
+        pmf = (counts == trials).astype(float)
+    else:
+        # Logarithms of binomial coefficients, computed incrementally:
+        log_comb = numpy.concatenate([[0.0], numpy.cumsum(numpy.log(trials - counts[1:] + 1) - numpy.log(counts[1:]))])
+        pmf = numpy.exp(log_comb + counts * numpy.log(prob) + (trials - counts) * numpy.log1p(-prob))
+    return numpy.cumsum(pmf[::-1])[::-1]
 
-        rnd_dist = numpy.mean(rnd_ps, axis=0) + numpy.std(rnd_ps, axis=0)
+
+def get_analytic_distrib(size, total_hits, half_window):
+    """
+    Return background distribution for given region size and number of hits, without permutations.
+
+    This is the closed form counterpart of ``get_avg_rnd_distrib``: hits are
+    placed on ``size`` positions uniformly at random. For a position with
+    window of ``w`` positions, number of hits in window is binomial ``B(N,
+    w/size)`` and, given that the position itself has no hits, ``B(N, (w-1) /
+    (size-1))``. Their difference gives the probability that the position is
+    occupied and has SWW score ``k`` or more. Summed over all positions (with
+    shorter windows at region ends) and divided by the expected number of
+    occupied positions, it gives the expected ``cumulative_prob``.
+
+    As in ``get_avg_rnd_distrib``, standard deviation is added to the mean.
+    It is approximated as if occupied positions were independent, which
+    underestimates it when windows overlap a lot, so this mode is meant for
+    large groups, where both modes give similar results.
+
+    Results are cached, so they can be reused.
+
+    Parameters
+    ----------
+    size : int
+        Size of region.
+    total_hits : int
+        Number of cross-link events in region.
+    half_window : int
+        Half-window size. The actual window size is: 2 * half_window + 1.
+
+    Returns
+    -------
+    list
+        Probability to find CWW score i or more on chosen position is equal to
+        i-th element or returned list. List ends with the last non-zero
+        probability.
+
+    """
+    cache_key = (size, total_hits, half_window, 'analytic')
+    if cache_key not in PS_CACHE:
+        positions = numpy.arange(size)
+        windows = numpy.minimum(positions, half_window) + numpy.minimum(size - 1 - positions, half_window) + 1
+        p_empty = (1 - 1 / size) ** total_hits
+
+        occupied_above = numpy.zeros(total_hits + 1)
+        for window, count in enumerate(numpy.bincount(windows)):
+            if count:
+                sf_window = _binomial_sf(total_hits, min(1.0, window / size))
+                sf_others = _binomial_sf(total_hits, (window - 1) / (size - 1) if size > 1 else 0.0)
+                occupied_above += count * (sf_window - p_empty * sf_others)
+
+        occupied = max(size * (1 - p_empty), 1.0)
+        mean = numpy.clip(occupied_above / occupied, 0.0, 1.0)
+        rnd_dist = mean + numpy.sqrt(mean * (1 - mean) / occupied)
         # Adding std, can make probability higher than 1, which is nonsense. Fix:
-        rnd_dist_fixed = [min(1.0, prob) for prob in rnd_dist]
-        PS_CACHE[cache_key] = rnd_dist_fixed
+        rnd_dist_fixed = numpy.minimum(rnd_dist, 1.0)
+        PS_CACHE[cache_key] = rnd_dist_fixed[:max(1, len(numpy.trim_zeros(rnd_dist_fixed, 'b')))].tolist()
 
     return PS_CACHE[cache_key]
 
 
-def _process_group(pos_scores, group_size, half_window, perms):
+def _process_group(pos_scores, group_size, half_window, perms, background='permutation', rnd_seed=None,
+                   disk_cache=None):
     """
     Assign FDR value to each position in group.
 
@@ -334,7 +597,8 @@ def _process_group(pos_scores, group_size, half_window, perms):
     This is "cumulative_prob" for given example.
 
     To produce a reference to which this can be compared, we use function
-    ``get_avg_rnd_distrib``.
+    ``get_avg_rnd_distrib`` (or ``get_analytic_distrib``, if ``background``
+    is 'analytic').
 
     Then, random and observed "cumulative_prob" are compared and FDR scores for
     each cross-link can be derived. More can be read in artice [1] or in code
@@ -350,6 +614,17 @@ def _process_group(pos_scores, group_size, half_window, perms):
         Lits with (position, scores) elements.
     group_size : list
         Size of region
+    half_window : int
+        Half-window size.
+    perms : int
+        Number of permutations when calculating random distribution.
+    background : str
+        Background distribution: 'permutation' or 'analytic'.
+    rnd_seed : int
+        Seed for random generator of permutation background, see
+        ``get_avg_rnd_distrib``.
+    disk_cache : _BackgroundCache
+        Cache of permutation backgrounds on disk.
 
     Returns
     -------
@@ -368,7 +643,13 @@ def _process_group(pos_scores, group_size, half_window, perms):
     observed = cumulative_prob(scores_sww, sum_scores)
 
     # Calculate random cumulative_prob for given group_size and sum_scores:
-    random_ = get_avg_rnd_distrib(group_size, sum_scores, half_window, perms=perms)
+    if background == 'analytic':
+        random_ = get_analytic_distrib(group_size, sum_scores, half_window)
+    else:
+        random_ = get_avg_rnd_distrib(
+            group_size, sum_scores, half_window, perms=perms, rnd_seed=rnd_seed, disk_cache=disk_cache)
+    # Random distribution is zero beyond its largest SWW score:
+    random_ = random_ + [0.0] * (max_val + 1 - len(random_))
 
     # This step follows the article [1] to produce FDR values. First, produce
     # mapping from sww_scores to FDR value:
@@ -380,9 +661,76 @@ def _process_group(pos_scores, group_size, half_window, perms):
     return zip(positions, scores, scores_sww, fdr_scores)
 
 
+def _init_worker_cache(cache, cache_dir, cache_size):
+    """Open cache on disk once per worker process, all chunks processed by worker share it."""
+    _WORKER_CACHE['disk_cache'] = _BackgroundCache(cache_dir, cache_size) if cache else None
+
+
+def _process_groups(groups, half_window, perms, background, rnd_seed, disk_cache=None):
+    """
+    Process chunk of groups.
+
+    Groups are given as tuples (group key, hits, group size). If
+    ``disk_cache`` is not given, the one opened by ``_init_worker_cache`` in
+    this worker process is used (if any). Returns list of tuples (group key,
+    processed hits) and numbers of hits and misses of cache on disk while
+    processing this chunk.
+    """
+    if disk_cache is None:
+        disk_cache = _WORKER_CACHE.get('disk_cache')
+    processed = []
+    hits_before, misses_before = (disk_cache.hits, disk_cache.misses) if disk_cache else (0, 0)
+    for key, hits, group_size in groups:
+        processed.append((key, list(_process_group(
+            hits, group_size, half_window, perms, background=background, rnd_seed=rnd_seed, disk_cache=disk_cache))))
+    if disk_cache is None:
+        return processed, 0, 0
+    return processed, disk_cache.hits - hits_before, disk_cache.misses - misses_before
+
+
+def _process_chunks(chunks, workers, cache, cache_dir, cache_size, **options):
+    """
+    Yield results of ``_process_groups`` for each chunk of groups.
+
+    Chunks are processed by a pool of ``workers`` if there is more than one,
+    otherwise in this process. Either way, cache on disk is opened once per
+    process.
+    """
+    if workers > 1:
+        initargs = (cache, cache_dir, cache_size)
+        with multiprocessing.Pool(processes=workers, initializer=_init_worker_cache, initargs=initargs) as pool:
+            yield from pool.imap_unordered(functools.partial(_process_groups, **options), chunks)
+    else:
+        disk_cache = _BackgroundCache(cache_dir, cache_size) if cache else None
+        for chunk in chunks:
+            yield _process_groups(chunk, disk_cache=disk_cache, **options)
+
+
+def _group_chunks(groups, chunks):
+    """
+    Split groups in about ``chunks`` chunks with similar number of cross-link events.
+
+    Groups are sorted by number of cross-link events, so the largest groups
+    are processed first and the remaining small ones balance the load of
+    workers at the end.
+    """
+    weights = {key: sum(score for _, score in hits) for key, hits, _ in groups}
+    limit = sum(weights.values()) / chunks
+    chunk, chunk_weight = [], 0
+    for group in sorted(groups, key=lambda group: (-weights[group[0]], group[0])):
+        chunk.append(group)
+        chunk_weight += weights[group[0]]
+        if chunk_weight >= limit:
+            yield chunk
+            chunk, chunk_weight = [], 0
+    if chunk:
+        yield chunk
+
+
 def run(annotation, sites, peaks, scores=None, features=None, group_by='gene_id',
         merge_features=False, half_window=3, fdr=0.05, perms=100, rnd_seed=42,
-        report_progress=False):
+        report_progress=False, background='permutation', cache=False, cache_dir=None,
+        cache_size=PEAKS_CACHE_SIZE, workers=1):
     """
     Find positions with high density of cross-linked sites.
 
@@ -422,9 +770,29 @@ def run(annotation, sites, peaks, scores=None, features=None, group_by='gene_id'
     perms : int
         Number of permutations when calculating random distribution.
     rnd_seed : int
-        Seed for random generator.
+        Seed for random generator. Background for each group size and number
+        of cross-link events is drawn from its own random generator, seeded
+        by rnd_seed and these parameters, so results do not depend on the
+        order in which groups are processed.
     report_progress : bool
         Report analysis progress.
+    background : str
+        How random distribution is calculated: 'permutation' (from perms
+        random permutations) or 'analytic' (from binomial model, without
+        permutations, see ``get_analytic_distrib``).
+    cache : bool
+        Store permutation backgrounds on disk and reuse backgrounds stored by
+        previous runs with the same rnd_seed.
+    cache_dir : str
+        Directory with cached backgrounds. By default, folder ``peaks_cache``
+        in iCount temporary folder (``ICOUNT_TMP_ROOT``) is used.
+    cache_size : int
+        Size limit of cache (in bytes). When it is exceeded, least recently
+        used backgrounds are removed.
+    workers : int
+        Number of worker processes used to process groups. Largest groups
+        are processed first and result does not depend on the number of
+        workers.
 
     Returns
     -------
@@ -435,12 +803,14 @@ def run(annotation, sites, peaks, scores=None, features=None, group_by='gene_id'
     iCount.log_inputs(LOGGER, level=logging.INFO)
     metrics = iCount.Metrics()
 
+    if background not in ('permutation', 'analytic'):
+        raise ValueError('Background should be "permutation" or "analytic", not "{}".'.format(background))
+
     if features is None:
         features = ['gene']
     assert peaks.endswith(('.bed', '.bed.gz'))
     if scores:
         assert scores.endswith(('.tsv', '.tsv.gz', '.csv', '.csv.gz', 'txt', 'txt.gz'))
-    numpy.random.seed(rnd_seed)  # pylint: disable=no-member
 
     LOGGER.info('Loading annotation file...')
     annotation2 = iCount.files.decompress_to_tempfile(annotation)
@@ -508,25 +878,36 @@ def run(annotation, sites, peaks, scores=None, features=None, group_by='gene_id'
     # calculated together for each group.
     results = {}
     metrics.all_groups = len(groups)
+    cache_hits, cache_misses = 0, 0
+    # Crucial step: each position in a group is given a fdr_score, based on
+    # hits in group, group_size, half-window size and number of
+    # permutations. Groups are processed in chunks, by a pool of workers if
+    # there is more than one:
+    chunks = _group_chunks([(key, hits, group_sizes[key]) for key, hits in groups.items()], max(workers, 1) * 16)
+    processed_chunks = _process_chunks(
+        chunks, workers, cache, cache_dir, cache_size, half_window=half_window, perms=perms, background=background,
+        rnd_seed=rnd_seed)
     progress, j = 0, 0
-    for (chrom, strand, group_id, name), hits in sorted(groups.items()):
-        j += 1
+    for processed, chunk_hits, chunk_misses in processed_chunks:
+        cache_hits += chunk_hits
+        cache_misses += chunk_misses
+        # FDR scores (+ some other info) are written to `results` container:
+        for (chrom, strand, group_id, name), group_processed in processed:
+            for (pos, val, val_extended, fdr_score) in group_processed:
+                results.setdefault((chrom, pos, strand), []).\
+                    append((fdr_score, name, group_id, val, val_extended))
+
+        j += len(processed)
         if report_progress:
             new_progress = j / metrics.all_groups
             # pylint: disable=protected-access
             progress = iCount._log_progress(new_progress, progress, LOGGER)
-
-        group_size = group_sizes[(chrom, strand, group_id, name)]
-
-        # Crucial step: each position in a group is given a fdr_score, based on
-        # hits in group, group_size, half-window size and number of
-        # permutations. Than, FDR scores (+ some other info) are written to
-        # `results` container:
-        processed = _process_group(hits, group_size, half_window, perms)
-        for (pos, val, val_extended, fdr_score) in processed:
-            results.setdefault((chrom, pos, strand), []).\
-                append((fdr_score, name, group_id, val, val_extended))
     metrics.positions_annotated = len(results)
+    if cache:
+        # Only backgrounds not already computed in the same process are looked up on disk:
+        metrics.background_cache_hits = cache_hits
+        metrics.background_cache_misses = cache_misses
+        metrics.background_cache_hit_rate = cache_hits / max(cache_hits + cache_misses, 1)
 
     # cross-linked sites outside annotated regions
     LOGGER.info('Determining cross-links not intersecting with annotation...')
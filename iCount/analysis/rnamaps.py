@@ -149,7 +149,6 @@ Wishes and ideas(Jernej, Tomaz):
 """
 import logging
 
-import pybedtools
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt  # pylint: disable=wrong-import-position
@@ -443,22 +442,42 @@ def run(bam, segmentation, out_file, strange, cross_transcript, implicit_handlin
     data = {}
 
     progress = 0
+    # Genes (and intergenic segments) sorted by start coordinate and position
+    # of each gene record (in gene_index.table) in this list, for each strand of
+    # current chromosome:
+    current_chrom, chrom_segmentation, gene_positions = None, {}, {}
+    gene_index = iCount.genomes.compiled.SegmentationIndex(segmentation, types=['gene', 'intergenic'])
     LOGGER.info('Processing data...')
     # pylint: disable=protected-access
-    for (chrom, strand), new_progress, by_pos in iCount.mapping.xlsites._processs_bam_file(
+    for (chrom, strand), new_progress, hits in iCount.mapping.xlsites._processs_bam_file(
             bam, metrics, mapq_th, strange, segmentation=segmentation, gap_th=holesize_th):
 
         # pylint: disable=protected-access
         progress = iCount._log_progress(new_progress, progress, LOGGER)
 
-        # Sort all genes (and intergenic) by start coordinate.
-        segmentation_sorted = sorted(
-            iCount.genomes.segment._prepare_segmentation(segmentation, chrom, strand).items(),
-            key=lambda x: x[1]['gene_segment'].start)
+        # Data for chromosome/strand comes in many chunks with increasing
+        # positions. Segmentation is prepared only for the first one.
+        if chrom != current_chrom:
+            current_chrom, chrom_segmentation, gene_positions = chrom, {}, {}
+        if strand not in chrom_segmentation:
+            # Sort all genes (and intergenic) by start coordinate.
+            chrom_segmentation[strand] = sorted(
+                iCount.genomes.compiled._prepare_segmentation(segmentation, chrom, strand).items(),
+                key=lambda x: x[1]['gene_segment'].start)
+            gene_ids = {gene_id: i for i, (gene_id, _) in enumerate(chrom_segmentation[strand])}
+            records = gene_index.records(chrom, strand)
+            # Intergenic segments are stored under artificial gene ID, see _prepare_segmentation:
+            gene_positions[strand] = dict(zip(records.tolist(), [
+                gene_ids['G_{}_{}_{}'.format(chrom, strand, start) if type_ == 'intergenic' else gene_id]
+                for type_, gene_id, start in zip(
+                    gene_index.table.values('type', records), gene_index.table.values('gene_id', records),
+                    gene_index.table.start[records].tolist())
+            ]))
+        segmentation_sorted = chrom_segmentation[strand]
         seg_max_index = len(segmentation_sorted) - 1
-        start_gene_index, stop_gene_index = 0, seg_max_index
 
-        for xlink_pos, by_bc in sorted(by_pos.items()):
+        # Hits are stored in columnar store, build hierarchical structure only for current chunk:
+        for xlink_pos, by_bc in hits.by_position().items():
             # pylint: disable=protected-access
             iCount.mapping.xlsites._merge_similar_randomers(by_bc, mismatches)
             # by_bc is modified in place in _merge_similar_randomers
@@ -478,32 +497,22 @@ def run(bam, segmentation, out_file, strange, cross_transcript, implicit_handlin
 
                     # Sort reads by length and take the longest one (read_len is 3rd column)!
                     ss_group = sorted(ss_group, key=lambda x: (-x[2]))
-                    stop = ss_group[0][1]
-                    start = xlink_pos
+                    low, high = sorted([xlink_pos, ss_group[0][1]])
+                    # Genes containing the first and the last position of read. Gene contains
+                    # position if gene_segment.start <= position <= gene_segment.stop:
+                    queries, records = gene_index.batch(chrom, strand, [low - 1, high - 1], [low + 1, high + 1])
+                    containing = [set(), set()]
+                    for query, record in zip(queries.tolist(), records.tolist()):
+                        containing[query].add(gene_positions[strand][record])
                     segmentation_subset = []
-                    passed_start = False  # Weather the start_gene_index was aready found.
-                    for gene_item in segmentation_sorted[start_gene_index:]:
-                        gene_segment = gene_item[1]['gene_segment']
-
-                        if gene_segment.start <= start <= gene_segment.stop:
-                            start_gene_index = segmentation_sorted.index(gene_item)
-                            passed_start = True
-
-                        if passed_start:
-                            segmentation_subset.append(gene_item)
-
-                        if gene_segment.start <= stop <= gene_segment.stop:
-                            stop_gene_index = segmentation_sorted.index(gene_item)
-                            # Append also one gene before (insert on first position to keep sorted)
-                            segmentation_subset.insert(
-                                0, segmentation_sorted[max(start_gene_index - 1, 0)])
-                            # Append also one gene after:
-                            segmentation_subset.append(
-                                segmentation_sorted[min(stop_gene_index + 1, seg_max_index)])
-                            break
-                        # Even if entries repeat, this is still OK, sice
-                        # first and last gene neeed to be the ones not including
-                        # start/stop!
+                    if containing[0] or containing[1]:
+                        first_gene = max(containing[0] or containing[1])
+                        last_gene = min(containing[1] or containing[0])
+                        # Include also one gene before and one gene after (first and last gene
+                        # need to be the ones not including start/stop):
+                        segmentation_subset = [segmentation_sorted[max(first_gene - 1, 0)]] + [
+                            segmentation_sorted[i] for i in sorted(containing[0] | containing[1])
+                        ] + [segmentation_sorted[min(last_gene + 1, seg_max_index)]]
 
                     # segmentation_subset is defined. Now process this group:
                     _process_read_group(
@@ -577,9 +586,7 @@ def make_normalization(segmentation, normalization):
     LOGGER.info('Reading segmentation to internal format...')
 
     # pylint: disable=protected-access
-    chroms = set()
-    for segment in pybedtools.BedTool(segmentation):
-        chroms.add(segment.chrom)
+    chroms = {chrom for chrom, _ in iCount.genomes.compiled._load_segmentation(segmentation)}
     chroms_strands = [(chrom, strand) for chrom in chroms for strand in ('+', '-')]
 
     for (chrom, strand) in chroms_strands:
@@ -587,7 +594,7 @@ def make_normalization(segmentation, normalization):
         last_intergenic = None  # Store last intergenic segment.
         last_segments = []  # Store segments with highest stop coordinate (can be more of them).
 
-        chrom_content = iCount.genomes.segment._prepare_segmentation(
+        chrom_content = iCount.genomes.compiled._prepare_segmentation(
             segmentation, chrom, strand=strand)
 
         # Iter through all genes in given chromosome/strand sorted by start position:
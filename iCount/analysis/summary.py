@@ -14,8 +14,9 @@ import tempfile
 from pybedtools import BedTool
 
 import iCount
-from iCount.genomes.segment import summary_templates, sort_types_subtypes, TEMPLATE_TYPE, TEMPLATE_SUBTYPE, \
-    TEMPLATE_GENE, SUMMARY_TYPE, SUMMARY_SUBTYPE, SUMMARY_GENE
+from iCount.genomes.compiled import SegmentationIndex
+from iCount.genomes.segment import summary_templates, sort_types_subtypes, TEMPLATE_TYPE, \
+    TEMPLATE_SUBTYPE, TEMPLATE_GENE, SUMMARY_TYPE, SUMMARY_SUBTYPE, SUMMARY_GENE
 
 LOGGER = logging.getLogger(__name__)
 
@@ -51,42 +52,48 @@ def summary_reports(annotation, sites, out_dir, templates_dir=None):
         summary_templates(annotation, templates_dir)
 
     LOGGER.info('Calculating intersection between cross-link and annotation...')
-    # pylint: disable=too-many-function-args,unexpected-keyword-arg
-    overlaps = BedTool(sites).intersect(
-        BedTool(annotation),
-        sorted=True,  # invokes memory efficient algorithm for large files
-        s=True,  # only report hits in B that overlap A on the same strand
-        wb=True,  # write the original entry in B for each overlap
-        nonamecheck=True,  # Do not print warnings about name inconsistency to stdout
-    ).saveas()
-    # pylint: enable=too-many-function-args,unexpected-keyword-arg
-    try:
-        overlaps[0]  # will raise Error if overlaps is empty:
-    except (IndexError, TypeError):
-        raise ValueError('No intersections found. This may be caused by different naming of chromosomes in annotation'
-                         'and cross-links file (example: "chr1" vs. "1")')
+    index = SegmentationIndex(annotation)
+    sites_list = list(BedTool(sites))
+    by_chrom_strand = {}
+    for i, site in enumerate(sites_list):
+        by_chrom_strand.setdefault((site.chrom, site.strand), []).append(i)
+    overlaps = []
+    for (chrom, strand), site_indexes in by_chrom_strand.items():
+        queries, records = index.batch(
+            chrom, strand,
+            [sites_list[i].start for i in site_indexes],
+            [sites_list[i].stop for i in site_indexes],
+        )
+        overlaps.extend(zip([site_indexes[query] for query in queries.tolist()], records.tolist()))
+    # Keep the order of cross-links and order of annotation records for each of them:
+    overlaps.sort()
 
     type_counter, subtype_counter, gene_counter = {}, {}, {}
     LOGGER.info('Extracting summary data from intersection...')
-    for segment in overlaps:
-        score = int(segment.score)
+    records = [record for _, record in overlaps]
+    for (site_index, _), type_, attrs in zip(
+            overlaps, index.table.values('type', records), index.table.attributes(records)):
+        score = int(sites_list[site_index].score)
 
-        type_ = segment[8]
         type_counter[type_] = type_counter.get(type_, 0) + score
 
-        biotype = re.match(r'.*biotype "(.*?)";', segment[-1])
+        biotype = re.match(r'.*biotype "(.*?)";', attrs)
         biotype = biotype.group(1) if biotype else ''
         biotypes = biotype.split(',')
         for biotype in biotypes:
             sbtyp = iCount.genomes.segment.make_subtype(type_, biotype)
             subtype_counter[sbtyp] = subtype_counter.get(sbtyp, 0) + score / len(biotypes)
 
-        gene_id = re.match(r'.*gene_id "(.*?)";', segment[-1])
+        gene_id = re.match(r'.*gene_id "(.*?)";', attrs)
         gene_id = gene_id.group(1) if gene_id else None
         gene_counter[gene_id] = gene_counter.get(gene_id, 0) + score
 
+    if not overlaps:
+        raise ValueError('No intersections found. This may be caused by different naming of chromosomes in annotation'
+                         'and cross-links file (example: "chr1" vs. "1")')
+
     sum_cdna = 0
-    for seg in BedTool(sites):
+    for seg in sites_list:
         sum_cdna += int(seg.score)
 
     def parse_template(template_file):
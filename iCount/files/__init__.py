@@ -9,6 +9,8 @@ Parsing of `GTF`_ files is done with `pybedtools`_.
 
 .. autofunction:: iCount.files.gz_open
 .. autofunction:: iCount.files.decompress_to_tempfile
+.. autofunction:: iCount.files.get_file_hash
+.. autofunction:: iCount.files.file_lock
 
 .. automodule:: iCount.files.bed
    :members:
@@ -43,8 +45,11 @@ Parsing of `GTF`_ files is done with `pybedtools`_.
 
 """
 
+import contextlib
+import fcntl
 import os
 import gzip
+import hashlib
 import tempfile
 import shutil
 
@@ -131,6 +136,53 @@ def get_temp_file_name(tmp_dir=None, extension=''):
     return os.path.join(tmp_dir, tmp_name)
 
 
+def get_file_hash(fname, chunk_size=2 ** 20):
+    """
+    Return SHA-256 hex digest of the content of file ``fname``.
+
+    Parameters
+    ----------
+    fname : str
+        Path to file.
+    chunk_size : int
+        Number of bytes read at once.
+
+    Returns
+    -------
+    str
+        Hex digest of file content.
+
+    """
+    digest = hashlib.sha256()
+    with open(fname, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextlib.contextmanager
+def file_lock(fname):
+    """
+    Hold exclusive lock on file ``fname``, waiting for other processes to release it.
+
+    Parameters
+    ----------
+    fname : str
+        Path to lock file. It is created if it does not exist.
+
+    Returns
+    -------
+    None
+
+    """
+    with open(fname, 'a', encoding='utf-8') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
 def _f2s(number, dec=4):
     """
     Return string representation of ``number``.
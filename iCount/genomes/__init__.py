@@ -15,6 +15,9 @@ Also, segmentation into genes and segments of same type (exon, intron, UTR, ...)
 .. automodule:: iCount.genomes.segment
    :members:
 
+.. automodule:: iCount.genomes.compiled
+   :members:
+
 .. _Ensembl:
     http://www.ensembl.org/index.html
 
@@ -24,9 +27,13 @@ Also, segmentation into genes and segments of same type (exon, intron, UTR, ...)
 """
 import ftplib
 
+from . import cache
+from . import compiled
 from . import ensembl
 from . import gencode
+from . import gtf
 from . import segment
+from . import writer
 
 
 SUPPORTED_SOURCES = [
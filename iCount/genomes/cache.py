@@ -0,0 +1,100 @@
+""".. Line to protect from pydocstyle D205, D400.
+
+Segmentation cache
+------------------
+
+Store outputs of ``iCount.genomes.segment.get_segments`` by content of its inputs.
+
+Cache entry is a folder named by the hash of iCount version and content of
+annotation and genome file. Outputs are hard-linked from cache entry (or
+copied, where linking is not possible), so repeated calls with the same
+inputs take only as long as hashing them.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import iCount
+
+LOGGER = logging.getLogger(__name__)
+
+# Cached outputs of ``get_segments`` are stored in this subfolder of ``iCount.TMP_ROOT`` by default:
+SEGMENT_CACHE_DIR = 'segment_cache'
+_CACHE_METRICS = '.metrics.json'
+
+
+def _segment_cache_key(annotation, fai):
+    """Return key of ``get_segments`` outputs: hash of iCount version and content of input files."""
+    digest = hashlib.sha256()
+    for part in [iCount.__version__, iCount.files.get_file_hash(annotation), iCount.files.get_file_hash(fai)]:
+        digest.update(part.encode() + b'\0')
+    return digest.hexdigest()
+
+
+def _link_or_copy(src, dst):
+    """Hard-link ``src`` to ``dst`` (copy it, if linking is not possible), replacing ``dst`` atomically."""
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return
+    tmp_dst = '{}.{}.tmp'.format(dst, os.getpid())
+    try:
+        os.link(src, tmp_dst)
+    except OSError:
+        shutil.copy2(src, tmp_dst)
+    os.replace(tmp_dst, dst)
+
+
+def _get_cached_segments(annotation, fai, segmentation, compute, outputs, cache_dir=None):
+    """
+    Link outputs of ``get_segments`` from cache, computing them first if they are not cached.
+
+    Outputs are cached in subfolder of ``cache_dir`` named by the hash of
+    iCount version and content of ``annotation`` and ``fai``. Subfolder is
+    locked while outputs are looked up and computed, so concurrent calls with
+    the same inputs compute them only once and others wait for the result.
+
+    Parameters
+    ----------
+    annotation : str
+        Path to input GTF file.
+    fai : str
+        Path to input genome_file (.fai or similar).
+    segmentation : str
+        Path to output segmentation.
+    compute : callable
+        Function that makes outputs for segmentation at given path and
+        returns their metrics.
+    outputs : callable
+        Function that returns paths to all outputs of given segmentation.
+    cache_dir : str
+        Directory with cached outputs. By default, folder
+        ``SEGMENT_CACHE_DIR`` in iCount temporary folder is used.
+
+    Returns
+    -------
+    dict
+        Metrics of the call that computed cached outputs.
+
+    """
+    cache_dir = cache_dir or os.path.join(iCount.TMP_ROOT, SEGMENT_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = os.path.join(cache_dir, _segment_cache_key(annotation, fai))
+    # Cached segmentation is compressed only if output is:
+    cached = os.path.join(entry, 'segmentation.gtf.gz' if segmentation.endswith('.gz') else 'segmentation.gtf')
+
+    with iCount.files.file_lock(entry + '.lock'):
+        # Metrics are written last, so their presence marks complete outputs:
+        if os.path.isfile(cached + _CACHE_METRICS):
+            LOGGER.info('Using cached segmentation from %s', entry)
+        else:
+            LOGGER.info('Segmentation is not cached, storing it in %s', entry)
+            os.makedirs(entry, exist_ok=True)
+            metrics = compute(cached)
+            with open(cached + _CACHE_METRICS, 'wt', encoding='utf-8') as handle:
+                json.dump({name: value for name, value in vars(metrics).items() if name != 'context'}, handle)
+
+        for src, dst in zip(outputs(cached), outputs(segmentation)):
+            _link_or_copy(src, dst)
+        with open(cached + _CACHE_METRICS, 'rt', encoding='utf-8') as handle:
+            return json.load(handle)
@@ -0,0 +1,561 @@
+""".. Line to protect from pydocstyle D205, D400.
+
+Compiled segmentation
+---------------------
+
+Store segmentation in columnar arrays and query it by position.
+
+Next to segmentation file, ``iCount.genomes.segment.get_segments`` stores its
+compiled (binary) version, with ``COMPILED_EXTENSION`` appended. Compiled
+file is memory-mapped on load, so analyses that use segmentation do not need
+to parse GTF, as long as segmentation content does not change.
+"""
+import functools
+import itertools
+import json
+import logging
+import os
+import re
+import struct
+from collections import OrderedDict
+
+import numpy
+from pybedtools import create_interval_from_list
+
+import iCount
+
+LOGGER = logging.getLogger(__name__)
+
+# Compiled (binary) segmentation is stored next to segmentation GTF file:
+COMPILED_EXTENSION = '.cseg'
+_COMPILED_MAGIC = b'iCSEG\x00\x00\x00'
+_COMPILED_VERSION = 1
+_COMPILED_ALIGN = 64
+_ATTRIBUTES_RE = re.compile(r'(?:^|;)\s*(gene_id|transcript_id|biotype) "([^"]*)"')
+
+# Number of segmentation files, which records are kept in memory by ``_load_segmentation``:
+_SEGMENTATION_CACHE_SIZE = 4
+
+
+def _encode_strings(values, table):
+    """
+    Return codes of ``values`` in string ``table`` as numpy array.
+
+    Values that are not in ``table`` yet are added to it, code of a value is
+    the order of its first appearance.
+    """
+    for value in dict.fromkeys(values):
+        table.setdefault(value, len(table))
+    return numpy.fromiter(map(table.__getitem__, values), dtype='int32', count=len(values))
+
+
+class _SegmentationTable:
+    """
+    Segmentation records stored in columnar arrays.
+
+    Records are grouped by chromosome and strand, keeping the file order
+    inside each group. Coordinates are 0-based, half-open numpy arrays, string
+    columns are stored as codes into string tables and attributes (column 9)
+    as one UTF-8 blob with offsets::
+
+        table.start[i], table.stop[i]  # Coordinates of i-th record
+        table.tables['type'][table.type[i]]  # Type of i-th record
+        table.rows(chrom, strand)  # Range of record indexes in group
+
+    When loaded from compiled file, arrays are memory-mapped: loading takes
+    constant time and all processes using the same file share its pages.
+    """
+
+    # Columns with codes into string tables, in GTF column order:
+    CODED = ['chrom', 'source', 'type', 'score', 'strand', 'frame']
+    # Attributes extracted from column 9, also stored as codes:
+    ATTRIBUTES = ['gene_id', 'transcript_id', 'biotype']
+    ARRAYS = OrderedDict(
+        [(name, 'int32') for name in CODED + ATTRIBUTES] +
+        [('start', 'int64'), ('stop', 'int64'), ('attrs_offset', 'int64'), ('attrs', 'uint8')]
+    )
+
+    def __init__(self, arrays, tables, groups, origin=None):
+        """Set arrays, string tables, group ranges and info on origin file."""
+        self.chrom = arrays['chrom']
+        self.source = arrays['source']
+        self.type = arrays['type']
+        self.score = arrays['score']
+        self.strand = arrays['strand']
+        self.frame = arrays['frame']
+        self.gene_id = arrays['gene_id']
+        self.transcript_id = arrays['transcript_id']
+        self.biotype = arrays['biotype']
+        self.start = arrays['start']
+        self.stop = arrays['stop']
+        self.attrs_offset = arrays['attrs_offset']
+        self.attrs = arrays['attrs']
+        self.tables = tables
+        self.groups = groups
+        self.origin = origin or {}
+
+    def __iter__(self):
+        """Iterate over (chrom, strand) groups."""
+        return iter(self.groups)
+
+    def __contains__(self, key):
+        """Check if there are records for (chrom, strand) ``key``."""
+        return key in self.groups
+
+    def __len__(self):
+        """Return number of records."""
+        return len(self.start)
+
+    def rows(self, chrom, strand):
+        """Return range of record indexes on ``chrom`` and ``strand``."""
+        return range(*self.groups.get((chrom, strand), (0, 0)))
+
+    def _lines(self, first, last):
+        """Return GTF lines (without newline) of records ``first`` to ``last``."""
+        columns = [
+            list(map(self.tables[name].__getitem__, getattr(self, name)[first:last].tolist()))
+            for name in self.CODED
+        ]
+        starts = (self.start[first:last] + 1).tolist()
+        stops = self.stop[first:last].tolist()
+        offsets = self.attrs_offset[first:last + 1].tolist()
+        blob = bytes(self.attrs[offsets[0]:offsets[-1]]) if offsets else b''
+        attrs = [blob[start - offsets[0]:stop - offsets[0]].decode() for start, stop in zip(offsets, offsets[1:])]
+        return [
+            '\t'.join([chrom, source, type_, str(start), str(stop), score, strand, frame, attrs_])
+            for chrom, source, type_, score, strand, frame, start, stop, attrs_ in zip(*columns, starts, stops, attrs)
+        ]
+
+    def values(self, name, records):
+        """Return values of coded column ``name`` for ``records``."""
+        return list(map(self.tables[name].__getitem__, getattr(self, name)[records].tolist()))
+
+    def attributes(self, records):
+        """Return 9th column (attributes) of ``records``."""
+        offsets = self.attrs_offset
+        return [bytes(self.attrs[offsets[index]:offsets[index + 1]]).decode() for index in records]
+
+    def line(self, index):
+        """Return GTF line of record ``index``, without newline."""
+        return self._lines(index, index + 1)[0]
+
+    def lines(self, chrom, strand):
+        """Return GTF lines of records on ``chrom`` and ``strand``."""
+        return self._lines(*self.groups.get((chrom, strand), (0, 0)))
+
+    @classmethod
+    def from_gtf(cls, fname, chunk_size=2 ** 16):
+        """Parse GTF file ``fname``, ``chunk_size`` lines at once."""
+        tables = {name: {} for name in cls.CODED + cls.ATTRIBUTES}
+        chunks = {name: [] for name in cls.CODED + cls.ATTRIBUTES + ['start', 'stop', 'group']}
+        groups, attrs = {}, []
+        with iCount.files.gz_open(fname, 'rt') as handle:
+            for lines in iter(lambda: list(itertools.islice(handle, chunk_size)), []):
+                rows = [line.rstrip('\n').split('\t', 8) for line in lines if line.strip() and line[0] != '#']
+                if not rows:
+                    continue
+                if any(len(row) != 9 for row in rows):
+                    raise ValueError('File {} is not in GTF format.'.format(fname))
+                columns = list(zip(*rows))
+                for name, column in zip(cls.CODED, columns[:3] + columns[5:8]):
+                    chunks[name].append(_encode_strings(column, tables[name]))
+                found = [dict(_ATTRIBUTES_RE.findall(value)) for value in columns[8]]
+                for name in cls.ATTRIBUTES:
+                    chunks[name].append(_encode_strings([values.get(name, '') for values in found], tables[name]))
+                chunks['start'].append(numpy.array(columns[3], dtype='int64') - 1)
+                chunks['stop'].append(numpy.array(columns[4], dtype='int64'))
+                chunks['group'].append(_encode_strings(list(zip(columns[0], columns[6])), groups))
+                attrs.extend(value.encode() for value in columns[8])
+
+        # Group records by chromosome and strand, keep file order inside groups:
+        arrays = {
+            name: numpy.concatenate(values or [[]]).astype(cls.ARRAYS.get(name, 'int64'))
+            for name, values in chunks.items()
+        }
+        group = arrays.pop('group')
+        order = numpy.argsort(group, kind='stable')
+        arrays = {name: values[order] for name, values in arrays.items()}
+        attrs = [attrs[index] for index in order.tolist()]
+        arrays['attrs'] = numpy.frombuffer(b''.join(attrs), dtype='uint8')
+        arrays['attrs_offset'] = numpy.cumsum([0] + [len(value) for value in attrs], dtype='int64')
+
+        sizes = numpy.bincount(group, minlength=len(groups))
+        ends = numpy.cumsum(sizes)
+        # Codes are given in the order of first appearance, which plain dict does not keep before Python 3.7:
+        groups = OrderedDict(
+            (key, (int(ends[code] - sizes[code]), int(ends[code])))
+            for key, code in sorted(groups.items(), key=lambda item: item[1]))
+        tables = {name: sorted(table, key=table.get) for name, table in tables.items()}
+        stat = os.stat(fname)
+        origin = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        return cls(arrays, tables, groups, origin)
+
+    def save(self, fname):
+        """
+        Write compiled segmentation to file ``fname``.
+
+        File starts with magic bytes and length of JSON header, that stores
+        string tables, groups, info on origin file and position of arrays. Raw
+        arrays follow, each aligned to ``_COMPILED_ALIGN`` bytes.
+        """
+        arrays, offset = {}, 0
+        for name, dtype in self.ARRAYS.items():
+            array = numpy.ascontiguousarray(getattr(self, name), dtype=dtype)
+            arrays[name] = (array, offset)
+            offset += -(-array.nbytes // _COMPILED_ALIGN) * _COMPILED_ALIGN
+        header = json.dumps({
+            'version': _COMPILED_VERSION,
+            'origin': self.origin,
+            'tables': self.tables,
+            'groups': [[chrom, strand, first, last] for (chrom, strand), (first, last) in self.groups.items()],
+            'arrays': {name: [array.dtype.str, len(array), offset] for name, (array, offset) in arrays.items()},
+        }).encode()
+
+        # Write to temporary file first, so that readers never see partial file:
+        tmp_fname = '{}.{}.tmp'.format(fname, os.getpid())
+        with open(tmp_fname, 'wb') as handle:
+            handle.write(_COMPILED_MAGIC + struct.pack('<Q', len(header)) + header)
+            handle.write(b'\0' * (-handle.tell() % _COMPILED_ALIGN))
+            data_start = handle.tell()
+            for array, offset in arrays.values():
+                handle.seek(data_start + offset)
+                handle.write(array.tobytes())
+            handle.write(b'\0' * (-handle.tell() % _COMPILED_ALIGN))
+        os.replace(tmp_fname, fname)
+
+    @classmethod
+    def read_header(cls, fname):
+        """Return header and position of data in compiled segmentation file."""
+        with open(fname, 'rb') as handle:
+            if handle.read(len(_COMPILED_MAGIC)) != _COMPILED_MAGIC:
+                raise ValueError('File {} is not a compiled segmentation.'.format(fname))
+            header_len = struct.unpack('<Q', handle.read(8))[0]
+            header = json.loads(handle.read(header_len).decode())
+            data_start = handle.tell() + (-handle.tell() % _COMPILED_ALIGN)
+        if header['version'] != _COMPILED_VERSION:
+            raise ValueError('Unsupported compiled segmentation version in {}.'.format(fname))
+        return header, data_start
+
+    @classmethod
+    def load(cls, fname):
+        """Memory-map compiled segmentation file ``fname``."""
+        header, data_start = cls.read_header(fname)
+        arrays = {}
+        for name, (dtype, length, offset) in header['arrays'].items():
+            if length:
+                arrays[name] = numpy.memmap(fname, dtype=dtype, mode='r', offset=data_start + offset, shape=(length,))
+            else:
+                arrays[name] = numpy.zeros(0, dtype=dtype)
+        groups = OrderedDict(((chrom, strand), (first, last)) for chrom, strand, first, last in header['groups'])
+        return cls(arrays, header['tables'], groups, header['origin'])
+
+
+def _compile_segmentation(seg_file, out_file=None):
+    """
+    Write compiled (binary) version of segmentation file.
+
+    Compiled file stores segmentation in columnar arrays that are
+    memory-mapped on load (see ``_SegmentationTable``). It is tied to the
+    content of ``seg_file`` through its SHA-256 hash, so it is ignored by
+    ``_load_segmentation`` once ``seg_file`` changes.
+
+    Parameters
+    ----------
+    seg_file : str
+        Path to GTF file, produces by ``get_segments`` function.
+    out_file : str
+        Path to compiled file. By default, ``COMPILED_EXTENSION`` is appended
+        to ``seg_file``.
+
+    Returns
+    -------
+    str
+        Path to compiled file.
+
+    """
+    if out_file is None:
+        out_file = seg_file + COMPILED_EXTENSION
+    table = _SegmentationTable.from_gtf(seg_file)
+    table.origin['hash'] = iCount.files.get_file_hash(seg_file)
+    table.save(out_file)
+    return out_file
+
+
+def _load_compiled_segmentation(seg_file):
+    """
+    Return compiled segmentation of ``seg_file`` if it is up to date.
+
+    Compiled file is valid if it was made from file with the same content. To
+    avoid hashing large files on each load, content hash is only computed if
+    size or modification time of ``seg_file`` changed since compilation.
+    """
+    compiled = seg_file + COMPILED_EXTENSION
+    if not os.path.isfile(compiled):
+        return None
+    try:
+        header, _ = _SegmentationTable.read_header(compiled)
+    except (ValueError, KeyError, struct.error) as error:
+        LOGGER.warning('Ignoring compiled segmentation %s: %s', compiled, error)
+        return None
+
+    stat = os.stat(seg_file)
+    origin = header['origin']
+    if (origin['size'], origin['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+        if origin['size'] != stat.st_size or origin['hash'] != iCount.files.get_file_hash(seg_file):
+            LOGGER.info('Compiled segmentation %s is outdated, reading %s instead.', compiled, seg_file)
+            return None
+    LOGGER.debug('Loading compiled segmentation from %s', compiled)
+    return _SegmentationTable.load(compiled)
+
+
+@functools.lru_cache(maxsize=_SEGMENTATION_CACHE_SIZE)
+def _read_segmentation(seg_file, mtime_ns, size):  # pylint: disable=unused-argument
+    """Read records of segmentation file, modification time and size of file only distinguish cached results."""
+    records = _load_compiled_segmentation(seg_file)
+    if records is None:
+        records = _SegmentationTable.from_gtf(seg_file)
+    return records
+
+
+def _load_segmentation(seg_file):
+    """
+    Read segmentation file into records grouped by chromosome and strand.
+
+    If compiled version of segmentation (made by ``_compile_segmentation``)
+    is up to date, it is memory-mapped instead of parsing GTF file. Either
+    way, file is read only once: records of the last
+    ``_SEGMENTATION_CACHE_SIZE`` files are kept in memory and returned again
+    as long as the file is not modified. This way all per-chromosome (and
+    per-strand) calls of ``_prepare_segmentation`` share them, also when
+    calls for different segmentations alternate. Records are converted to
+    intervals only when chromosome is prepared.
+
+    Parameters
+    ----------
+    seg_file : str
+        Path to GTF file, produces by ``get_segments`` function.
+
+    Returns
+    -------
+    _SegmentationTable
+        Segmentation records.
+
+    """
+    stat = os.stat(seg_file)
+    return _read_segmentation(os.path.abspath(seg_file), stat.st_mtime_ns, stat.st_size)
+
+
+class SegmentationIndex:
+    """
+    Index for overlap queries over segmentation (or regions) file.
+
+    Records of each chromosome and strand are split in classes by their
+    length (powers of two) and sorted by start coordinate inside each class.
+    Records that overlap query interval are then found with binary search of
+    the window ``[start - max_length, stop)`` in each class, so only records
+    at most twice longer than the overlapping ones are checked in vain::
+
+        index = SegmentationIndex('segmentation.gtf')
+        index.point('1', '+', 1000)  # Records overlapping position 1000
+        index.range('1', '+', 1000, 2000)  # Records overlapping [1000, 2000)
+        index.batch('1', '+', [1000, 3000])  # Records overlapping each position
+
+    Coordinates are 0-based and intervals half-open (as in BED files).
+    Queries return indexes of records in ``index.table`` (in file order), that
+    can be used to get their coordinates, types and attributes.
+    """
+
+    def __init__(self, segmentation, types=None, excluded_types=None):
+        """
+        Index records in ``segmentation`` file.
+
+        Parameters
+        ----------
+        segmentation : str
+            Path to GTF file (segmentation, regions or any other annotation).
+        types : list_str
+            Only index records of these types (3rd column). All by default.
+        excluded_types : list_str
+            Do not index records of these types.
+
+        """
+        self.table = _load_segmentation(segmentation)
+        self.types = types
+        self.excluded_types = excluded_types or []
+        self._groups = {}
+
+    def records(self, chrom, strand):
+        """Return indexes of all indexed records on ``chrom`` and ``strand``."""
+        rows = self.table.rows(chrom, strand)
+        records = numpy.arange(rows.start, rows.stop, dtype='int64')
+        if self.types is None and not self.excluded_types:
+            return records
+        tables = self.table.tables['type']
+        types = self.types if self.types is not None else tables
+        selected = [code for code, type_ in enumerate(tables)
+                    if type_ in types and type_ not in self.excluded_types]
+        return records[numpy.isin(self.table.type[records], selected)]
+
+    def _length_classes(self, chrom, strand):
+        """Return (max_length, starts, stops, records) of each length class."""
+        key = (chrom, strand)
+        if key not in self._groups:
+            records = self.records(chrom, strand)
+            starts, stops = self.table.start[records], self.table.stop[records]
+            lengths = numpy.maximum(stops - starts, 1)
+            classes = numpy.ceil(numpy.log2(lengths)).astype('int64')
+            self._groups[key] = []
+            for class_ in numpy.unique(classes):
+                selected = records[classes == class_]
+                selected = selected[numpy.argsort(self.table.start[selected], kind='stable')]
+                self._groups[key].append((
+                    int(lengths[classes == class_].max()),
+                    numpy.asarray(self.table.start[selected]),
+                    numpy.asarray(self.table.stop[selected]),
+                    selected,
+                ))
+        return self._groups[key]
+
+    def batch(self, chrom, strand, starts, stops=None):
+        """
+        Find records overlapping each of many intervals at once.
+
+        Parameters
+        ----------
+        chrom : str
+            Chromosome name.
+        strand : str
+            Strand.
+        starts : list
+            Start coordinates of query intervals.
+        stops : list
+            Stop coordinates of query intervals. If not given, queries are
+            positions (``stops = starts + 1``).
+
+        Returns
+        -------
+        tuple
+            Arrays of query indexes and record indexes of all overlaps,
+            sorted by query and record.
+
+        """
+        starts = numpy.asarray(starts, dtype='int64')
+        stops = starts + 1 if stops is None else numpy.asarray(stops, dtype='int64')
+        queries, records = [numpy.zeros(0, dtype='int64')], [numpy.zeros(0, dtype='int64')]
+        for max_length, class_starts, class_stops, class_records in self._length_classes(chrom, strand):
+            first = numpy.searchsorted(class_starts, starts - max_length, side='right')
+            last = numpy.searchsorted(class_starts, stops, side='left')
+            counts = numpy.maximum(last - first, 0)
+            # Indexes of all candidates (in class arrays), grouped by query:
+            query = numpy.repeat(numpy.arange(len(starts)), counts)
+            candidate = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts - first, counts)
+            overlap = class_stops[candidate] > starts[query]
+            queries.append(query[overlap])
+            records.append(class_records[candidate[overlap]])
+        queries, records = numpy.concatenate(queries), numpy.concatenate(records)
+        order = numpy.lexsort((records, queries))
+        return queries[order], records[order]
+
+    def range(self, chrom, strand, start, stop):
+        """Return indexes of records overlapping interval [start, stop)."""
+        return self.batch(chrom, strand, [start], [stop])[1]
+
+    def point(self, chrom, strand, position):
+        """Return indexes of records overlapping ``position``."""
+        return self.batch(chrom, strand, [position])[1]
+
+    def borders(self, chrom):
+        """
+        Return starts and stops of indexed records on ``chrom``.
+
+        Second start of a split read on "+" strand is compared to record
+        starts and second start of a read on "-" strand to record stops.
+        Borders of records on both strands are therefore stored in sets keyed
+        by strand of the read::
+
+            borders = {
+                '+': {start1, start2, ...},
+                '-': {stop1, stop2, ...},
+            }
+
+        This way testing if second start falls on a known border takes
+        constant time.
+        """
+        borders = {'+': set(), '-': set()}
+        for strand in ('+', '-'):
+            records = self.records(chrom, strand)
+            borders['+'].update(self.table.start[records].tolist())
+            borders['-'].update(self.table.stop[records].tolist())
+        return borders
+
+
+def _prepare_segmentation(seg_file, chrom, strand=None):
+    """
+    Parse segmentation file to hierarchical structure.
+
+    Utility function to transformn segmentation file to the following
+    hierarchical structure::
+
+        segmentation = {
+            gene_id#1: {
+                'gene_segment': gene_segment,
+                transcript_id#1: [transcript, exon1, intron1, exon2, ...],
+                transcript_id#2: [transcript, exon1, intron1, exon2, ...],
+                ...
+            },
+            gene_id#2: {},
+            ...
+        }
+
+    Note that intergenic segments have multiple roles: the same intergenic
+    segment has the role of gene, transcript and sub-transcript segment. This
+    eases the treatment of intergenic intervals in algorithms that use this
+    function (rnamaps, xlsites, ...)
+
+    Parameters
+    ----------
+    seg_file : str
+        Path to GTF file, produces by ``get_segments`` function.
+    chrom : str
+        Chromosome for which segmentation is prepared.
+    strand : str
+        Strand for which segmentation is prepared. If not given, both strands
+        are included.
+
+    Returns
+    -------
+    dict
+        Segmentation, wrapped in dict with chrom-strand/gene/transcript levels of
+        depth.
+
+    """
+    segmentation = {}
+
+    records = _load_segmentation(seg_file)
+    lines = itertools.chain.from_iterable(
+        records.lines(chrom, strand_) for strand_ in ([strand] if strand else ['+', '-']))
+    for line in lines:
+        segment = create_interval_from_list(line.split('\t'))
+
+        if segment[2] == 'gene':
+            segmentation.setdefault(segment.attrs['gene_id'], {}). \
+                setdefault('gene_segment', segment)
+
+        elif segment[2] == 'intergenic':
+            # Make artificial_id from chromosome, strand and start:
+            fake_gid = 'G_{}_{}_{}'.format(segment.chrom, segment.strand, segment.start)
+            fake_tid = 'T_{}_{}_{}'.format(segment.chrom, segment.strand, segment.start)
+            segmentation.setdefault(fake_gid, {})['gene_segment'] = segment
+            segmentation[fake_gid][fake_tid] = [segment]
+
+        elif segment[2] == 'transcript':
+            segmentation.setdefault(segment.attrs['gene_id'], {}). \
+                setdefault(segment.attrs['transcript_id'], []). \
+                insert(0, segment)  # Ensure that transcript segment is the first one in list.
+
+        else:  # normal segment
+            segmentation.setdefault(segment.attrs['gene_id'], {}). \
+                setdefault(segment.attrs['transcript_id'], []). \
+                append(segment)
+
+    return segmentation
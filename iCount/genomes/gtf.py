@@ -0,0 +1,322 @@
+""".. Line to protect from pydocstyle D205, D400.
+
+Reading annotation
+------------------
+
+Read GTF annotation into groups of intervals belonging to one gene.
+
+Lines are parsed into lightweight ``_GtfRecord`` objects. Annotation is read
+in one pass if lines of each gene are contiguous (as in ENSEMBL and GENCODE
+annotations), otherwise lines are grouped by gene first.
+"""
+import logging
+import os
+
+import iCount
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _parse_attributes(col8):
+    """
+    Parse the content of 9th column (attributes) of GTF line into dict.
+
+    Pairs are separated by ``;``, key and value by the first whitespace and
+    quotes are removed from values. Value ``.`` stands for no attributes.
+    """
+    attrs = {}
+    if col8 == '.':
+        return attrs
+    for pair in col8.split(';'):
+        pair = pair.strip()
+        if pair:
+            key, value = pair.split(None, 1)
+            attrs[key] = value.replace('"', '')
+    return attrs
+
+
+def _format_attributes(col8):
+    """
+    Format the content of 9th column of GTF line as ``pybedtools`` writes parsed attributes.
+
+    Pairs are joined by ``;`` without spaces and the last one is also followed
+    by ``;``. Key and value are separated by ``=`` if there are at least as many
+    ``=`` as pairs (GFF) and by space otherwise. Values keep their quotes and
+    repeated keys are written once (at first position, with the last value).
+    """
+    field_sep = '=' if col8.count('=') > col8.count(';') - 1 else ' '
+    values, quoted = {}, set()
+    for pair in col8.strip().split(';'):
+        pair = pair.strip()
+        if pair:
+            key, value = pair.split(field_sep, 1)
+            if value.count('"') == 2:
+                quoted.add(key)
+            values[key] = value.replace('"', '')
+    return ''.join('{}{}{};'.format(key, field_sep, '"{}"'.format(value) if key in quoted else value)
+                   for key, value in values.items())
+
+
+class _GtfRecord:
+    """
+    Lightweight representation of GTF line used when building segmentation.
+
+    Coordinates are stored as integers in the same (0-based) system as in
+    ``pybedtools.Interval``: ``start`` is 0-based and ``stop`` is equal to the
+    GTF end coordinate. Attributes are parsed from column 9 only when they are
+    accessed for the first time and are cached afterwards. Text ``fields`` are
+    only made when record is written out. As in ``pybedtools.Interval``,
+    column 9 of records with accessed (non-empty) attributes is written in the
+    format of ``_format_attributes``.
+    """
+
+    __slots__ = ('chrom', 'source', 'type', 'start', 'stop', 'score', 'strand', 'frame', 'col8', '_attrs')
+
+    def __init__(self, chrom, source, type_, start, stop, score='.', strand='.', frame='.', col8='.'):
+        """Initialize record, ``start`` is 0-based."""
+        self.chrom = chrom
+        self.source = source
+        self.type = type_
+        self.start = start
+        self.stop = stop
+        self.score = score
+        self.strand = strand
+        self.frame = frame
+        self.col8 = col8
+        self._attrs = None
+
+    @classmethod
+    def from_fields(cls, fields):
+        """Make record from fields of GTF line."""
+        return cls(fields[0], fields[1], fields[2], int(fields[3]) - 1, int(fields[4]), *fields[5:9])
+
+    @property
+    def attrs(self):
+        """Attributes from column 9 as dict."""
+        if self._attrs is None:
+            self._attrs = _parse_attributes(self.col8)
+        return self._attrs
+
+    @property
+    def fields(self):
+        """Fields of GTF line (as strings)."""
+        col8 = _format_attributes(self.col8) if self._attrs else self.col8
+        return [self.chrom, self.source, self.type, str(self.start + 1), str(self.stop), self.score, self.strand,
+                self.frame, col8]
+
+    def replace(self, **changes):
+        """Return copy of record with given slots (e.g. ``type`` or ``start``) changed."""
+        record = _GtfRecord(self.chrom, self.source, self.type, self.start, self.stop, self.score, self.strand,
+                            self.frame, self.col8)
+        for name, value in changes.items():
+            setattr(record, name, value)
+        if 'col8' not in changes:
+            record._attrs = self._attrs  # pylint: disable=protected-access
+        return record
+
+    def __getitem__(self, index):
+        """Get field(s) of GTF line."""
+        return self.fields[index]
+
+    def __len__(self):
+        """Length of record."""
+        return self.stop - self.start
+
+    def __str__(self):
+        """GTF line."""
+        return '\t'.join(self.fields) + '\n'
+
+    def __repr__(self):
+        """Representation of record."""
+        return '_GtfRecord({})'.format(', '.join(repr(field) for field in self.fields))
+
+
+def _is_record_line(line):
+    """Check if line of GTF file is a record (and not comment or empty line)."""
+    return not line.startswith(('#', 'track ', 'browser ')) and bool(line.strip())
+
+
+def _read_gtf(gtf):
+    """Yield records of GTF file, skipping comments and empty lines."""
+    with iCount.files.gz_open(gtf, 'rt') as handle:
+        for line in handle:
+            if _is_record_line(line):
+                yield _GtfRecord.from_fields(line.rstrip('\n').split('\t'))
+
+
+def _read_gtf_by_gene(gtf, chromosomes):
+    """
+    Yield records of GTF file on given chromosomes, grouped by gene.
+
+    Genes are given in the order of their first line in file and records of
+    each gene in file order. Grouping is done through in-memory index of line
+    offsets in (decompressed) file, so records are not kept in memory.
+    """
+    fname = iCount.files.decompress_to_tempfile(gtf, context='segment')
+    try:
+        offsets = {}
+        with open(fname, 'rb') as handle:
+            offset = 0
+            for line in handle:
+                text = line.decode()
+                if _is_record_line(text):
+                    record = _GtfRecord.from_fields(text.rstrip('\n').split('\t'))
+                    if record.chrom in chromosomes:
+                        offsets.setdefault(record.attrs['gene_id'], []).append(offset)
+                offset += len(line)
+
+            for gene_offsets in offsets.values():
+                for offset in gene_offsets:
+                    handle.seek(offset)
+                    yield _GtfRecord.from_fields(handle.readline().decode().rstrip('\n').split('\t'))
+    finally:
+        if fname != gtf:
+            os.remove(fname)
+
+
+def _check_gene_order(gtf, chromosomes):
+    """
+    Find genes and transcripts whose lines are not contiguous in GTF file.
+
+    Parameters
+    ----------
+    gtf : str
+        Path to GTF file.
+    chromosomes : set
+        Chromosomes to consider.
+
+    Returns
+    -------
+    tuple
+        Number of records on given chromosomes, list of non-contiguous genes
+        and list of non-contiguous transcripts.
+
+    Raises
+    ------
+    ValueError
+        If transcript belongs to more than one gene.
+
+    """
+    seen_genes, transcript_genes = set(), {}
+    split_genes, split_transcripts = {}, {}
+    current_gene, current_transcript = None, None
+    count = 0
+    for record in _read_gtf(gtf):
+        if record.chrom not in chromosomes:
+            continue
+        count += 1
+
+        gene_id = record.attrs['gene_id']
+        if gene_id != current_gene:
+            if gene_id in seen_genes:
+                split_genes[gene_id] = None
+            seen_genes.add(gene_id)
+            current_gene, current_transcript = gene_id, None
+
+        transcript_id = record.attrs.get('transcript_id')
+        if transcript_id is not None and transcript_id != current_transcript:
+            if transcript_id in transcript_genes:
+                if transcript_genes[transcript_id] != gene_id:
+                    raise ValueError('Transcript {} is in genes {} and {}.'.format(
+                        transcript_id, transcript_genes[transcript_id], gene_id))
+                split_transcripts[transcript_id] = None
+            transcript_genes[transcript_id] = gene_id
+            current_transcript = transcript_id
+
+    return count, list(split_genes), list(split_transcripts)
+
+
+def _filter_col8(interval, keys=None):
+    """Filter the content of 9th column (attributes) in a GTF interval."""
+    if keys is None:
+        keys = ['gene_id', 'gene_name', 'transcript_id', 'transcript_name']
+    return ' '.join(['{} "{}";'.format(key, value) for key, value in sorted(interval.attrs.items()) if key in keys])
+
+
+def _get_gene_content(gtf, chromosomes, report_progress=False):
+    """
+    Give groups of intervals belonging to one gene (as generator).
+
+    Yielded structure is a dictionary that has key-value pairs:
+
+        * 'gene': interval if type gene
+        * 'transcript_id#1': intervals corresponding to transcript_id#1
+        * 'transcript_id#2': intervals corresponding to transcript_id#2
+        ...
+
+    Parameters
+    ----------
+    gtf : str
+        Path to gtf input file.
+    chromosomes : list
+        List of chromosomes to consider.
+    report_progress : bool
+        Show progress.
+
+    Returns
+    -------
+    dict
+        All intervals in gene, separated by transcript_id.
+
+    """
+    current_gene = None
+    gene_content = {}
+
+    def finalize(gene_content):
+        """Procedure before returning group of intervals belonging to one gene."""
+        if 'gene' not in gene_content:
+            # Manually create "gene interval":
+            int1 = next(iter(gene_content.values()))[0]
+            col8 = _filter_col8(int1)
+            start = min([i.start for j in gene_content.values() for i in j])
+            stop = max([i.stop for j in gene_content.values() for i in j])
+            gene_content['gene'] = int1.replace(type='gene', start=start, stop=stop, col8=col8)
+        return gene_content
+
+    # Check (in one pass) that lines of each gene are contiguous, otherwise group them through index:
+    chromosomes = set(chromosomes)
+    length, split_genes, split_transcripts = _check_gene_order(gtf, chromosomes)
+    if split_transcripts:
+        LOGGER.warning('Lines of %d transcripts are not contiguous in annotation: %s', len(split_transcripts),
+                       ', '.join(split_transcripts[:10]) + (', ...' if len(split_transcripts) > 10 else ''))
+    if split_genes:
+        LOGGER.warning('Lines of %d genes are not contiguous in annotation, grouping them by gene: %s',
+                       len(split_genes), ', '.join(split_genes[:10]) + (', ...' if len(split_genes) > 10 else ''))
+        intervals = _read_gtf_by_gene(gtf, chromosomes)
+    else:
+        intervals = (interval for interval in _read_gtf(gtf) if interval.chrom in chromosomes)
+
+    progress, j = 0, 0
+    for interval in intervals:
+        j += 1
+        if report_progress:
+            new_progress = j / length
+            progress = iCount._log_progress(new_progress, progress, LOGGER)  # pylint: disable=protected-access
+
+        # Segments without 'transcript_id' attributes are the ones that
+        # define genes. such intervals are not in all releases.
+        if interval.attrs['gene_id'] == current_gene:
+            if interval.type == 'gene':
+                gene_content['gene'] = interval
+            else:
+                # Lines of transcript are not necessarily contiguous:
+                gene_content.setdefault(interval.attrs['transcript_id'], []).append(interval)
+
+        else:  # New gene!
+            # First process old content:
+            if gene_content:  # To survive the first iteration
+                yield finalize(gene_content)
+
+            # Make empty container and classify interval
+            current_gene = interval.attrs['gene_id']
+            gene_content = {}
+            if interval.type == 'gene':
+                gene_content['gene'] = interval
+            elif 'transcript_id' in interval.attrs:
+                gene_content[interval.attrs['transcript_id']] = [interval]
+            else:
+                raise Exception("First element in gene content is neither gene or transcript!")
+
+    # for the last iteration:
+    if gene_content:
+        yield finalize(gene_content)
@@ -64,18 +64,24 @@ taken into account: CDS > UTR3 > UTR5 > ncRNA > intron > intergenic::
             |-intergenic-||--UTR5-||--UTR5-||-----CDS-----||-CDS-||-intron-||-UTR3-||-intergenic-|
 
 """
+import hashlib
+import heapq
 import itertools
 import logging
 import math
+import multiprocessing
 import os
 import re
-import shutil
-import tempfile
 from collections import Counter, OrderedDict
 
+import numpy
 from pybedtools import BedTool, create_interval_from_list
 
 import iCount
+from iCount.genomes.cache import _get_cached_segments
+from iCount.genomes.compiled import COMPILED_EXTENSION, _compile_segmentation, _load_segmentation
+from iCount.genomes.gtf import _GtfRecord, _filter_col8, _get_gene_content
+from iCount.genomes.writer import _SegmentationWriter, _read_chromosome_lengths
 
 LOGGER = logging.getLogger(__name__)
 
@@ -87,6 +93,8 @@ SUMMARY_TYPE = 'summary_type.tsv'
 SUMMARY_SUBTYPE = 'summary_subtype.tsv'
 SUMMARY_GENE = 'summary_gene.tsv'
 
+_GENE_NAME_RE = re.compile(r'gene_name "([^"]*)"')
+
 TYPE_HIERARCHY = [
     'CDS',
     'UTR3',
@@ -212,8 +220,22 @@ def simplify_biotype(type_, biotype):
     return biotype
 
 
-def make_uniq_region(seg, types, biotypes, genes):
-    """Make pybedtools.Interval representing unique region."""
+def _resolve_region(types, biotypes, genes):
+    """
+    Resolve overlapping segments into type, gene and biotypes of unique region.
+
+    Only segments with the highest rated type (by ``TYPE_HIERARCHY``) are
+    considered. Their biotypes are simplified and if they belong to more than
+    one gene, the longest gene is picked (on equal length, the one with the
+    smallest gene_id).
+
+    Returns
+    -------
+    tuple
+        Region type, gene as (gene_id, gene_name, gene_size) and comma
+        separated biotypes.
+
+    """
     assert len(types) == len(biotypes) == len(genes)
 
     # In case biotype is '3prime_overlapping_ncRNA', make sure type is UTR3
@@ -231,30 +253,27 @@ def make_uniq_region(seg, types, biotypes, genes):
 
     # Simplify biotypes and pick unique ones
     biotype_groups = set()
-    for i, item in enumerate(biotypes):
-        if i in idxs and item is not None:
+    for i in idxs:
+        if biotypes[i] is not None:
             # pylint: disable=undefined-loop-variable
-            biotype_groups.add(simplify_biotype(region_type, item))
+            biotype_groups.add(simplify_biotype(region_type, biotypes[i]))
             # pylint: enable=undefined-loop-variable
 
-    # Note that each entry in `genes` is a tuple of form (gene_id, gene_name, gene_size)
-    genes = list(set([item for i, item in enumerate(genes) if i in idxs]))
-    if len(genes) > 1:
-        # In case there are two or more genes, pick the longest one:
-        gene_sizes = [gsize for (_, _, gsize) in genes]
-        max_index = gene_sizes.index(max(gene_sizes))
-        genes = [genes[max_index]]
-    assert len(genes) == 1
-
-    attrs = 'gene_id "{}"; gene_name "{}"; biotype "{}";'.format(
-        genes[0][0],
-        genes[0][1],
-        ','.join(sorted(biotype_groups)),
-    )
+    # Note that each entry in `genes` is a tuple of form (gene_id, gene_name, gene_size).
+    # In case there are two or more genes, pick the longest one:
+    gene = min(set(genes[i] for i in idxs), key=lambda gene: (-gene[2], str(gene[0])))
+
     # pylint: disable=undefined-loop-variable
+    return region_type, gene, ','.join(sorted(biotype_groups))
+    # pylint: enable=undefined-loop-variable
+
+
+def make_uniq_region(seg, types, biotypes, genes):
+    """Make pybedtools.Interval representing unique region."""
+    region_type, gene, biotype = _resolve_region(types, biotypes, genes)
+    attrs = 'gene_id "{}"; gene_name "{}"; biotype "{}";'.format(gene[0], gene[1], biotype)
     return create_interval_from_list(
         [seg.chrom, '.', region_type, seg.start + 1, seg.stop, '.', seg.strand, '.', attrs])
-    # pylint: enable=undefined-loop-variable
 
 
 def merge_regions(nonmerged, out_file):
@@ -313,99 +332,151 @@ def sort_types_subtypes(entry):
     return [get_index(type_, TYPE_HIERARCHY), get_index(biotype, list(SUBTYPE_GROUPS.keys()))]
 
 
-def summary_templates(annotation, templates_dir):
-    """Make summary templates."""
-    type_template, subtype_template, gene_template = {}, {}, {}
-    for interval in BedTool(annotation):
-        length = len(interval)
+def _add_to_templates(templates, type_, biotype, gene_id, gene_name, length):
+    """Add length of region to (type, subtype, gene) ``templates``."""
+    type_template, subtype_template, gene_template = templates
+    type_template[type_] = type_template.get(type_, 0) + length
+
+    biotypes = biotype.split(',')
+    for biotype_ in biotypes:
+        sbtyp = make_subtype(type_, biotype_)
+        subtype_template[sbtyp] = subtype_template.get(sbtyp, 0) + length / len(biotypes)
 
-        type_ = interval[2]
-        type_template[type_] = type_template.get(type_, 0) + length
+    current_size = gene_template.get(gene_id, ['', 0])[1]
+    gene_template[gene_id] = [gene_name, current_size + length]
 
-        biotypes = interval.attrs.get('biotype', '').split(',')
-        for biotype in biotypes:
-            sbtyp = make_subtype(type_, biotype)
-            subtype_template[sbtyp] = subtype_template.get(sbtyp, 0) + length / len(biotypes)
 
-        gene_id = interval.attrs.get('gene_id', '')
-        gene_name = interval.attrs.get('gene_name', '')
-        current_size = gene_template.get(gene_id, ['', 0])[1]
-        gene_template[gene_id] = [gene_name, current_size + length]
+def _write_templates(templates, templates_dir):
+    """Write (type, subtype, gene) ``templates`` to ``templates_dir``."""
+    type_template, subtype_template, gene_template = templates
 
     # Write type template
-    with open(os.path.join(templates_dir, TEMPLATE_TYPE), 'wt') as outfile:
+    with open(os.path.join(templates_dir, TEMPLATE_TYPE), 'wt', encoding='utf-8') as outfile:
         for type_, length in sorted(type_template.items(), key=lambda x: sort_types_subtypes(x[0])):
             outfile.write('{}\t{}\n'.format(type_, math.floor(length)))
 
     # Write subtype template
-    with open(os.path.join(templates_dir, TEMPLATE_SUBTYPE), 'wt') as outfile:
+    with open(os.path.join(templates_dir, TEMPLATE_SUBTYPE), 'wt', encoding='utf-8') as outfile:
         for subtype, length in sorted(subtype_template.items(), key=lambda x: sort_types_subtypes(x[0])):
             outfile.write('{}\t{}\n'.format(subtype, math.floor(length)))
 
     # Write gene template
-    with open(os.path.join(templates_dir, TEMPLATE_GENE), 'wt') as outfile:
+    with open(os.path.join(templates_dir, TEMPLATE_GENE), 'wt', encoding='utf-8') as outfile:
         for gene_id, (gene_name, length) in sorted(gene_template.items()):
             line = [gene_id, gene_name, str(math.floor(length))]
             outfile.write('\t'.join(map(str, line)) + '\n')
 
 
-def make_regions(segmentation, out_dir=None):
-    """Make regions file (regions.gtf.gz) and summary templates."""
-    if out_dir is None:
-        out_dir = os.getcwd()
-    if not os.path.isdir(out_dir):
-        os.makedirs(out_dir, exist_ok=True)
+def summary_templates(annotation, templates_dir):
+    """Make summary templates."""
+    templates = ({}, {}, {})
+    for interval in BedTool(annotation):
+        _add_to_templates(
+            templates,
+            interval[2],
+            interval.attrs.get('biotype', ''),
+            interval.attrs.get('gene_id', ''),
+            interval.attrs.get('gene_name', ''),
+            len(interval),
+        )
+    _write_templates(templates, templates_dir)
 
-    seg_filtered = BedTool(segmentation).filter(lambda x: x[2] not in ['transcript', 'gene']).saveas()
 
-    borders = construct_borders(seg_filtered)
-    # pylint: disable=unexpected-keyword-arg, too-many-function-args
-    overlaps = BedTool(borders).intersect(
-        seg_filtered, sorted=True, s=True, wa=True, wb=True, nonamecheck=True).saveas()
-    # pylint: enable=unexpected-keyword-arg, too-many-function-args
+def _type_codes(table, types):
+    """Return codes of ``types`` in string table of segmentation ``table``."""
+    return [code for code, type_ in enumerate(table.tables['type']) if type_ in types]
 
-    intervals, types, biotypes, genes = [], [], [], []
-    gene_sizes = get_gene_sizes(segmentation)
-    pseg = overlaps[0]  # Set initial value for "previous segment"
-    for seg in overlaps:
-        if seg.start != pseg.start or seg.stop != pseg.stop or seg.strand != pseg.strand:
-            intervals.append(make_uniq_region(pseg, types, biotypes, genes))
-            types, biotypes, genes = [], [], []
 
-        types.append(seg[8])  # In overlaps, this is 3rd column of GTF file
+def _sweep_regions(table, chrom, strand, gene_sizes):
+    """
+    Yield merged regions on ``chrom`` and ``strand`` of segmentation ``table``.
 
-        biotype = re.match(r'.*biotype "(.*?)";', seg[-1])
-        biotype = biotype.group(1) if biotype else None
-        biotypes.append(biotype)
+    Segments (without genes and transcripts) are swept by start. Between each
+    two consecutive borders of segments, overlapping segments are resolved
+    into one region by ``_resolve_region``. Consecutive regions with the same
+    type, biotypes and gene are merged. Regions are yielded as tuples
+    ``(start, stop, type, gene_id, gene_name, biotype)``, sorted by start.
+    """
+    rows = table.rows(chrom, strand)
+    records = numpy.arange(rows.start, rows.stop, dtype='int64')
+    records = records[~numpy.isin(table.type[records], _type_codes(table, ['gene', 'transcript']))]
+    records = records[numpy.argsort(table.start[records], kind='stable')]
+
+    starts = table.start[records].tolist()
+    stops = table.stop[records].tolist()
+    types = table.values('type', records)
+    biotypes = [biotype or None for biotype in table.values('biotype', records)]
+    genes = [
+        (gene_id, match.group(1) if match else None, gene_sizes.get(gene_id, 0))
+        for gene_id, match in zip(table.values('gene_id', records),
+                                  map(_GENE_NAME_RE.search, table.attributes(records.tolist())))
+    ]
+
+    borders = sorted(set(starts).union(stops))
+    active, ends = set(), []
+    current, next_ = [], 0
+    for start, stop in zip(borders, borders[1:]):
+        # Segments that start at this border become active, the ones that end here are removed:
+        while next_ < len(starts) and starts[next_] <= start:
+            active.add(next_)
+            heapq.heappush(ends, (stops[next_], next_))
+            next_ += 1
+        while ends and ends[0][0] <= start:
+            active.discard(heapq.heappop(ends)[1])
+        if not active:
+            continue
 
-        gene_id = re.match(r'.*gene_id "(.*?)";', seg[-1])
-        gene_id = gene_id.group(1) if gene_id else None
-        gene_name = re.match(r'.*gene_name "(.*?)";', seg[-1])
-        gene_name = gene_name.group(1) if gene_name else None
-        genes.append((gene_id, gene_name, gene_sizes[gene_id]))
+        members = sorted(active)
+        region_type, gene, biotype = _resolve_region(
+            [types[i] for i in members], [biotypes[i] for i in members], [genes[i] for i in members])
+        if current and (current[2], current[3], current[5]) == (region_type, gene[0], biotype):
+            current[1] = stop
+        else:
+            if current:
+                yield tuple(current)
+            current = [start, stop, region_type, gene[0], gene[1], biotype]
 
-        pseg = seg
+    if current:
+        yield tuple(current)
 
-    intervals.append(make_uniq_region(pseg, types, biotypes, genes))
-    nonmerged = BedTool(interval for interval in intervals).saveas()
 
-    # Merge intervals where possible
-    merged = os.path.join(out_dir, REGIONS_FILE)
-    merge_regions(nonmerged, merged)
+def make_regions(segmentation, out_dir=None):
+    """
+    Make regions file (regions.gtf.gz) and summary templates.
 
-    # Finally, make templates
-    summary_templates(merged, out_dir)
+    Segmentation is read once (memory-mapped, if it is compiled) and
+    segments of each chromosome and strand are flattened into regions in a
+    single sweep by start coordinate, see ``_sweep_regions``. Regions are
+    written sorted by chromosome and start and summary templates are
+    computed from them on the fly.
+    """
+    if out_dir is None:
+        out_dir = os.getcwd()
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir, exist_ok=True)
 
+    table = _load_segmentation(segmentation)
+    gene_sizes = {'.': 0}  # Fill '.' as this is 'gene_id' for intergenic regions
+    genes = numpy.flatnonzero(numpy.isin(table.type, _type_codes(table, ['gene'])))
+    for gene_id, start, stop in zip(table.values('gene_id', genes), table.start[genes].tolist(),
+                                    table.stop[genes].tolist()):
+        gene_sizes[gene_id] = stop - start
+
+    templates = ({}, {}, {})
+    with iCount.files.gz_open(os.path.join(out_dir, REGIONS_FILE), 'wt') as handle:
+        for chrom in sorted(set(chrom for chrom, _ in table)):
+            strands = [
+                zip(_sweep_regions(table, chrom, strand, gene_sizes), itertools.repeat(strand))
+                for strand in ['+', '-']
+            ]
+            for (start, stop, type_, gene_id, gene_name, biotype), strand in heapq.merge(
+                    *strands, key=lambda item: item[0][0]):
+                attrs = 'gene_id "{}";gene_name "{}";biotype "{}";'.format(gene_id, gene_name, biotype)
+                handle.write('\t'.join([chrom, '.', type_, str(start + 1), str(stop), '.', strand, '.', attrs]) + '\n')
+                _add_to_templates(templates, type_, biotype, gene_id, str(gene_name), stop - start)
 
-def _first_two_columns(input_file):
-    """Keep just first two columns of file."""
-    ofile = tempfile.NamedTemporaryFile(mode='wt', delete=False)
-    with open(input_file) as ifile:
-        for line in ifile:
-            col_1_2 = line.strip().split()[:2]
-            ofile.write('\t'.join(col_1_2) + '\n')
-    ofile.close()
-    return os.path.abspath(ofile.name)
+    # Finally, make templates
+    _write_templates(templates, out_dir)
 
 
 def _a_in_b(first, second):
@@ -430,7 +501,7 @@ def _get_biotype(interval):
 
     Parameters
     ----------
-    interval : pybedtools.Interval
+    interval : _GtfRecord
         Interval == line in GTf file.
 
     Returns
@@ -448,13 +519,13 @@ def _get_biotype(interval):
     elif "gene_type" in interval.attrs:
         return interval.attrs['gene_type']
     else:
-        return interval[1]
+        return interval.source
 
 
 def _add_biotype_value(interval, biotype):
     """Add biotype value to interval."""
-    col8 = interval[8] if interval[8] != '.' else ''
-    return create_interval_from_list(interval[:8] + [col8 + ' biotype "{}";'.format(biotype)])
+    col8 = interval[8] if interval.col8 != '.' else ''
+    return interval.replace(col8=col8 + ' biotype "{}";'.format(biotype))
 
 
 def _add_biotype_attribute(gene_content):
@@ -482,14 +553,11 @@ def _add_biotype_attribute(gene_content):
     for transcript_id, transcript_intervals in gene_content.items():
         if transcript_id == 'gene':
             continue
-        first_exon = [i for i in transcript_intervals if i[2] in ['CDS', 'ncRNA']][0]
+        first_exon = next(i for i in transcript_intervals if i.type in ('CDS', 'ncRNA'))
         biotype = _get_biotype(first_exon)
         gene_biotypes.append(biotype)
 
-        new_intervals = []
-        for interval in transcript_intervals:
-            new_intervals.append(_add_biotype_value(interval, biotype))
-        gene_content[transcript_id] = new_intervals
+        gene_content[transcript_id] = [_add_biotype_value(interval, biotype) for interval in transcript_intervals]
 
     # Finally, make also gene biotype: a list of all biotypes in gene,
     # sorted by frequency. Additionally, another sorting is added to sort
@@ -547,7 +615,7 @@ def _check_consistency(intervals):
     }
     intervals = intervals.copy()
     try:
-        index = next(i for i in range(len(intervals)) if intervals[i][2] == 'transcript')
+        index = next(i for i in range(len(intervals)) if intervals[i].type == 'transcript')
     except StopIteration:
         raise ValueError("No transcript interval in list of intervals.")
     transcript_interval = intervals.pop(index)
@@ -558,7 +626,7 @@ def _check_consistency(intervals):
     assert transcript_interval.stop == intervals[-1].stop
     for first, second in zip(intervals, intervals[1:]):
         assert first.stop == second.start
-        assert second[2] in can_follow[strand][first[2]]
+        assert second.type in can_follow[strand][first.type]
 
 
 def _get_non_cds_exons(cdses, exons, intervals):
@@ -610,7 +678,7 @@ def _get_non_cds_exons(cdses, exons, intervals):
     utrs = []
     int0 = intervals[0]
     strand = int0.strand
-    stop_codons = [i for i in intervals if i.fields[2] == 'stop_codon']
+    stop_codons = [i for i in intervals if i.type == 'stop_codon']
     cdses = cdses.copy()
 
     # Merge stop_codons with cds where posssible:
@@ -628,11 +696,11 @@ def _get_non_cds_exons(cdses, exons, intervals):
         elif touching_cds:
             cds_index, cds = touching_cds
             replace_cds_indexes.append(cds_index)
-            start = min(cds.start, stop_codon.start) + 1
+            start = min(cds.start, stop_codon.start)
             stop = max(cds.stop, stop_codon.stop)
-            replace_cdses.append(create_interval_from_list(cds[:3] + [start, stop] + cds[5:]))
+            replace_cdses.append(cds.replace(start=start, stop=stop))
         else:
-            new_cdses.append(create_interval_from_list(stop_codon[:2] + ['CDS'] + stop_codon[3:]))
+            new_cdses.append(stop_codon.replace(type='CDS'))
     for index, cds in zip(replace_cds_indexes, replace_cdses):
         cdses[index] = cds
     cdses.extend(new_cdses)
@@ -645,8 +713,7 @@ def _get_non_cds_exons(cdses, exons, intervals):
                 mode = "UTR3"
             else:
                 mode = "UTR5"
-            utrs.append(create_interval_from_list(
-                exon[:2] + [mode, exon.start + 1, exon.stop, '.', strand, '.', exon[8]]))
+            utrs.append(exon.replace(type=mode, score='.', strand=strand, frame='.'))
 
         else:
             # CDS in exons! Identify which one:
@@ -656,24 +723,15 @@ def _get_non_cds_exons(cdses, exons, intervals):
             if cds.start != exon.start:
                 # UTR in the beggining:
                 mode = 'UTR5' if exon.strand == '+' else "UTR3"
-                utrs.append(create_interval_from_list(
-                    exon[:2] + [mode, exon.start + 1, cds.start, '.', strand, '.', exon[8]]))
+                utrs.append(exon.replace(type=mode, stop=cds.start, score='.', strand=strand, frame='.'))
             if cds.stop != exon.stop:
                 # UTR in the end:
                 mode = "UTR3" if exon.strand == '+' else "UTR5"
-                utrs.append(create_interval_from_list(
-                    exon[:2] + [mode, cds.stop + 1, exon.stop, '.', strand, '.', exon[8]]))
+                utrs.append(exon.replace(type=mode, start=cds.stop, score='.', strand=strand, frame='.'))
 
     return cdses, utrs
 
 
-def _filter_col8(interval, keys=None):
-    """Filter the content of 9th column (attributes) in a GTF interval."""
-    if keys is None:
-        keys = ['gene_id', 'gene_name', 'transcript_id', 'transcript_name']
-    return ' '.join(['{} "{}";'.format(key, value) for key, value in sorted(interval.attrs.items()) if key in keys])
-
-
 def _get_introns(exons):
     """
     Calculate the positions of introns and return them as a list of intervals.
@@ -695,19 +753,19 @@ def _get_introns(exons):
     Returns
     -------
     list
-        List of pybedtools interval objects representing introns.
+        List of records representing introns.
 
     """
-    # start of intron is on exon1.stop + 1
+    # start of intron is on exon1.stop + 1 (exon1.stop in 0-based coordinates)
     # stop of intron is on exon2.start (since in GTF: e2.start = e2[3] - 1)
-    start_stop = [(e1.stop + 1, e2.start) for e1, e2 in zip(exons, exons[1:])]
+    start_stop = [(e1.stop, e2.start) for e1, e2 in zip(exons, exons[1:])]
 
     # For introns, keep only a subset of key-value pairs from column 8:
     col8 = _filter_col8(exons[0])
 
     ex1 = exons[0]
-    strand = ex1.strand
-    return [create_interval_from_list(ex1[:2] + ['intron', i[0], i[1], '.', strand, '.', col8]) for i in start_stop]
+    return [_GtfRecord(ex1.chrom, ex1.source, 'intron', start, stop, '.', ex1.strand, '.', col8)
+            for start, stop in start_stop]
 
 
 def _process_transcript_group(intervals):
@@ -732,14 +790,14 @@ def _process_transcript_group(intervals):
     Returns
     -------
     list
-        Modified list of pybedtools interval objects.
+        Modified list of records.
 
     """
     # Container for interval objects
     container = []
 
     # Get the interval describing whole transcript (make it if not present)
-    index = next((i for i in range(len(intervals)) if intervals[i][2] == 'transcript'), None)
+    index = next((i for i in range(len(intervals)) if intervals[i].type == 'transcript'), None)
     if index is not None:
         container.append(intervals.pop(index))
     else:
@@ -749,9 +807,9 @@ def _process_transcript_group(intervals):
 
         start = min([i.start for i in intervals])
         stop = max([i.stop for i in intervals])
-        container.append(create_interval_from_list(int1[:2] + ['transcript', start + 1, stop] + int1[5:8] + [col8]))
+        container.append(int1.replace(type='transcript', start=start, stop=stop, col8=col8))
 
-    exons = [i for i in intervals if i[2] == 'exon']
+    exons = [i for i in intervals if i.type == 'exon']
     assert exons
 
     # Sort exones by exom number (reverse if strand == '-'):
@@ -763,11 +821,11 @@ def _process_transcript_group(intervals):
     # Gaps between exons are introns. Apend introns to container container:
     container.extend(_get_introns(exons))
 
-    if not {'CDS', 'start_codon', 'stop_codon'} & {i[2] for i in intervals}:
+    if not {'CDS', 'start_codon', 'stop_codon'} & {i.type for i in intervals}:
         # If no CDS/stop_codon/start_codon transcript name should be ncRNA.
-        container.extend([create_interval_from_list(i[:2] + ['ncRNA'] + i[3:]) for i in intervals])
+        container.extend([i.replace(type='ncRNA') for i in intervals])
     else:
-        cdses = [i for i in intervals if i[2] == 'CDS']
+        cdses = [i for i in intervals if i.type == 'CDS']
         # check that all CDSs are within exons:
         for cds in cdses:
             assert any([_a_in_b(cds, exon) for exon in exons])
@@ -780,167 +838,188 @@ def _process_transcript_group(intervals):
     # check the consistency of container and make a report if check fails:
     try:
         _check_consistency(container)
-    except AssertionError as error:
-        print('X' * 80)
-        for i in sorted(intervals, key=lambda x: x.start):
-            print(i)
-        print('*' * 80)
-        for i in sorted(container, key=lambda x: x.start):
-            print(i)
-        raise error
+    except AssertionError:
+        LOGGER.error(
+            'Inconsistent segmentation of transcript.\nInput intervals:\n%s\nSegmentation:\n%s',
+            ''.join(str(i) for i in sorted(intervals, key=lambda x: x.start)),
+            ''.join(str(i) for i in sorted(container, key=lambda x: x.start)),
+        )
+        raise
 
     return container
 
 
-def _complement(gtf, genome_file, strand, type_name='intergenic'):
+def _process_gene(gene_content):
     """
-    Get the complement of intervals in gtf that have strand == `strand`.
+    Process group of intervals belonging to gene.
 
-    Required structure of genome_file: first column has to be chromosome
-    name and the second column has to be chromosome length. Files produced
-    with `samtools faidx` (*.fai file extension) respect this rule.
+    Process each transcript_group in gene_content, add 'biotype' attribute to
+    all intervals and return fields of all of them: intervals of transcripts
+    first and gene interval last.
+    """
+    assert 'gene' in gene_content
 
-    Possible options for strand param: '+', '-' and '.'.
+    for id_, transcript_group in gene_content.items():
+        if id_ == 'gene':
+            continue
+        gene_content[id_] = _process_transcript_group(transcript_group)
 
-    Parameters
-    ----------
-    gtf : str
-        Path to GTF file with content.
-    genome_file : str
-        Path to genome_file (*.fai or similar).
-    strand : string
-        Strand for which to compute complement.
+    # Add biotype attribute to all intervals:
+    gene_content = _add_biotype_attribute(gene_content)
 
-    Returns
-    -------
-    str
-        Absolute path to GTF file with complement segments.
+    fields = []
+    for id_, transcript_group in gene_content.items():
+        if id_ == 'gene':
+            continue
+        fields.extend(interval.fields for interval in transcript_group)
+    fields.append(gene_content['gene'].fields)
+    return fields
 
+
+def _process_genes(genes):
     """
-    assert(strand in ['+', '-', '.'])
-
-    # Filter the content file by strand
-    gtf_strand_only = BedTool(gtf).filter(lambda x: x.strand == strand).saveas()
-
-    # Sorted input is required for complement calculation:
-    gtf_sorted = gtf_strand_only.sort(faidx=genome_file).saveas()  # pylint: disable=unexpected-keyword-arg
-
-    # This step will fail if gtf_sorted has different set of chromosomes as they are defined in genome_file:
-    intergenic_bed = gtf_sorted.complement(g=genome_file).saveas()
-
-    # intergenic_bed is BED3 file. We need to make it GTF. Note the differences in BED and  GTF:
-    # https://pythonhosted.org/pybedtools/intervals.html#bed-is-0-based-others-are-1-based
-    # This effectively means:
-    # gtf_start = bed_start + 1
-    # gtf_stop = bed_stop
-    if strand == '+':
-        col8 = 'ID "interP%5.5d"; gene_id "."; transcript_id ".";'
-    elif strand == '-':
-        col8 = 'ID "interN%5.5d"; gene_id "."; transcript_id ".";'
-    else:
-        col8 = 'ID "interB%5.5d"; gene_id "."; transcript_id ".";'
-    gtf = BedTool(
-        create_interval_from_list([i[0], '.', type_name, str(int(i[1]) + 1), i[2], '.', strand, '.', col8 % n])
-        for n, i in enumerate(intergenic_bed)
-    ).saveas()
+    Process chunk of genes in worker process.
 
-    return os.path.abspath(gtf.fn)
+    Genes are given as records (which can be passed between processes) and
+    results are returned as fields of intervals.
+    """
+    return [_process_gene(gene_content) for gene_content in genes]
 
 
-def _get_gene_content(gtf, chromosomes, report_progress=False):
+def _segment_genes(genes, workers=1, chunk_size=1000):
     """
-    Give groups of intervals belonging to one gene (as generator).
+    Process genes and yield fields of intervals in each of them.
 
-    Yielded structure is a dictionary that has key-value pairs:
+    With more than one worker, genes are partitioned by chromosome in chunks
+    of ``chunk_size`` genes, which are processed by a pool of ``workers``
+    processes. Either way, tuples (gene_id, fields) are yielded in the order
+    of ``genes``, so segmentation does not depend on the number of workers.
+    """
+    if workers <= 1:
+        for gene_content in genes:
+            gene_id = gene_content['gene'].attrs['gene_id']
+            yield gene_id, _process_gene(gene_content)
+        return
+
+    with multiprocessing.Pool(processes=workers) as pool:
+        # Chromosome and ID of all genes in input order, chunks of genes
+        # that are not submitted yet and submitted chunks for each chromosome:
+        order, chunks, results = [], {}, {}
+        for gene_content in genes:
+            chrom = gene_content['gene'].chrom
+            order.append((chrom, gene_content['gene'].attrs['gene_id']))
+            chunk = chunks.setdefault(chrom, [])
+            chunk.append(gene_content)
+            if len(chunk) == chunk_size:
+                results.setdefault(chrom, []).append(pool.apply_async(_process_genes, (chunks.pop(chrom),)))
+        for chrom, chunk in chunks.items():
+            results.setdefault(chrom, []).append(pool.apply_async(_process_genes, (chunk,)))
+
+        # Genes of each chromosome are processed in order, merge them in input order:
+        processed = {
+            chrom: itertools.chain.from_iterable(result.get() for result in chrom_results)
+            for chrom, chrom_results in results.items()
+        }
+        for chrom, gene_id in order:
+            yield gene_id, next(processed[chrom])
+
+
+def _gene_digest(gene_content):
+    """Return hash of all intervals in (not yet processed) gene."""
+    digest = hashlib.sha256()
+    for id_, intervals in gene_content.items():
+        digest.update(id_.encode() + b'\0')
+        for interval in [intervals] if id_ == 'gene' else intervals:
+            digest.update(str(interval).encode())
+    return digest.hexdigest()
+
+
+def _segmentation_genes(table):
+    """Return indexes of records (in file order) of each gene in segmentation ``table``."""
+    order = numpy.argsort(table.gene_id, kind='stable')
+    codes, first = numpy.unique(table.gene_id[order], return_index=True)
+    genes = {}
+    for code, records in zip(codes.tolist(), numpy.split(order, first[1:])):
+        gene_id = table.tables['gene_id'][code]
+        # Intergenic intervals are not part of any gene:
+        if gene_id not in ('', '.'):
+            genes[gene_id] = records
+    return genes
+
+
+def _get_changed_genes(annotation, chromosomes, base_annotation, base_segmentation, report_progress=False,
+                       workers=1):
+    """
+    Find genes that changed since ``base_annotation`` and process only them.
 
-        * 'gene': interval if type gene
-        * 'transcript_id#1': intervals corresponding to transcript_id#1
-        * 'transcript_id#2': intervals corresponding to transcript_id#2
-        ...
+    Genes are compared by the hash of their intervals. Genes that are equal
+    in both annotations (and are in ``base_segmentation``) are taken from
+    ``base_segmentation``, the others are processed.
 
     Parameters
     ----------
-    gtf : str
-        Path to gtf input file.
+    annotation : str
+        Path to new GTF file.
     chromosomes : list
         List of chromosomes to consider.
+    base_annotation : str
+        Path to GTF file from which ``base_segmentation`` was made.
+    base_segmentation : str
+        Path to segmentation made from ``base_annotation``.
     report_progress : bool
         Show progress.
+    workers : int
+        Number of worker processes used to process changed genes.
 
     Returns
     -------
-    dict
-        All intervals in gene, separated by transcript_id.
+    tuple
+        List of IDs of changed genes and generator of (gene_id, fields) of
+        all genes in ``annotation``, in the same order as ``_segment_genes``.
 
     """
-    # Lists to keep track of all already processed genes/transcripts:
-    gene_ids = []
-    transcript_ids = []
-
-    current_transcript = None
-    current_gene = None
-    gene_content = {}
-
-    def finalize(gene_content):
-        """Procedure before returning group of intervals belonging to one gene."""
-        if 'gene' not in gene_content:
-            # Manually create "gene interval":
-            int1 = next(iter(gene_content.values()))[0]
-            col8 = _filter_col8(int1)
-            start = min([i.start for j in gene_content.values() for i in j])
-            stop = max([i.stop for j in gene_content.values() for i in j])
-            gene_content['gene'] = create_interval_from_list(int1[:2] + ['gene', start + 1, stop] + int1[5:8] + [col8])
-        return gene_content
-
-    length = BedTool(gtf).count()
-    progress, j = 0, 0
-    for interval in BedTool(gtf):
-        j += 1
-        if report_progress:
-            new_progress = j / length
-            progress = iCount._log_progress(new_progress, progress, LOGGER)  # pylint: disable=protected-access
-
-        if interval.chrom in chromosomes:
-            # Segments without 'transcript_id' attributes are the ones that
-            # define genes. such intervals are not in all releases.
-            if interval.attrs['gene_id'] == current_gene:
-                if interval.attrs['transcript_id'] == current_transcript:
-                    # Same gene, same transcript: just add to container:
-                    gene_content[current_transcript].append(interval)
-                else:
-                    # New transcript - confirm that it is really a new one:
-                    current_transcript = interval.attrs['transcript_id']
-                    assert current_transcript not in transcript_ids
-                    transcript_ids.append(current_transcript)
-                    gene_content[current_transcript] = [interval]
-
-            else:  # New gene!
-                # First process old content:
-                if gene_content:  # To survive the first iteration
-                    yield finalize(gene_content)
-
-                # Confirm that it is really new gene!
-                current_gene = interval.attrs['gene_id']
-                assert current_gene not in gene_ids
-                gene_ids.append(current_gene)
-
-                # Make empty container and classify interval
-                gene_content = {}
-                if interval[2] == 'gene':
-                    gene_content['gene'] = interval
-                elif 'transcript_id' in interval.attrs:
-                    current_transcript = interval.attrs['transcript_id']
-                    assert current_transcript not in transcript_ids
-                    transcript_ids.append(current_transcript)
-                    gene_content[current_transcript] = [interval]
-                else:
-                    raise Exception("First element in gene content is neither gene or transcript!")
-
-    # for the last iteration:
-    yield finalize(gene_content)
-
-
-def get_segments(annotation, segmentation, fai, report_progress=False):
+    table = _load_segmentation(base_segmentation)
+    base_genes = _segmentation_genes(table)
+    base_digests = {
+        gene_content['gene'].attrs['gene_id']: _gene_digest(gene_content)
+        for gene_content in _get_gene_content(base_annotation, chromosomes)
+    }
+
+    order, changed = [], {}
+    for gene_content in _get_gene_content(annotation, chromosomes, report_progress):
+        gene_id = gene_content['gene'].attrs['gene_id']
+        kept = gene_id in base_genes and base_digests.get(gene_id) == _gene_digest(gene_content)
+        order.append((gene_id, kept))
+        if not kept:
+            changed[gene_id] = None
+
+    def genes():
+        """Yield (gene_id, fields) of all genes, processing the changed ones."""
+        processed = _segment_genes(
+            (gene_content for gene_content in _get_gene_content(annotation, chromosomes)
+             if gene_content['gene'].attrs['gene_id'] in changed),
+            workers=workers,
+        )
+        for gene_id, kept in order:
+            if kept:
+                yield gene_id, [table.line(index).split('\t') for index in base_genes[gene_id].tolist()]
+            else:
+                processed_id, fields = next(processed)
+                assert processed_id == gene_id
+                yield gene_id, fields
+
+    return list(changed), genes()
+
+
+def _segment_outputs(segmentation):
+    """Return paths to all files made by ``get_segments`` for ``segmentation``."""
+    out_dir = os.path.dirname(segmentation)
+    return [segmentation, segmentation + COMPILED_EXTENSION] + [
+        os.path.join(out_dir, fname) for fname in [REGIONS_FILE, TEMPLATE_TYPE, TEMPLATE_SUBTYPE, TEMPLATE_GENE]]
+
+
+def get_segments(annotation, segmentation, fai, report_progress=False, workers=1, cache=False, cache_dir=None,
+                 base_annotation=None, base_segmentation=None):
     """
     Create GTF file with transcript level segmentation.
 
@@ -959,6 +1038,21 @@ def get_segments(annotation, segmentation, fai, report_progress=False):
     of theese names. Only consider GTF entries of chromosomes given in
     fai file.
 
+    Genes are written to segmentation as they are processed, so memory usage
+    does not grow with the size of annotation. Annotation does not need to be
+    sorted, but sorted annotation is processed without external sorting.
+
+    Next to segmentation, its compiled (binary) version is stored in file
+    with ``COMPILED_EXTENSION`` appended. Analyses that use segmentation
+    memory-map this file instead of parsing GTF, as long as segmentation
+    content does not change.
+
+    If ``base_annotation`` is given, segmentation is updated incrementally:
+    only genes that differ from the ones in ``base_annotation`` are
+    processed, all others are taken from its segmentation. Intergenic
+    intervals and regions are made again from the updated segmentation.
+    Result is the same as if all genes were processed.
+
     Parameters
     ----------
     annotation : str
@@ -969,6 +1063,22 @@ def get_segments(annotation, segmentation, fai, report_progress=False):
         Path to input genome_file (.fai or similar).
     report_progress : bool
         Show progress.
+    workers : int
+        Number of worker processes used to process genes. Genes are
+        partitioned by chromosome and result does not depend on the number
+        of workers.
+    cache : bool
+        Use cached outputs of previous call with the same annotation, genome
+        file and iCount version, if they exist. Otherwise, outputs are
+        computed and stored in cache.
+    cache_dir : str
+        Directory with cached outputs. By default, folder ``segment_cache``
+        in iCount temporary folder (``ICOUNT_TMP_ROOT``) is used.
+    base_annotation : str
+        Path to GTF file, from which ``base_segmentation`` was made.
+    base_segmentation : str
+        Path to segmentation made from ``base_annotation`` (by this
+        function). By default, ``segmentation`` is updated in place.
 
     Returns
     -------
@@ -978,128 +1088,56 @@ def get_segments(annotation, segmentation, fai, report_progress=False):
     """
     iCount.log_inputs(LOGGER, level=logging.INFO)
     metrics = iCount.Metrics()
-    metrics.genes = 0
-
-    # Container for storing intermediate data
-    data = []
-
-    LOGGER.debug('Opening genome file: %s', fai)
-    fai = _first_two_columns(fai)
-    with open(fai) as gfile:
-        chromosomes = [line.strip().split()[0] for line in gfile]
-
-    def process_gene(gene_content):
-        """
-        Process each group of intervals belonging to gene.
-
-        Process each transcript_group in gene_content, add 'biotype'
-        attribute to all intervals and include them in `data`.
-        """
-        assert 'gene' in gene_content
+    if base_annotation and base_segmentation is None:
+        base_segmentation = segmentation
 
-        for id_, transcript_group in gene_content.items():
-            if id_ == 'gene':
-                continue
-            gene_content[id_] = _process_transcript_group(transcript_group)
+    if cache:
+        # Outputs are hard-linked to cached files, so they should not be modified in place.
+        def compute(cached):
+            """Make outputs of segmentation stored in cache."""
+            return get_segments(annotation, cached, fai, report_progress=report_progress, workers=workers,
+                                base_annotation=base_annotation, base_segmentation=base_segmentation)
 
-        # Add biotype attribute to all intervals:
-        gene_content = _add_biotype_attribute(gene_content)
+        cached_metrics = _get_cached_segments(annotation, fai, segmentation, compute, _segment_outputs, cache_dir)
+        for name, value in cached_metrics.items():
+            setattr(metrics, name, value)
+        return metrics
 
-        for id_, transcript_group in gene_content.items():
-            if id_ == 'gene':
-                continue
-            data.extend(transcript_group)
-        data.append(gene_content['gene'])
+    LOGGER.debug('Opening genome file: %s', fai)
+    chromosomes = _read_chromosome_lengths(fai)
 
     LOGGER.debug('Processing genome annotation from: %s', annotation)
-    for gene_content in _get_gene_content(annotation, chromosomes, report_progress):
-        process_gene(gene_content)
-        LOGGER.debug('Just processed gene: %s', gene_content['gene'].attrs['gene_id'])
-        metrics.genes += 1
+    if base_annotation:
+        # Base segmentation is read before outputs (possibly the same file) are written:
+        changed, segmented_genes = _get_changed_genes(
+            annotation, [chrom for chrom, _ in chromosomes], base_annotation, base_segmentation,
+            report_progress=report_progress, workers=workers)
+        LOGGER.info('Processing %d genes that changed since %s', len(changed), base_annotation)
+        metrics.genes_changed = len(changed)
+    else:
+        genes = _get_gene_content(annotation, [chrom for chrom, _ in chromosomes], report_progress)
+        segmented_genes = _segment_genes(genes, workers=workers)
 
-    # Produce GTF/GFF file from data:
-    gtf = BedTool(i.fields for i in data).saveas()
+    # Outputs may be hard-linked to cached files, writing them must not change the cache:
+    for fname in _segment_outputs(segmentation):
+        if os.path.isfile(fname) and os.stat(fname).st_nlink > 1:
+            os.remove(fname)
 
-    LOGGER.info('Calculating intergenic intervals...')
-    intergenic_pos = _complement(gtf.fn, fai, '+')
-    intergenic_neg = _complement(gtf.fn, fai, '-')
+    metrics.genes = 0
+    with _SegmentationWriter() as writer:
+        # Genes are written as they are processed:
+        for gene_id, fields in segmented_genes:
+            writer.add(fields)
+            LOGGER.debug('Just processed gene: %s', gene_id)
+            metrics.genes += 1
 
-    # Join the gtf, intergenic_pos and intergenic_neg in one file:
-    file2 = tempfile.NamedTemporaryFile(delete=False)
-    for infile in [gtf.fn, intergenic_pos, intergenic_neg]:
-        shutil.copyfileobj(open(infile, 'rb'), file2)
-    file2.close()
+        LOGGER.info('Adding intergenic intervals...')
+        writer.write(segmentation, chromosomes)
+    LOGGER.info('Segmentation stored in %s', segmentation)
 
-    file3 = BedTool(file2.name).sort().saveas(segmentation)
-    LOGGER.info('Segmentation stored in %s', file3.fn)
+    LOGGER.info('Compiling segmentation...')
+    _compile_segmentation(segmentation)
 
     LOGGER.info('Making also gene level segmentation...')
     make_regions(segmentation, out_dir=os.path.dirname(segmentation))
     return metrics
-
-
-def _prepare_segmentation(seg_file, chrom, strand=None):
-    """
-    Parse segmentation file to hierarchical structure.
-
-    Utility function to transformn segmentation file to the following
-    hierarchical structure::
-
-        segmentation = {
-            gene_id#1: {
-                'gene_segment': gene_segment,
-                transcript_id#1: [transcript, exon1, intron1, exon2, ...],
-                transcript_id#2: [transcript, exon1, intron1, exon2, ...],
-                ...
-            },
-            gene_id#2: {},
-            ...
-        }
-
-    Note that intergenic segments have multiple roles: the same intergenic
-    segment has the role of gene, transcript and sub-transcript segment. This
-    eases the treatment of intergenic intervals in algorithms that use this
-    function (rnamaps, xlsites, ...)
-
-    Parameters
-    ----------
-    seg_file : str
-        Path to GTF file, produces by ``get_segments`` function.
-
-    Returns
-    -------
-    dict
-        Segmentation, wrapped in dict with chrom-strand/gene/transcript levels of
-        depth.
-
-    """
-    segmentation = {}
-
-    for segment in BedTool(seg_file):
-        if segment.chrom != chrom:
-            continue
-        if strand and segment.strand != strand:
-            continue
-
-        if segment[2] == 'gene':
-            segmentation.setdefault(segment.attrs['gene_id'], {}). \
-                setdefault('gene_segment', segment)
-
-        elif segment[2] == 'intergenic':
-            # Make artificial_id from chromosome, strand and start:
-            fake_gid = 'G_{}_{}_{}'.format(segment.chrom, segment.strand, segment.start)
-            fake_tid = 'T_{}_{}_{}'.format(segment.chrom, segment.strand, segment.start)
-            segmentation.setdefault(fake_gid, {})['gene_segment'] = segment
-            segmentation[fake_gid][fake_tid] = [segment]
-
-        elif segment[2] == 'transcript':
-            segmentation.setdefault(segment.attrs['gene_id'], {}). \
-                setdefault(segment.attrs['transcript_id'], []). \
-                insert(0, segment)  # Ensure that transcript segment is the first one in list.
-
-        else:  # normal segment
-            segmentation.setdefault(segment.attrs['gene_id'], {}). \
-                setdefault(segment.attrs['transcript_id'], []). \
-                append(segment)
-
-    return segmentation
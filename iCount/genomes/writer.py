@@ -0,0 +1,245 @@
+""".. Line to protect from pydocstyle D205, D400.
+
+Writing segmentation
+--------------------
+
+Write segmented genes, sorted and together with intergenic intervals.
+"""
+import heapq
+import itertools
+import logging
+import os
+
+from pybedtools import BedTool, create_interval_from_list
+
+import iCount
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _add_span(spans, start, stop):
+    """Add interval to the union of intervals in ``spans``, intervals must be added sorted by start."""
+    if spans and start <= spans[-1][1]:
+        spans[-1][1] = max(spans[-1][1], stop)
+    else:
+        spans.append([start, stop])
+
+
+def _gaps(spans, length):
+    """Yield (start, stop) of gaps between (possibly overlapping) spans in chromosome of given length."""
+    covered = 0
+    for start, stop in sorted(spans):
+        if start > covered:
+            yield covered, start
+        covered = max(covered, stop)
+    if covered < length:
+        yield covered, length
+
+
+def _intergenic_fields(chrom, start, stop, strand, number, type_name='intergenic'):
+    """Make fields of intergenic interval, ``start`` is 0-based."""
+    prefix = {'+': 'P', '-': 'N'}.get(strand, 'B')
+    col8 = 'ID "inter{}{:05d}"; gene_id "."; transcript_id ".";'.format(prefix, number)
+    return [chrom, '.', type_name, str(start + 1), str(stop), '.', strand, '.', col8]
+
+
+def _read_chromosome_lengths(genome_file):
+    """Read chromosome names and lengths (first two columns) from genome_file, in file order."""
+    with open(genome_file, encoding='utf-8') as gfile:
+        return [(cols[0], int(cols[1])) for cols in (line.split() for line in gfile) if cols]
+
+
+def _complement(gtf, genome_file, strand, type_name='intergenic'):
+    """
+    Get the complement of intervals in gtf that have strand == `strand`.
+
+    Required structure of genome_file: first column has to be chromosome
+    name and the second column has to be chromosome length. Files produced
+    with `samtools faidx` (*.fai file extension) respect this rule.
+
+    Possible options for strand param: '+', '-' and '.'.
+
+    Parameters
+    ----------
+    gtf : str
+        Path to GTF file with content.
+    genome_file : str
+        Path to genome_file (*.fai or similar).
+    strand : string
+        Strand for which to compute complement.
+
+    Returns
+    -------
+    str
+        Absolute path to GTF file with complement segments.
+
+    """
+    assert(strand in ['+', '-', '.'])
+
+    spans = {}
+    for interval in BedTool(gtf):
+        if interval.strand == strand:
+            spans.setdefault(interval.chrom, []).append((interval.start, interval.stop))
+
+    # Complement is reported in the order of chromosomes in genome_file:
+    intervals = []
+    for chrom, length in _read_chromosome_lengths(genome_file):
+        for start, stop in _gaps(spans.get(chrom, []), length):
+            intervals.append(_intergenic_fields(chrom, start, stop, strand, len(intervals), type_name=type_name))
+    gtf = BedTool(create_interval_from_list(fields) for fields in intervals).saveas()
+
+    return os.path.abspath(gtf.fn)
+
+
+class _SegmentationWriter:
+    """
+    Write segmentation sorted by chromosome and start, together with intergenic intervals.
+
+    Genes are added one by one, as fields of their intervals. As long as genes
+    of each chromosome come contiguously and sorted by start (as in ENSEMBL and
+    GENCODE annotations), intervals are written to one temporary run per
+    chromosome: only intervals of genes that overlap the last added gene are
+    kept in memory. On the first gene that breaks this order, writer switches
+    to external merge sort: intervals are buffered and spilled as sorted runs
+    of ``buffer_size`` intervals, which are merged when writing the output.
+
+    Union of intervals on each strand is swept while runs are written, so
+    intergenic intervals (gaps between them) are known without another pass.
+    Output is sorted by chromosome name and start, intervals with equal
+    start are kept in the order genes were added and intergenic intervals
+    ('+' strand first) come last.
+    """
+
+    def __init__(self, buffer_size=2 ** 18, tmp_dir=None):
+        """Initialize writer."""
+        self.buffer_size = buffer_size
+        self.tmp_dir = tmp_dir
+        self.sorted = True
+        # Runs of each chromosome as [file name, {strand: spans}] and open runs:
+        self.runs = {}
+        self._open = {}
+        # Buffered intervals of each chromosome, heaps of (start, number, fields):
+        self._buffers = {}
+        self._buffered = 0
+        self._number = 0
+        self._chrom = None
+        self._watermark = 0
+
+    def __enter__(self):
+        """Enter context."""
+        return self
+
+    def __exit__(self, *args):
+        """Remove temporary runs."""
+        self._close_runs()
+        for run in itertools.chain.from_iterable(self.runs.values()):
+            if os.path.isfile(run[0]):
+                os.remove(run[0])
+        self.runs = {}
+
+    def add(self, fields):
+        """Add fields of all intervals in gene."""
+        chrom = fields[0][0]
+        entries = [(int(fields_[3]) - 1, self._number + i, fields_) for i, fields_ in enumerate(fields)]
+        self._number += len(entries)
+        first = min(entries)[0]
+
+        if self.sorted:
+            if chrom != self._chrom and chrom not in self.runs and chrom not in self._buffers:
+                # New chromosome: write all intervals of the previous one.
+                self._spill()
+                self._chrom = chrom
+            elif chrom != self._chrom or first < self._watermark:
+                # Intervals before watermark are already written, this run can not be continued:
+                LOGGER.info('Annotation is not sorted, switching to external sort.')
+                self.sorted = False
+                self._close_runs()
+            self._watermark = first
+
+        buffer = self._buffers.setdefault(chrom, [])
+        for entry in entries:
+            heapq.heappush(buffer, entry)
+        self._buffered += len(entries)
+
+        if self.sorted:
+            # Intervals of genes that follow can not start before this gene:
+            self._write(chrom, first)
+        elif self._buffered >= self.buffer_size:
+            self._spill()
+            self._close_runs()
+
+    def _write(self, chrom, up_to=None):
+        """Write buffered intervals of chromosome that start at or before ``up_to`` to its open run."""
+        buffer = self._buffers[chrom]
+        if chrom not in self._open:
+            run = [iCount.files.get_temp_file_name(tmp_dir=self.tmp_dir, extension='gtf'), {}]
+            self.runs.setdefault(chrom, []).append(run)
+            self._open[chrom] = (open(run[0], 'wt', encoding='utf-8'), run[1])
+        handle, spans = self._open[chrom]
+
+        while buffer and (up_to is None or buffer[0][0] <= up_to):
+            start, _, fields = heapq.heappop(buffer)
+            self._buffered -= 1
+            _add_span(spans.setdefault(fields[6], []), start, int(fields[4]))
+            handle.write('\t'.join(fields) + '\n')
+
+        if not buffer:
+            del self._buffers[chrom]
+
+    def _spill(self):
+        """Write all buffered intervals."""
+        for chrom in sorted(self._buffers):
+            self._write(chrom)
+
+    def _close_runs(self):
+        """Close open runs, further intervals are written to new runs."""
+        for handle, _ in self._open.values():
+            handle.close()
+        self._open = {}
+
+    def _read_run(self, fname):
+        """Yield (start, line) of intervals in run."""
+        with open(fname, 'rt', encoding='utf-8') as handle:
+            for line in handle:
+                yield int(line.split('\t', 4)[3]) - 1, line
+
+    def write(self, fname, chromosomes):
+        """
+        Write segmentation to file.
+
+        Parameters
+        ----------
+        fname : str
+            Path to output GTF file.
+        chromosomes : list
+            Chromosome names and lengths (in the order of genome file).
+
+        Returns
+        -------
+        None
+
+        """
+        self._spill()
+        self._close_runs()
+
+        # Intergenic intervals are numbered in the order of chromosomes in genome file:
+        gaps, numbers = {}, {'+': 0, '-': 0}
+        for chrom, length in chromosomes:
+            for strand in ['+', '-']:
+                spans = [span for run in self.runs.get(chrom, []) for span in run[1].get(strand, [])]
+                gaps[(chrom, strand)] = (numbers[strand], list(_gaps(spans, length)))
+                numbers[strand] += len(gaps[(chrom, strand)][1])
+
+        def intergenic(chrom, strand):
+            """Yield (start, line) of intergenic intervals."""
+            first, chrom_gaps = gaps[(chrom, strand)]
+            for number, (start, stop) in enumerate(chrom_gaps, start=first):
+                yield start, '\t'.join(_intergenic_fields(chrom, start, stop, strand, number)) + '\n'
+
+        with iCount.files.gz_open(fname, 'wt') as handle:
+            for chrom in sorted(chrom for chrom, _ in chromosomes):
+                streams = [self._read_run(run[0]) for run in self.runs.get(chrom, [])]
+                streams.extend([intergenic(chrom, '+'), intergenic(chrom, '-')])
+                # Merge is stable: on equal start, streams that are given first come first.
+                for _, line in heapq.merge(*streams, key=lambda item: item[0]):
+                    handle.write(line)
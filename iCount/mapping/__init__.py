@@ -17,7 +17,9 @@ Mapping
 
 """
 
+from . import barcodes
 from . import filters
+from . import hits
 from . import mapstar
 from . import indexstar
 from . import xlsites
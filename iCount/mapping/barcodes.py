@@ -0,0 +1,332 @@
+""".. Line to protect from pydocstyle D205, D400.
+
+Random barcodes
+---------------
+
+Compare and merge random barcodes (randomers) of reads.
+
+Barcodes are packed to integers, using two bits per nucleotide, so that
+mismatches between a barcode and many other barcodes are counted with a few
+vectorised bitwise operations (``_count_mismatches_batch``). Barcodes without
+``N`` wildcards can also be looked up by code in the Hamming neighbourhood of
+a barcode (``_hamming_neighbourhood``).
+"""
+import functools
+import itertools
+import collections
+
+import numpy
+
+
+NUCLEOTIDE_CODES = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+# Longest barcode that can be packed in 64 bits and lower bits of all 2-bit groups:
+MAX_PACKED_LENGTH = 32
+LOW_BITS = int('01' * MAX_PACKED_LENGTH, 2)
+# Number of set bits in each byte:
+POPCOUNT_TABLE = numpy.array([bin(i).count('1') for i in range(256)], dtype=numpy.int64)
+
+
+def _match(seq1, seq2, mismatches):
+    """
+    Test if sequence seq1 and seq2 are sufficiently similar.
+
+    Parameters
+    ----------
+    seq1 : str
+        First sequence.
+    seq2 : str
+        Second sequence.
+    mismatches : int
+        Number of allowed mismatches between given sequences.
+
+    Returns
+    -------
+    bool
+        Do sequence `seq1` and `seq2` have less or equal than ``mismatches``
+
+    """
+    packed1, packed2 = _pack_barcode(seq1), _pack_barcode(seq2)
+    if packed1 is None or packed2 is None:
+        seq1, seq2 = seq1.upper(), seq2.upper()
+        matches = sum([(nuc1 == 'N' or nuc2 == 'N' or nuc1 == nuc2) for nuc1, nuc2 in zip(seq1, seq2)])
+        return max(len(seq1), len(seq2)) - matches <= mismatches
+    return _count_mismatches(packed1, packed2) <= mismatches
+
+
+@functools.lru_cache(maxsize=2 ** 16)
+def _pack_barcode(barcode):
+    """
+    Pack barcode to integer code and mask, using two bits per nucleotide.
+
+    Nucleotide on position ``i`` is stored in bits ``2i`` and ``2i + 1`` of
+    code. Mask has both bits set for ``A``, ``C``, ``G`` and ``T`` and none
+    for ``N``, so that ``N`` matches any nucleotide. Letter case is ignored.
+
+    Parameters
+    ----------
+    barcode : str
+        Barcode sequence.
+
+    Returns
+    -------
+    tuple
+        Code, mask and length of barcode or None if barcode contains
+        characters other than ``A``, ``C``, ``G``, ``T`` and ``N``.
+
+    """
+    code = mask = 0
+    for pos, nuc in enumerate(barcode.upper()):
+        if nuc == 'N':
+            continue
+        nuc_code = NUCLEOTIDE_CODES.get(nuc)
+        if nuc_code is None:
+            return None
+        code |= nuc_code << (2 * pos)
+        mask |= 3 << (2 * pos)
+    return code, mask, len(barcode)
+
+
+def _count_mismatches(packed1, packed2):
+    """
+    Count mismatches between two packed barcodes.
+
+    Positions where barcodes differ are obtained with XOR of codes, restricted
+    to positions defined in both barcodes. Each differing 2-bit group is folded
+    to its lower bit and set bits are counted. Positions that are present only
+    in the longer barcode are all counted as mismatches, as in ``_match``.
+    """
+    code1, mask1, length1 = packed1
+    code2, mask2, length2 = packed2
+    diff = (code1 ^ code2) & mask1 & mask2
+    diff = (diff | (diff >> 1)) & (mask1 & mask2) // 3
+    return bin(diff).count('1') + abs(length1 - length2)
+
+
+def _pack_barcodes(barcodes):
+    """
+    Pack barcodes to arrays of codes, masks and lengths.
+
+    Parameters
+    ----------
+    barcodes : list_str
+        Barcode sequences.
+
+    Returns
+    -------
+    tuple
+        Arrays of codes, masks (both ``numpy.uint64``) and lengths or None if
+        any of barcodes can not be packed or is longer than
+        ``MAX_PACKED_LENGTH``.
+
+    """
+    packed = [_pack_barcode(barcode) for barcode in barcodes]
+    if any(item is None or item[2] > MAX_PACKED_LENGTH for item in packed):
+        return None
+    codes = numpy.array([item[0] for item in packed], dtype=numpy.uint64)
+    masks = numpy.array([item[1] for item in packed], dtype=numpy.uint64)
+    lengths = numpy.array([item[2] for item in packed], dtype=numpy.int64)
+    return codes, masks, lengths
+
+
+def _count_mismatches_batch(barcode, packed_barcodes):
+    """
+    Count mismatches between ``barcode`` and each of packed barcodes.
+
+    This is the vectorised version of ``_count_mismatches``.
+
+    Parameters
+    ----------
+    barcode : str
+        Barcode sequence, not longer than ``MAX_PACKED_LENGTH``.
+    packed_barcodes : tuple
+        Barcodes, packed with ``_pack_barcodes``.
+
+    Returns
+    -------
+    numpy.ndarray
+        Number of mismatches for each of packed barcodes.
+
+    """
+    code, mask, length = _pack_barcode(barcode)
+    codes, masks, lengths = packed_barcodes
+    diff = (codes ^ numpy.uint64(code)) & masks & numpy.uint64(mask)
+    diff = (diff | (diff >> numpy.uint64(1))) & numpy.uint64(LOW_BITS)
+    # Positions after the end of shorter barcode are not set in either mask.
+    counts = POPCOUNT_TABLE[diff.view(numpy.uint8)].reshape(-1, 8).sum(axis=1)
+    return counts + numpy.abs(lengths - length)
+
+
+def _match_batch(barcode, packed_barcodes, mismatches):
+    """
+    Test which of packed barcodes are sufficiently similar to ``barcode``.
+
+    This is the vectorised version of ``_match``.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean array, True for barcodes with at most ``mismatches`` mismatches.
+
+    """
+    return _count_mismatches_batch(barcode, packed_barcodes) <= mismatches
+
+
+def _find_matches(barcode, barcodes, packed_barcodes, selected, mismatches):
+    """
+    Return indexes of selected barcodes that are similar to ``barcode``.
+
+    Barcodes are compared in a single vectorised call if they are packed and
+    one by one with ``_match`` otherwise.
+
+    Parameters
+    ----------
+    barcode : str
+        Barcode sequence.
+    barcodes : list_str
+        Barcode sequences to compare with.
+    packed_barcodes : tuple
+        The same barcodes, packed with ``_pack_barcodes`` or None.
+    selected : numpy.ndarray
+        Boolean array, only barcodes marked with True are compared.
+    mismatches : int
+        Number of allowed mismatches.
+
+    Returns
+    -------
+    list
+        Indexes of matching barcodes in increasing order.
+
+    """
+    if packed_barcodes is None:
+        return [i for i in numpy.flatnonzero(selected) if _match(barcode, barcodes[i], mismatches)]
+    return numpy.flatnonzero(selected & _match_batch(barcode, packed_barcodes, mismatches)).tolist()
+
+
+def _barcode_codes(barcodes):
+    """
+    Return codes of barcodes (from ``_pack_barcode``) that can be indexed by code.
+
+    Only barcodes without ``N`` wildcards have all their neighbours in
+    ``_hamming_neighbourhood``. Since letter case is ignored, barcodes that
+    differ only in case share the same code: such barcodes can not be told
+    apart by code either. For all other barcodes None is returned.
+    """
+    codes = []
+    for barcode in barcodes:
+        packed = _pack_barcode(barcode)
+        codes.append(packed[0] if packed is not None and packed[1] == 4 ** len(barcode) - 1 else None)
+    shared = {code for code, count in collections.Counter(codes).items() if count > 1}
+    return [None if code in shared else code for code in codes]
+
+
+def _neighbourhood_size(length, mismatches):
+    """Return the number of barcodes that differ from given one in 1 to ``mismatches`` positions."""
+    size, combinations = 0, 1
+    for dist in range(1, min(mismatches, length) + 1):
+        combinations = combinations * (length - dist + 1) // dist
+        size += combinations * 3 ** dist
+    return size
+
+
+def _hamming_neighbourhood(code, length, mismatches):
+    """
+    Yield codes of barcodes that differ from ``code`` in 1 to ``mismatches`` positions.
+
+    Each of the three alternative nucleotides on a position is obtained by
+    XOR-ing the two bits of that position with 1, 2 or 3.
+    """
+    for dist in range(1, min(mismatches, length) + 1):
+        for positions in itertools.combinations(range(length), dist):
+            for changes in itertools.product((1, 2, 3), repeat=dist):
+                neighbour = code
+                for pos, change in zip(positions, changes):
+                    neighbour ^= change << (2 * pos)
+                yield neighbour
+
+
+def _merge_weak_randomers(by_bc, mismatches, min_hit_count):
+    """
+    Merge randomers with less than ``min_hit_count`` hits to similar ones.
+
+    Barcodes are visited by decreasing number of hits (and decreasing barcode
+    on ties). Each barcode absorbs all weak (less than ``min_hit_count`` hits)
+    similar barcodes that come after it in this order. Since absorbing
+    barcode gets more hits and moves forward in the order, this is repeated
+    until no more weak similar barcodes come after it. Barcodes that are
+    already visited can never absorb any other barcode again, so each barcode
+    needs to be visited only once.
+
+    Weak barcodes are indexed by their integer code (``_barcode_codes``).
+    Similar barcodes are found by looking up all barcodes in Hamming
+    neighbourhood of given barcode or by comparing to all weak barcodes in a
+    single vectorised call (``_find_matches``), whichever is cheaper. Both
+    use the same packing of barcodes (``_pack_barcode``). Barcodes that can
+    not be indexed by code (or barcodes of unequal lengths) are always found
+    with ``_find_matches``.
+
+    Parameters
+    ----------
+    by_bc : dict
+        Dictionary of barcodes and their hits.
+    mismatches : int
+        Number of allowed mismatches between barcodes.
+    min_hit_count : int
+        Barcodes with at least this many hits are never merged to other ones.
+
+    Returns
+    -------
+    None
+        None, since input `by_bc` is modified in-place.
+
+    """
+    order_bcs = sorted([(len(hits), bc) for bc, hits in by_bc.items()], reverse=True)
+    barcodes = [bc for _, bc in order_bcs]
+    index = {bc: i for i, bc in enumerate(barcodes)}
+    packed_barcodes = _pack_barcodes(barcodes)
+
+    lengths = {len(bc) for bc in barcodes}
+    length = lengths.pop() if len(lengths) == 1 else None
+    if length is not None:
+        codes = _barcode_codes(barcodes)
+        neighbourhood_size = _neighbourhood_size(length, mismatches)
+    else:
+        codes = [None] * len(barcodes)
+        neighbourhood_size = 0
+    not_encoded = numpy.array([code is None for code in codes], dtype=bool)
+
+    # Weak barcodes: encoded ones are also indexed by code.
+    weak = numpy.array([nhits < min_hit_count for nhits, _ in order_bcs], dtype=bool)
+    weak_by_code = {codes[i]: i for i in numpy.flatnonzero(weak & ~not_encoded)}
+    weak_count = int(weak.sum())
+
+    for i, barcode in enumerate(barcodes):
+        if barcode not in by_bc:
+            # Already merged to another barcode.
+            continue
+
+        while weak_count:
+            if codes[i] is None or weak_count <= neighbourhood_size:
+                candidates = _find_matches(barcode, barcodes, packed_barcodes, weak, mismatches)
+            else:
+                candidates = [weak_by_code[neighbour] for neighbour in
+                              _hamming_neighbourhood(codes[i], length, mismatches) if neighbour in weak_by_code]
+                candidates.extend(_find_matches(barcode, barcodes, packed_barcodes, weak & not_encoded, mismatches))
+
+            # Only barcodes that come after current one are merged to it.
+            key = (len(by_bc[barcode]), barcode)
+            similar = sorted([(len(by_bc[barcodes[j]]), barcodes[j]) for j in candidates
+                              if j != i and (len(by_bc[barcodes[j]]), barcodes[j]) < key], reverse=True)
+            if not similar:
+                break
+
+            for _, barcode2 in similar:
+                by_bc[barcode].extend(by_bc.pop(barcode2))
+                j = index[barcode2]
+                weak[j] = False
+                weak_count -= 1
+                weak_by_code.pop(codes[j], None)
+
+            if weak[i] and len(by_bc[barcode]) >= min_hit_count:
+                weak[i] = False
+                weak_count -= 1
+                weak_by_code.pop(codes[i], None)
@@ -0,0 +1,195 @@
+""".. Line to protect from pydocstyle D205, D400.
+
+Hits
+----
+
+Store hits (used reads) in columns and count cDNA and reads in cross-link sites
+from them.
+"""
+import array
+
+import numpy
+
+
+# Columns of hits in _Hits store:
+XLINK_POS, BARCODE, MIDDLE_POS, END_POS, READ_LEN, NUM_MAPPED, SECOND_START = range(7)
+HIT_COLUMNS = 7
+
+
+class _Hits:
+    """
+    Columnar store of hits (used reads) on one strand of a chromosome.
+
+    Each hit is stored as seven 64-bit integers: cross-link position,
+    barcode, middle position, end position, read length, number of mapped
+    positions and second start (see ``XLINK_POS``, ``BARCODE``, ...). Barcode
+    is stored as index in ``barcodes``, list of barcodes that is shared by all
+    stores of the same chromosome. This takes 56 bytes per hit instead of the
+    tuple in dict of dicts of lists (more than 200 bytes per hit).
+
+    Hits are appended to ``array.array`` and are exposed as two-dimensional
+    NumPy array with one row per hit.
+    """
+
+    def __init__(self, barcodes, rows=None):
+        """Initialize attributes."""
+        self.barcodes = barcodes
+        self._data = array.array('q')
+        if rows is not None:
+            self._data.frombytes(numpy.ascontiguousarray(rows, dtype=numpy.int64).tobytes())
+
+    def __len__(self):
+        """Return number of hits."""
+        return len(self._data) // HIT_COLUMNS
+
+    def append(self, xlink_pos, barcode, read_data):
+        """Append hit with ``read_data`` = (middle_pos, end_pos, read_len, num_mapped, second_start)."""
+        self._data.append(xlink_pos)
+        self._data.append(barcode)
+        self._data.extend(read_data)
+
+    @property
+    def rows(self):
+        """Return hits as NumPy array, one row per hit."""
+        return numpy.array(self._data, dtype=numpy.int64).reshape(-1, HIT_COLUMNS)
+
+    def split(self, threshold=None):
+        """
+        Remove hits with cross-links before ``threshold`` (all if None) and return them.
+
+        Hits keep their order in both, returned and remaining store.
+        """
+        rows = self.rows
+        if threshold is None:
+            complete = numpy.ones(len(rows), dtype=bool)
+        else:
+            complete = rows[:, XLINK_POS] < threshold
+        self._data = array.array('q')
+        self._data.frombytes(rows[~complete].tobytes())
+        return _Hits(self.barcodes, rows[complete])
+
+    def by_position(self):
+        """
+        Return hits in a hierarchical structure.
+
+        Structure is the following::
+
+            by_pos = {
+                xlink_pos: {
+                    barcode: [(middle_pos, end_pos, read_len, num_mapped, second_start), ...],
+                    ...
+                },
+                ...
+            }
+
+        Positions are in increasing order, barcodes in order of their first hit
+        and hits in order in which they were appended.
+        """
+        rows = self.rows
+        rows = rows[numpy.argsort(rows[:, XLINK_POS], kind='stable')]
+        by_pos = {}
+        for row in rows.tolist():
+            by_pos.setdefault(row[XLINK_POS], {}).setdefault(
+                self.barcodes[row[BARCODE]], []).append(tuple(row[MIDDLE_POS:]))
+        return by_pos
+
+
+def _group_rows(*keys):
+    """
+    Group rows by values in ``keys`` columns.
+
+    Parameters
+    ----------
+    keys : numpy.ndarray
+        Columns with keys, first one is the primary key.
+
+    Returns
+    -------
+    tuple
+        Index of group for each row (groups are numbered in increasing order
+        of keys) and index of the first row in each group.
+
+    """
+    order = numpy.lexsort(keys[::-1])  # Stable, so rows in group keep their order.
+    new_group = numpy.zeros(order.size, dtype=bool)
+    new_group[:1] = True
+    for key in keys:
+        key_sorted = key[order]
+        new_group[1:] |= key_sorted[1:] != key_sorted[:-1]
+    groups = numpy.empty(order.size, dtype=numpy.int64)
+    groups[order] = numpy.cumsum(new_group) - 1
+    return groups, order[new_group]
+
+
+def _sum_counts(rows, groups, grp_pos, used):
+    """
+    Sum cDNA and reads of ``used`` hits for each position in ``grp_pos``.
+
+    Rows need to be ordered by second-start groups, which are given in
+    ``groups``. See ``_count_sites`` for details.
+    """
+    if not used.any():
+        return {}
+    xlink_pos, read_len, num_mapped = rows[:, XLINK_POS], rows[:, READ_LEN], rows[:, NUM_MAPPED]
+    # Sum of all read lengths per second-start group:
+    sum_len = numpy.bincount(groups, weights=read_len * used)
+
+    used_rows = numpy.flatnonzero(used)
+    weights = read_len[used_rows] / (num_mapped[used_rows] * sum_len[groups[used_rows]])
+
+    # Sums within each cross-link position (bincount sums in order of rows):
+    pairs, first_pairs = _group_rows(xlink_pos[used_rows], grp_pos[used_rows])
+    pair_weights = numpy.bincount(pairs, weights=weights)
+    pair_reads = numpy.bincount(pairs)
+
+    # Sums over cross-link positions:
+    positions, first_positions = _group_rows(grp_pos[used_rows][first_pairs])
+    cdna = numpy.bincount(positions, weights=pair_weights)
+    reads = numpy.bincount(positions, weights=pair_reads).astype(numpy.int64)
+    return dict(zip(
+        grp_pos[used_rows][first_pairs][first_positions].tolist(),
+        zip(cdna.tolist(), reads.tolist()),
+    ))
+
+
+def _count_sites(rows, group_by, multimax):
+    """
+    Count cDNA and reads in cross-link sites from array of hits.
+
+    This is a vectorised implementation of ``_collapse``. Hits in ``rows``
+    (with columns as in ``_Hits``) need to be grouped by cross-link position
+    and barcode. Within cross-link position and barcode, hits are split to
+    second-start groups and the weight of each read is::
+
+        weight = read_len / (num_mapped * sum(read lengths in second-start group))
+
+    Weights are summed in the same order as in a loop over barcodes,
+    second-start groups and reads, so that results are exactly the same.
+    Counts for each position are first summed within each cross-link position
+    and then over cross-link positions in increasing order.
+
+    Parameters
+    ----------
+    rows : numpy.ndarray
+        Hits, one per row.
+    group_by : str
+        Report by start, middle or end position.
+    multimax : int
+        Ignore reads, mapped to more than ``multimax`` places.
+
+    Returns
+    -------
+    tuple
+        Dicts with number of cDNA and reads for each position: of uniquely
+        mapped reads and of reads mapped to at most ``multimax`` places.
+
+    """
+    # Order hits by second-start groups (in the order of their first hit):
+    groups, first_rows = _group_rows(rows[:, XLINK_POS], rows[:, BARCODE], rows[:, SECOND_START])
+    order = numpy.argsort(first_rows[groups], kind='stable')
+    rows, groups = rows[order], groups[order]
+    grp_pos = rows[:, [XLINK_POS, MIDDLE_POS, END_POS][['start', 'middle', 'end'].index(group_by)]]
+
+    unique_by_pos = _sum_counts(rows, groups, grp_pos, rows[:, NUM_MAPPED] <= 1)
+    multi_by_pos = _sum_counts(rows, groups, grp_pos, rows[:, NUM_MAPPED] <= multimax)
+    return unique_by_pos, multi_by_pos
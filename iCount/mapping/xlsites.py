@@ -83,45 +83,93 @@ of randomers among) unique mapped sites that overlap with multimapped reads
 import re
 import os
 import math
+import bisect
 import logging
+import multiprocessing
 
-import pybedtools
+import numpy
 import pysam
 from pysam import AlignmentFile  # pylint: disable=no-name-in-module
 
 import iCount
-from iCount.files import _f2s, get_temp_file_name
+from iCount.files import get_temp_file_name
+from iCount.mapping.barcodes import _match, _match_batch, _merge_weak_randomers, _pack_barcodes
+from iCount.mapping.hits import XLINK_POS, BARCODE, MIDDLE_POS, HIT_COLUMNS, _Hits, _count_sites, _group_rows
 
 
 LOGGER = logging.getLogger(__name__)
 VALID_NUCLEOTIDES = set('ATCGN')
 RANDOM_BARCODE_REGEX = r'.*:rbc:([ATCGN]+).*'
+# Number of pending hits on a strand before complete positions are flushed:
+FLUSH_BATCH = 2 ** 16
 
 
-def _iter_bed_dict(bed, val_index=None):
-    """Iterate through dict object."""
-    if val_index is not None:
-        for (chrome, strand), by_pos in bed.items():
-            for pos, val in by_pos.items():
-                val = val[val_index]
-                yield pybedtools.create_interval_from_list(
-                    [chrome, pos, pos + 1, '.', _f2s(val), strand]
-                )
-    else:
-        for (chrome, strand), by_pos in bed.items():
-            for pos, val in by_pos.items():
-                yield pybedtools.create_interval_from_list(
-                    [chrome, pos, pos + 1, '.', _f2s(val), strand]
-                )
+def _format_values(values, dec=4):
+    """
+    Return string representations of ``values``, as given by ``_f2s``.
+
+    Sites share a small number of distinct scores, so each distinct value is
+    formatted only once. Integers do not need formatting to decimal places.
+    """
+    cache = {}
+    template = '%.{:d}f'.format(dec)
+    formatted = []
+    for value in values:
+        string = cache.get(value)
+        if string is None:
+            if isinstance(value, int):
+                string = str(value)
+            else:
+                string = (template % value).rstrip('0').rstrip('.')
+            cache[value] = string
+        formatted.append(string)
+    return formatted
 
 
 def _save_dict(bed, out_fname, val_index=None):
-    """Save data from dict to BED file."""
-    sites = pybedtools.BedTool(
-        _iter_bed_dict(bed, val_index=val_index)
-    ).saveas()
-    sites1 = sites.sort().saveas(out_fname)
-    return sites1
+    """
+    Save data from dict to BED6 file, sorted by chromosome and position.
+
+    Sites of each chromosome (from both strands) are sorted in memory and
+    written to file in a single pass. Sites on the same position are ordered
+    by strand. If ``out_fname`` ends with ``.gz`` file is compressed in BGZF
+    format, which can be read as ordinary gzip file and indexed with tabix.
+
+    Parameters
+    ----------
+    bed : dict
+        Sites, in the form of ``{(chrom, strand): {pos: value(s)}}``.
+    out_fname : str
+        Output BED6 file.
+    val_index : int
+        If given, ``value(s)`` are lists and value on this index is reported.
+
+    Returns
+    -------
+    None
+        None.
+
+    """
+    by_chrom = {}
+    for (chrom, strand), by_pos in bed.items():
+        by_chrom.setdefault(chrom, []).append((strand, by_pos))
+
+    if out_fname.endswith('.gz'):
+        handle = pysam.BGZFile(out_fname, 'wb')  # pylint: disable=no-member
+    else:
+        handle = open(out_fname, 'wb')
+
+    with handle:
+        for chrom in sorted(by_chrom):
+            sites = sorted(
+                (pos, strand, val if val_index is None else val[val_index])
+                for strand, by_pos in by_chrom[chrom] for pos, val in by_pos.items()
+            )
+            scores = _format_values([val for _, _, val in sites])
+            handle.write(''.join([
+                '{}\t{}\t{}\t.\t{}\t{}\n'.format(chrom, pos, pos + 1, score, strand)
+                for (pos, strand, _), score in zip(sites, scores)
+            ]).encode())
 
 
 def _get_random_barcode(query_name, metrics):
@@ -142,30 +190,6 @@ def _get_random_barcode(query_name, metrics):
     return barcode
 
 
-def _match(seq1, seq2, mismatches):
-    """
-    Test if sequence seq1 and seq2 are sufficiently similar.
-
-    Parameters
-    ----------
-    seq1 : str
-        First sequence.
-    seq2 : str
-        Second sequence.
-    mismatches : int
-        Number of allowed mismatches between given sequences.
-
-    Returns
-    -------
-    bool
-        Do sequence `seq1` and `seq2` have less or equal than ``mismatches``
-
-    """
-    seq1, seq2 = seq1.upper(), seq2.upper()
-    matches = sum([(nuc1 == 'N' or nuc2 == 'N' or nuc1 == nuc2) for nuc1, nuc2 in zip(seq1, seq2)])
-    return max(len(seq1), len(seq2)) - matches <= mismatches
-
-
 def _update(cur_vals, to_add):
     """
     Add the values from ``to_add`` to appropriate place in ``cur_vals``.
@@ -218,7 +242,7 @@ def _merge_similar_randomers(by_bc, mismatches, ratio_th=0.1):
         3. Merge remaining.
         For each barcode with number of reads below the threshold, identify if there
         exists any similar one. If there is, join the hits form second barcode to
-        the first one.
+        the first one. This is done in ``_merge_weak_randomers``.
 
     TODO: Code should be improved in step #1. Instead of finding any match,
     match with least difference should be found. Check also the skipped unit
@@ -253,50 +277,39 @@ def _merge_similar_randomers(by_bc, mismatches, ratio_th=0.1):
     # If match is found, move hits form ambiguous to the non-ambiguous one.
     # If no match is found, declare ambiguous randomer (even if it has 'N's) as
     # non-ambiguous.
+    # Accepted barcodes are kept sorted by increasing frequency. Only the entry
+    # of the barcode whose frequency changes is re-positioned. Each ambiguous
+    # randomer is compared to all barcodes at once.
+    barcodes = list(by_bc)
+    index = {bc: i for i, bc in enumerate(barcodes)}
+    packed_barcodes = _pack_barcodes(barcodes)
+    accepted = sorted([(len(by_bc[bc]), bc) for bc in nonambig_bcs])
     for _, amb_bc in sorted(ambig_bcs):
-        matches = False
-        # Get list of accepted barcodes (sorted by decreasing frequency).
-        # Sort is required each time as frequency changes when hits are
-        # assigned from ambiguous to non-ambiguous randomer
-        order_bcs = sorted([(len(hits), bc) for bc, hits in by_bc.items() if
-                            bc in nonambig_bcs], reverse=True)
-
-        for _, barcode in order_bcs:
-            if _match(barcode, amb_bc, mismatches):
-                matches = True
+        if packed_barcodes is None:
+            matching = None
+        else:
+            matching = _match_batch(amb_bc, packed_barcodes, mismatches)
+        for nhits, barcode in reversed(accepted):
+            if matching[index[barcode]] if matching is not None else _match(barcode, amb_bc, mismatches):
+                del accepted[bisect.bisect_left(accepted, (nhits, barcode))]
                 by_bc[barcode].extend(by_bc.pop(amb_bc))
+                bisect.insort(accepted, (len(by_bc[barcode]), barcode))
                 break
-        if not matches:
-            nonambig_bcs.add(amb_bc)
+        else:
+            bisect.insort(accepted, (len(by_bc[amb_bc]), amb_bc))
 
     # Step #2: identify and accept randomers with strong support
     # Randomers that are supported by a threshold number of hits are accepted as unique.
     # Threshold is defined as the proportion (ratio_th) of the number of reads assigned
     # to the most frequent randomer.
-    order_bcs = [(len(hits), bc) for bc, hits in by_bc.items()]
-    order_bcs = sorted(order_bcs, reverse=True)
-    min_hit_count = max(1, math.floor(order_bcs[0][0] * ratio_th))
+    max_hit_count = max(len(hits) for hits in by_bc.values())
+    min_hit_count = max(1, math.floor(max_hit_count * ratio_th))
 
     # Step #3: merge remaining
     # For each barcode with number of reads below the threshold, identify if there
     # exists any similar one. If there is, join the hits form second barcode to the
     # first one.
-    merged = True
-    while merged:
-        # start with most frequent randomers first
-        order_bcs = [(len(hits), bc) for bc, hits in by_bc.items()]
-        order_bcs = sorted(order_bcs, reverse=True)
-        merged = False
-        for i, (_, barcode) in enumerate(order_bcs):
-            for nhits2, barcode2 in order_bcs[i + 1:]:
-                if nhits2 >= min_hit_count:
-                    # do not try to merge barcodes with large support
-                    continue
-                if _match(barcode, barcode2, mismatches):
-                    merged = True
-                    by_bc[barcode].extend(by_bc.pop(barcode2))
-            if merged:
-                break
+    _merge_weak_randomers(by_bc, mismatches, min_hit_count)
 
 
 def _collapse(xlink_pos, by_bc, group_by, multimax=1):
@@ -368,99 +381,121 @@ def _collapse(xlink_pos, by_bc, group_by, multimax=1):
         Number of cDNA and reads for each position.
 
     """
-    group_by_index = ['start', 'middle', 'end'].index(group_by)
+    return _collapse_by_multimax(xlink_pos, by_bc, group_by, multimax)[1]
 
-    # Container for cDNA and read counts:
-    counts = {}
 
-    for hits in by_bc.values():
-
-        # separate in groups by second-start
-        ss_groups = {}
-        for read in hits:
-            ss_groups.setdefault(read[4], []).append(read)
+def _collapse_by_multimax(xlink_pos, by_bc, group_by, multimax):
+    """
+    Report number of cDNAs and reads in cross-link site for uniquely mapped and multi-mapped reads.
 
-        for ss_group in ss_groups.values():
+    This gives the same results as calling ``_collapse`` with ``multimax``
+    equal to 1 and to ``multimax``, but second-start groups are computed only
+    once.
 
-            # Sum of all read lengths per ss_group:
-            sum_len_per_barcode = sum([i[2] for i in ss_group if i[3] <= multimax])
+    Parameters
+    ----------
+    xlink_pos : int
+        Cross link position (genomic coordinate).
+    by_bc : dict
+        Dict with hits for each barcode.
+    group_by : str
+        Report by start, middle or end position.
+    multimax : int
+        Ignore reads, mapped to more than ``multimax`` places.
 
-            for middle_pos, end_pos, read_len, num_mapped, _ in ss_group:
-                if num_mapped > multimax:
-                    continue
-                grp_pos = (xlink_pos, middle_pos, end_pos)[group_by_index]
-                weight = read_len / (num_mapped * sum_len_per_barcode)
+    Returns
+    -------
+    tuple
+        Number of cDNA and reads for each position, of uniquely mapped reads
+        and of reads mapped to at most ``multimax`` places.
 
-                current_values = counts.get(grp_pos, (0, 0))
-                upadated_values = (current_values[0] + weight, current_values[1] + 1)
-                counts[grp_pos] = upadated_values
+    """
+    hits = [hit for bc_hits in by_bc.values() for hit in bc_hits]
+    if not hits:
+        return {}, {}
 
-    return counts
+    rows = numpy.empty((len(hits), HIT_COLUMNS), dtype=numpy.int64)
+    rows[:, XLINK_POS] = xlink_pos
+    rows[:, BARCODE] = numpy.repeat(numpy.arange(len(by_bc)), [len(bc_hits) for bc_hits in by_bc.values()])
+    rows[:, MIDDLE_POS:] = hits
+    return _count_sites(rows, group_by, multimax)
 
 
-def _intersects_with_annotaton(second_start, segmentation, chrom, strand):
+def _position_at(blocks, idx):
     """
-    Test if second_start corresopnds to any entry in segmentation.
-
-    Returns
-    -------
-        bool
-    Does the read's second_start corresopnd to any known segment in segmentation
+    Return reference position of ``idx``-th aligned nucleotide in ``blocks``.
 
+    Indexing follows list semantics on the (never built) list of aligned
+    positions: negative indexes count from the end and out of range indexes
+    raise IndexError.
     """
-    for gene_content in segmentation.values():
-        for transcript_id, transcript_content in gene_content.items():
-            if transcript_id == 'gene_segment':
-                continue
-            for segment in transcript_content:
-                if strand == '+':
-                    if second_start == segment.start:
-                        return True
-                else:
-                    if second_start == segment.stop:
-                        return True
-    return False
+    if idx < 0:
+        idx += sum(end - start for start, end in blocks)
+    if idx >= 0:
+        for start, end in blocks:
+            if idx < end - start:
+                return start + idx
+            idx -= end - start
+    raise IndexError('aligned position index out of range')
 
 
-def _second_start(read, poss, strand, chrom, segmentation, holesize_th):
+def _second_start(read, blocks, strand, chrom, borders, holesize_th):
     """
     Return the coordinate of second start.
 
     If read is not split or we wish algorithm
-    to think of read as linear, second_start equals to 0.
+    to think of read as linear, second_start equals to 0. Segment borders
+    (as returned by ``SegmentationIndex.borders``) are used to determine if
+    second start corresponds to any known segment.
+
+    Holes are the gaps between consecutive aligned ``blocks`` (as returned
+    by ``read.get_blocks()``). Blocks split only by an insertion are adjacent
+    and form a hole of size 0.
     """
-    holes = [j - i - 1 for i, j in zip(poss, poss[1:])]
-    # Get the size of the biggest hole:
-    biggest_hole_size = max(holes) if holes else 0
+    # Get the size and position of the (first) biggest hole:
+    biggest_hole_size, biggest_hole_block = 0, None
+    for i in range(1, len(blocks)):
+        hole_size = blocks[i][0] - blocks[i - 1][1]
+        if hole_size > biggest_hole_size:
+            biggest_hole_size, biggest_hole_block = hole_size, i
 
     second_start = 0
     is_strange = False
-    if not segmentation:
+    if not borders:
         # Effectively this means, that read is considered as it has no holes.
         if biggest_hole_size > holesize_th:
             # Still, read is not treated as on with distinct second_start.
             # However, it is reported as starnge:
             is_strange = True
     else:
-        biggest_hole_size_index = holes.index(biggest_hole_size)
-        # Take right border of hole on "+" and left border on "-" strand:
-        if strand == '+':
-            second_start = poss[biggest_hole_size_index + 1]
+        # Take right border of hole on "+" and left border on "-" strand. If
+        # there is no hole, the first pair of aligned nucleotides is taken.
+        if biggest_hole_block is not None:
+            if strand == '+':
+                second_start = blocks[biggest_hole_block][0]
+            else:
+                second_start = blocks[biggest_hole_block - 1][1] - 1
+        elif strand == '+':
+            second_start = _position_at(blocks, 1)
         else:
-            second_start = poss[biggest_hole_size_index]
+            second_start = blocks[0][0]
 
         # Read is strange if:
         # it is not intersecting with segmentation AND
         # if there actually is a hole
-        if not _intersects_with_annotaton(second_start, segmentation, chrom, strand) and \
-                biggest_hole_size != 0:
+        if second_start not in borders[strand] and biggest_hole_size != 0:
             is_strange = True
 
     return second_start, is_strange
 
 
-def _get_read_data(read, metrics, mapq_th, segmentation=None, gap_th=4):
-    """Extract neccessary data from read."""
+def _get_read_data(read, metrics, mapq_th, borders=None, gap_th=4):
+    """
+    Extract neccessary data from read.
+
+    All positions are computed from aligned blocks of the read, so no list of
+    all aligned reference positions is built.
+    """
     # NH (number of reported alignments) tag is required:
     if not read.has_tag('NH'):
         raise ValueError('"NH" tag not set for record: {}'.format(read.query_name))
@@ -471,34 +506,257 @@ def _get_read_data(read, metrics, mapq_th, segmentation=None, gap_th=4):
     metrics.bc_cn[barcode] = metrics.bc_cn.get(barcode, 0) + 1
 
     # position of cross-link is one nucleotide before start of read
-    poss = read.get_reference_positions()
+    blocks = read.get_blocks()
+    first_pos = blocks[0][0]
+    last_pos = blocks[-1][1] - 1
     if read.is_reverse:
         strand = '-'
-        xlink_pos = poss[-1] + 1
-        end_pos = poss[0]
+        xlink_pos = last_pos + 1
+        end_pos = first_pos
     else:
         strand = '+'
-        xlink_pos = poss[0] - 1
+        xlink_pos = first_pos - 1
         xlink_pos = 1 if xlink_pos < 1 else xlink_pos  # Case of neg. pos on circular MT
-        end_pos = poss[-1]
+        end_pos = last_pos
 
     chrom = read.reference_name
-    second_start, is_strange = _second_start(read, poss, strand, chrom, segmentation, gap_th)
+    second_start, is_strange = _second_start(read, blocks, strand, chrom, borders, gap_th)
     if is_strange:
         metrics.strange_recs += 1
 
     # Position of middle nucleotide. Because we can have spliced reads, middle position is
     # not necessarily the middle of region the read maps to. Take one nucleotide upstream
     # of center in case length is even, happens by default on + strand
-    idx = read.query_length // 2 - 1 if (strand == '-' and read.query_length % 2 == 0) \
-        else read.query_length // 2
-    middle_pos = poss[idx]
+    query_length = read.query_length
+    idx = query_length // 2 - 1 if (strand == '-' and query_length % 2 == 0) else query_length // 2
+    if len(blocks) == 1 and 0 <= idx < blocks[0][1] - first_pos:
+        middle_pos = first_pos + idx
+    else:
+        middle_pos = _position_at(blocks, idx)
 
-    return (xlink_pos, barcode, is_strange, strand, middle_pos, end_pos, read.query_length,
+    return (xlink_pos, barcode, is_strange, strand, middle_pos, end_pos, query_length,
             num_mapped, second_start)
 
 
-def _processs_bam_file(bam_fname, metrics, mapq_th, skipped, segmentation=None, gap_th=4):
+def _init_metrics(metrics):
+    """Set BAM processing counters in ``metrics`` to initial values."""
+    metrics.all_recs = 0  # All records
+    metrics.notmapped_recs = 0  # Not mapped records
+    metrics.mapped_recs = 0  # Mapped records
+    metrics.lowmapq_recs = 0  # Records with insufficient quality
+    metrics.used_recs = 0  # Records used in analysis (all - unmapped - lowmapq)
+    metrics.invalidrandomer_recs = 0  # Records with invalid randomer
+    metrics.norandomer_recs = 0  # Records with no randomer
+    metrics.bc_cn = {}  # Barcode counter
+    metrics.strange_recs = 0  # Strange records (not expected by segmentation)
+
+
+def _merge_metrics(metrics, other):
+    """
+    Add BAM processing counters from ``other`` to ``metrics``.
+
+    Barcode counts are summed per barcode. New barcodes are appended in the
+    order they appear in ``other``, so merging per-chromosome metrics in
+    chromosome order gives the same result as processing the file serially.
+    """
+    for name in ['all_recs', 'notmapped_recs', 'mapped_recs', 'lowmapq_recs', 'used_recs',
+                 'invalidrandomer_recs', 'norandomer_recs', 'strange_recs']:
+        setattr(metrics, name, getattr(metrics, name) + getattr(other, name))
+    for barcode, count in other.bc_cn.items():
+        metrics.bc_cn[barcode] = metrics.bc_cn.get(barcode, 0) + count
+
+
+def _report_metrics(metrics, skipped):
+    """Log BAM processing counters."""
+    LOGGER.info('All records in BAM file: %d', metrics.all_recs)
+    LOGGER.info('Reads not mapped: %d', metrics.notmapped_recs)
+    LOGGER.info('Mapped reads records (hits): %d', metrics.mapped_recs)
+    LOGGER.info('Hits ignored because of low MAPQ: %d', metrics.lowmapq_recs)
+    LOGGER.info('Records used for quantification: %d', metrics.used_recs)
+    LOGGER.info('Records with invalid randomer info in header: %d', metrics.invalidrandomer_recs)
+    LOGGER.info('Records with no randomer info: %d', metrics.norandomer_recs)
+    LOGGER.info('Ten most frequent randomers:')
+    top10 = sorted(
+        [(count, barcode) for barcode, count in metrics.bc_cn.items()], reverse=True)[:10]
+    for count, barcode in top10:
+        LOGGER.info('    %s: %d', barcode, count)
+    LOGGER.info('There are %d reads with second-start not falling on segmentation. They are '
+                'reported in file: %s', metrics.strange_recs, skipped)
+
+
+def _find_bam_index(bam_fname):
+    """Return path to an up-to-date index of ``bam_fname`` or None if there is none."""
+    candidates = [bam_fname + '.bai', bam_fname + '.csi', os.path.splitext(bam_fname)[0] + '.bai']
+    for index in candidates:
+        if os.path.isfile(index) and os.path.getmtime(index) >= os.path.getmtime(bam_fname):
+            return index
+    return None
+
+
+def _prepare_bam_file(bam_fname, threads=1, sort_memory='768M', tmp_dir=None):
+    """
+    Ensure that ``bam_fname`` is sorted by coordinate and indexed.
+
+    If BAM header declares ``SO:coordinate`` and index (``.bai`` or ``.csi``)
+    exists, input file is used directly. If file is sorted but not indexed,
+    only a temporary index is made. Otherwise, file is sorted with
+    ``threads`` threads, each using up to ``sort_memory`` of memory.
+
+    Parameters
+    ----------
+    bam_fname : str
+        BAM file with mapped reads.
+    threads : int
+        Number of threads used for sorting.
+    sort_memory : str
+        Maximum memory per sorting thread (as in ``samtools sort -m``).
+    tmp_dir : str
+        Directory for temporary files. If not given, ``iCount.TMP_ROOT`` is used.
+
+    Returns
+    -------
+    tuple
+        Path to sorted BAM file, path to its index and list of temporary
+        files that should be removed by the caller.
+
+    """
+    with AlignmentFile(bam_fname, 'rb') as bamfile:
+        is_sorted = bamfile.header.get('HD', {}).get('SO') == 'coordinate'
+
+    if is_sorted:
+        index = _find_bam_index(bam_fname)
+        if index:
+            LOGGER.info('Bam file is sorted and indexed, no need to sort it.')
+            return bam_fname, index, []
+        LOGGER.info('Bam file is sorted, indexing it...')
+        index = get_temp_file_name(tmp_dir=tmp_dir, extension='bai')
+        pysam.index(bam_fname, index)  # pylint: disable=no-member
+        return bam_fname, index, [index]
+
+    LOGGER.info('Sorting and indexing bam file...')
+    tmp_file = get_temp_file_name(tmp_dir=tmp_dir, extension='bam')
+    # pylint: disable=no-member
+    pysam.sort('-@', str(max(threads - 1, 0)), '-m', sort_memory, '-T', tmp_file + '.part',
+               '-o', tmp_file, bam_fname)
+    pysam.index(tmp_file)
+    # pylint: enable=no-member
+    return tmp_file, tmp_file + '.bai', [tmp_file, tmp_file + '.bai']
+
+
+def _process_chromosome(bamfile, chrom, metrics, mapq_th, strange_bam, segmentation=None,
+                        gap_th=4, genome_done=0, genome_size=1, batch_size=FLUSH_BATCH):
+    """
+    Extract data for chromosome ``chrom`` from opened and indexed ``bamfile``.
+
+    Yields the same chunks as ``_processs_bam_file``, but only for one
+    chromosome. Reads that do not map as expected by segmentation are written
+    to ``strange_bam``.
+
+    Data is streamed: cross-link positions are complete as soon as sliding
+    window start (start of the current read) has moved past them. Hits are
+    kept in columnar ``_Hits`` store of each strand and complete positions are
+    yielded when there are at least ``batch_size`` hits in the store (or
+    twice as much as the number of hits that remained in store after the last
+    flush). Therefore only a limited number of reads is kept in memory, chunks
+    are big enough for vectorised processing and the same position is never
+    yielded twice.
+
+    Parameters
+    ----------
+    bamfile : pysam.AlignmentFile
+        Sorted and indexed BAM file, opened for reading.
+    chrom : str
+        Chromosome to process.
+    metrics : iCount.Metrics
+        Metrics object for storing analysis metadata.
+    mapq_th : int
+        Ignore hits with MAPQ < mapq_th.
+    strange_bam : pysam.AlignmentFile
+        BAM file opened for writing, where strange reads are stored.
+    segmentation : str
+        File with segmentation (obtained by ``iCount segment``).
+    gap_th : int
+        Reads with gaps less than gap_th are treated as if they have no gap.
+    genome_done : int
+        Size of all chromosomes processed before this one (for progress).
+    genome_size : int
+        Size of whole genome (for progress).
+    batch_size : int
+        Minimal number of pending hits on a strand before they are flushed.
+
+    Returns
+    -------
+    generator
+        Tuples ((chrom, strand), progress, hits), where hits is ``_Hits``.
+
+    """
+    def finalize(thresholds, progress, force=False):
+        """Yield hits with cross-links before threshold of each strand."""
+        for strand in ('+', '-'):
+            pending = hits_pending[strand]
+            if len(pending) and (force or len(pending) >= flush_size[strand]):
+                hits = pending.split(thresholds[strand])
+                flush_size[strand] = max(batch_size, 2 * len(pending))
+                if len(hits):
+                    yield ((chrom, strand), progress, hits)
+
+    chrom_len = bamfile.header['SQ'][bamfile.get_tid(chrom)]['LN']
+    borders = None
+    if segmentation:
+        # Segment borders are collected once per chromosome, so that checking
+        # second start of each read is a constant time lookup.
+        index = iCount.genomes.compiled.SegmentationIndex(segmentation, excluded_types=['gene'])
+        if (chrom, '+') in index.table or (chrom, '-') in index.table:
+            borders = index.borders(chrom)
+
+    # Pending hits of each strand and barcodes (hits store barcode indexes):
+    barcodes, barcode_indexes = [], {}
+    hits_pending = {'+': _Hits(barcodes), '-': _Hits(barcodes)}
+    flush_size = {'+': batch_size, '-': batch_size}
+    start = 0
+    for read in bamfile.fetch(chrom):
+        metrics.all_recs += 1
+        if read.is_unmapped:
+            metrics.notmapped_recs += 1
+            continue
+        metrics.mapped_recs += 1
+
+        if read.reference_start > start:
+            # Sliding window start (smaller coordinate) has moved. Reads are
+            # sorted, so all further reads start on ``start`` or later. Their
+            # cross-links are on ``start - 1`` or later on positive strand and
+            # on ``start + 1`` or later on negative strand (one nucleotide
+            # after the end of read). Positions before that are complete.
+            start = read.reference_start
+            progress = round(min((genome_done + start) / genome_size, 1.0), 4)
+            for data in finalize({'+': start - 1, '-': start + 1}, progress):
+                yield data
+
+        if read.mapping_quality < mapq_th:
+            metrics.lowmapq_recs += 1
+            continue
+        metrics.used_recs += 1
+
+        rdata = _get_read_data(
+            read, metrics, mapq_th, borders=borders, gap_th=gap_th)
+        (xlink_pos, barcode, is_strange, strand), read_data = rdata[0:4], rdata[4:]
+
+        if is_strange:
+            strange_bam.write(read)
+        else:
+            if barcode not in barcode_indexes:
+                barcode_indexes[barcode] = len(barcodes)
+                barcodes.append(barcode)
+            hits_pending[strand].append(xlink_pos, barcode_indexes[barcode], read_data)
+
+    # Flush the rest of the chromosome:
+    progress = round(min((genome_done + chrom_len) / genome_size, 1.0), 4)
+    for data in finalize({'+': None, '-': None}, progress, force=True):
+        yield data
+
+
+def _processs_bam_file(bam_fname, metrics, mapq_th, skipped, segmentation=None, gap_th=4, threads=1,
+                       sort_memory='768M', tmp_dir=None, batch_size=FLUSH_BATCH):
     """
     Extract data from BAM file into chunks of genome.
 
@@ -520,122 +778,211 @@ def _processs_bam_file(bam_fname, metrics, mapq_th, skipped, segmentation=None,
         File with segmentation (obtained by ``iCount segment``).
     gap_th : int
         Reads with gaps less than gap_th are treated as if they have no gap.
+    threads : int
+        Number of threads used for sorting (if sorting is needed).
+    sort_memory : str
+        Maximum memory per sorting thread.
+    tmp_dir : str
+        Directory for temporary files.
+    batch_size : int
+        Minimal number of pending hits on a strand before they are flushed.
 
     Returns
     -------
-    dict
-        Internal structure of BAM file, described in docstring.
-    list
-        BAM file with
+    generator
+        Tuples ((chrom, strand), progress, hits), where hits is ``_Hits``.
 
     """
-    metrics.all_recs = 0  # All records
-    metrics.notmapped_recs = 0  # Not mapped records
-    metrics.mapped_recs = 0  # Mapped records
-    metrics.lowmapq_recs = 0  # Records with insufficient quality
-    metrics.used_recs = 0  # Records used in analysis (all - unmapped - lowmapq)
-    metrics.invalidrandomer_recs = 0  # Records with invalid randomer
-    metrics.norandomer_recs = 0  # Records with no randomer
-    metrics.bc_cn = {}  # Barcode counter
-    metrics.strange_recs = 0  # Strange records (not expected by segmentation)
-
-    def finalize(reads_pending_fwd, reads_pending_rev, start, chrom, progress):
-        """Yield appropriate data."""
-        reads_to_process_fwd = {}
-        for pos in list(reads_pending_fwd):
-            if pos < start:
-                reads_to_process_fwd[pos] = reads_pending_fwd.pop(pos)
-        if reads_to_process_fwd:
-            yield ((chrom, '+'), progress, reads_to_process_fwd)
-
-        reads_to_process_rev = {}
-        for pos in list(reads_pending_rev):
-            if pos < start:
-                reads_to_process_rev[pos] = reads_pending_rev.pop(pos)
-        if reads_to_process_rev:
-            yield ((chrom, '-'), progress, reads_to_process_rev)
+    _init_metrics(metrics)
 
     # Ensure sorted and and indexed input BAM file:
-    LOGGER.info('Ensuring that bam file is sorted and indexed...')
-    tmp_file = get_temp_file_name()
-    pysam.sort('-o', tmp_file, bam_fname)  # pylint: disable=no-member
-    pysam.index(tmp_file)  # pylint: disable=no-member
+    bam_sorted, bam_index, tmp_files = _prepare_bam_file(
+        bam_fname, threads=threads, sort_memory=sort_memory, tmp_dir=tmp_dir)
     genome_done = 0
-    ann_data = None
     LOGGER.info('Detecting cross-links...')
-    with AlignmentFile(tmp_file, 'rb') as bamfile:
-        strange_bam = AlignmentFile(skipped, 'wb', header=bamfile.header)
-        genome_size = sum([contig['LN'] for contig in bamfile.header['SQ']])
-        for chrom in bamfile.references:
-            chrom_len = bamfile.header['SQ'][bamfile.get_tid(chrom)]['LN']
-            if segmentation:
-                # pylint: disable=protected-access
-                ann_data = iCount.genomes.segment._prepare_segmentation(segmentation, chrom)
-
-            reads_pending_fwd = {}
-            reads_pending_rev = {}
-            read = None
-            for read in bamfile.fetch(chrom):
-                metrics.all_recs += 1
-                if read.is_unmapped:
-                    metrics.notmapped_recs += 1
-                    continue
-                metrics.mapped_recs += 1
-                if read.mapping_quality < mapq_th:
-                    metrics.lowmapq_recs += 1
-                    continue
-                metrics.used_recs += 1
-
-                rdata = _get_read_data(
-                    read, metrics, mapq_th, segmentation=ann_data, gap_th=gap_th)
-                (xlink_pos, barcode, is_strange, strand), read_data = rdata[0:4], rdata[4:]
-
-                if is_strange:
-                    strange_bam.write(read)
-                else:
-                    if strand == '+':
-                        reads_pending_fwd.setdefault(
-                            xlink_pos, {}).setdefault(barcode, []).append(read_data)
-                    else:
-                        reads_pending_rev.setdefault(
-                            xlink_pos, {}).setdefault(barcode, []).append(read_data)
-
-            # Sliding window start (smaller coordinate)
-            start = 0 if read is None else (0 if not read.positions else read.positions[0])
-            progress = round(min((genome_done + start) / genome_size, 1.0), 4)
+    with AlignmentFile(bam_sorted, 'rb', index_filename=bam_index) as bamfile:
+        with AlignmentFile(skipped, 'wb', header=bamfile.header) as strange_bam:
+            genome_size = sum([contig['LN'] for contig in bamfile.header['SQ']])
+            for chrom in bamfile.references:
+                for data in _process_chromosome(
+                        bamfile, chrom, metrics, mapq_th, strange_bam, segmentation=segmentation,
+                        gap_th=gap_th, genome_done=genome_done, genome_size=genome_size,
+                        batch_size=batch_size):
+                    yield data
+
+                genome_done += bamfile.header['SQ'][bamfile.get_tid(chrom)]['LN']
 
-            for data in finalize(reads_pending_fwd, reads_pending_rev, start, chrom, progress):
-                yield data
+    # Clean up:
+    for tmp_file in tmp_files:
+        os.remove(tmp_file)
 
-            start = chrom_len
-            progress = round(min((genome_done + start) / genome_size, 1.0), 4)
-            for data in finalize(reads_pending_fwd, reads_pending_rev, start, chrom, progress):
-                yield data
+    # Report:
+    _report_metrics(metrics, skipped)
 
-            genome_done += chrom_len
+
+def _quantify(hits, group_by, mismatches, ratio_th, multimax):
+    """
+    Merge randomers and count cDNA and reads in each position of ``hits``.
+
+    Randomers are merged only on cross-link positions with more than one
+    barcode. After merging, hits of each barcode are followed by hits of
+    barcodes that were merged to it, as in ``_merge_similar_randomers``.
+    Counting is vectorised over all positions (see ``_count_sites``).
+
+    Parameters
+    ----------
+    hits : _Hits
+        Hits to quantify.
+    group_by : str
+        Report by start, middle or end position.
+    mismatches : int
+        Number of allowed mismatches between merged randomers.
+    ratio_th : float
+        Ratio of hits, needed to accept randomer as unique.
+    multimax : int
+        Ignore reads, mapped to more than ``multimax`` places.
+
+    Returns
+    -------
+    tuple
+        Dicts with counts of uniquely mapped and multi-mapped reads for
+        each position.
+
+    """
+    rows = hits.rows
+    rows = rows[numpy.argsort(rows[:, XLINK_POS], kind='stable')]
+    xlinks = rows[:, XLINK_POS]
+
+    # Cross-link positions with more than one barcode:
+    _, first_pairs = _group_rows(xlinks, rows[:, BARCODE])
+    pair_xlinks, barcode_counts = numpy.unique(xlinks[first_pairs], return_counts=True)
+    for xlink_pos in pair_xlinks[barcode_counts > 1].tolist():
+        start, stop = numpy.searchsorted(xlinks, [xlink_pos, xlink_pos + 1]).tolist()
+        by_bc = {}
+        for i, barcode in enumerate(rows[start:stop, BARCODE].tolist(), start):
+            by_bc.setdefault(hits.barcodes[barcode], []).append(i)
+
+        _merge_similar_randomers(by_bc, mismatches, ratio_th=ratio_th)
+
+        merged = rows[[i for indexes in by_bc.values() for i in indexes]]
+        merged[:, BARCODE] = numpy.repeat(
+            [rows[indexes[0], BARCODE] for indexes in by_bc.values()],
+            [len(indexes) for indexes in by_bc.values()])
+        rows[start:stop] = merged
+
+    # count uniquely mapped reads only and all reads mapped les than multimax times
+    unique_by_pos, multi_by_pos = _count_sites(rows, group_by, multimax)
+    return unique_by_pos, multi_by_pos
+
+
+def _process_chromosome_worker(args):
+    """
+    Quantify cross-links on one chromosome (in a separate process).
+
+    Each worker opens the sorted and indexed BAM file on its own and writes
+    strange reads to its own temporary BAM file in ``tmp_dir``.
+
+    Returns
+    -------
+    tuple
+        Chromosome name, metrics, unique and multi counts (keyed by
+        (chrom, strand)) and path to BAM file with strange reads.
+
+    """
+    (bam_fname, bam_index, chrom, mapq_th, segmentation, gap_th, group_by, mismatches, ratio_th,
+     multimax, tmp_dir) = args
+
+    metrics = iCount.Metrics(context=chrom)
+    _init_metrics(metrics)
+
+    unique, multi = {}, {}
+    skipped_part = get_temp_file_name(tmp_dir=tmp_dir, extension='bam')
+    with AlignmentFile(bam_fname, 'rb', index_filename=bam_index) as bamfile:
+        with AlignmentFile(skipped_part, 'wb', header=bamfile.header) as strange_bam:
+            for (chrom_, strand), _, by_pos in _process_chromosome(
+                    bamfile, chrom, metrics, mapq_th, strange_bam, segmentation=segmentation,
+                    gap_th=gap_th):
+                unique_by_pos, multi_by_pos = _quantify(
+                    by_pos, group_by, mismatches, ratio_th, multimax)
+                _update(unique.setdefault((chrom_, strand), {}), unique_by_pos)
+                _update(multi.setdefault((chrom_, strand), {}), multi_by_pos)
+
+    return chrom, metrics, unique, multi, skipped_part
+
+
+def _process_bam_file_parallel(bam_fname, metrics, mapq_th, skipped, segmentation=None, gap_th=4,
+                                group_by='start', mismatches=1, ratio_th=0.1, multimax=50,
+                                workers=2, sort_memory='768M', tmp_dir=None, report_progress=False):
+    """
+    Quantify cross-links in BAM file by processing chromosomes in parallel.
+
+    Chromosomes are distributed to a pool of ``workers`` processes, largest
+    chromosomes first. Results are merged in the order of chromosomes in the
+    BAM header, so that metrics and outputs are identical to the serial run.
+
+    Returns
+    -------
+    tuple
+        Dicts with counts of uniquely mapped and multi-mapped reads, keyed by
+        (chrom, strand).
+
+    """
+    _init_metrics(metrics)
+
+    bam_sorted, bam_index, tmp_files = _prepare_bam_file(
+        bam_fname, threads=workers, sort_memory=sort_memory, tmp_dir=tmp_dir)
+    with AlignmentFile(bam_sorted, 'rb', index_filename=bam_index) as bamfile:
+        header = bamfile.header
+        chrom_sizes = [(contig['SN'], contig['LN']) for contig in header['SQ']]
+    genome_size = sum([size for _, size in chrom_sizes])
+
+    tasks = [
+        (bam_sorted, bam_index, chrom, mapq_th, segmentation, gap_th, group_by, mismatches,
+         ratio_th, multimax, tmp_dir)
+        for chrom, _ in sorted(chrom_sizes, key=lambda x: -x[1])
+    ]
+
+    if segmentation:
+        # Load segmentation before workers are started, so that forked
+        # workers share it instead of each reading the whole file again.
+        # pylint: disable=protected-access
+        iCount.genomes.compiled._load_segmentation(segmentation)
+
+    LOGGER.info('Detecting cross-links (using %d workers)...', workers)
+    results = {}
+    progress, genome_done = 0, 0
+    with multiprocessing.Pool(processes=min(workers, len(tasks)) or 1) as pool:
+        for result in pool.imap_unordered(_process_chromosome_worker, tasks):
+            results[result[0]] = result
+            genome_done += dict(chrom_sizes)[result[0]]
+            if report_progress:
+                # pylint: disable=protected-access
+                progress = iCount._log_progress(genome_done / genome_size, progress, LOGGER)
+
+    # Merge results in the same order as the serial run would produce them:
+    unique, multi = {}, {}
+    with AlignmentFile(skipped, 'wb', header=header) as strange_bam:
+        for chrom, _ in chrom_sizes:
+            _, chrom_metrics, chrom_unique, chrom_multi, skipped_part = results[chrom]
+            _merge_metrics(metrics, chrom_metrics)
+            unique.update(chrom_unique)
+            multi.update(chrom_multi)
+            with AlignmentFile(skipped_part, 'rb') as part:
+                for read in part.fetch(until_eof=True):
+                    strange_bam.write(read)
+            os.remove(skipped_part)
 
     # Clean up:
-    os.remove(tmp_file)
+    for tmp_file in tmp_files:
+        os.remove(tmp_file)
 
-    # Report:
-    LOGGER.info('All records in BAM file: %d', metrics.all_recs)
-    LOGGER.info('Reads not mapped: %d', metrics.notmapped_recs)
-    LOGGER.info('Mapped reads records (hits): %d', metrics.mapped_recs)
-    LOGGER.info('Hits ignored because of low MAPQ: %d', metrics.lowmapq_recs)
-    LOGGER.info('Records used for quantification: %d', metrics.used_recs)
-    LOGGER.info('Records with invalid randomer info in header: %d', metrics.invalidrandomer_recs)
-    LOGGER.info('Records with no randomer info: %d', metrics.norandomer_recs)
-    LOGGER.info('Ten most frequent randomers:')
-    top10 = sorted(
-        [(count, barcode) for barcode, count in metrics.bc_cn.items()], reverse=True)[:10]
-    for count, barcode in top10:
-        LOGGER.info('    %s: %d', barcode, count)
-    LOGGER.info('There are %d reads with second-start not falling on segmentation. They are '
-                'reported in file: %s', metrics.strange_recs, skipped)
+    _report_metrics(metrics, skipped)
+    return unique, multi
 
 
 def run(bam, sites_unique, sites_multi, skipped, group_by='start', quant='cDNA',
         segmentation=None, mismatches=1, mapq_th=0, multimax=50, gap_th=4, ratio_th=0.1,
+        workers=1, sort_memory='768M', tmp_dir=None, sites_unique_reads=None, sites_multi_reads=None,
         report_progress=False):
     """
     Identify and quantify cross-linked sites.
@@ -685,6 +1032,24 @@ def run(bam, sites_unique, sites_multi, skipped, group_by='start', quant='cDNA',
         number of reads supporting the most frequent randomer. All randomers
         above this threshold are accepted as unique. Remaining are merged
         with the rest, allowing for the specified number of mismatches.
+    workers : int
+        Number of processes to use. If more than 1, chromosomes are
+        processed in parallel. Results are the same as with one process.
+        This is also the number of threads used when BAM file needs sorting.
+    sort_memory : str
+        Maximum memory per thread when sorting BAM file (e.g. 768M, 2G).
+        Sorting is skipped if BAM file is already sorted by coordinate.
+    tmp_dir : str
+        Directory for temporary files (sorted BAM file and its index). If not
+        given, iCount.TMP_ROOT is used.
+    sites_unique_reads : str
+        Optional output BED6 file to store number of reads (regardless of
+        ``quant``) from uniquely mapped reads. Together with
+        ``sites_multi_reads`` this enables to get both cDNA and reads
+        counts in a single run.
+    sites_multi_reads : str
+        Optional output BED6 file to store number of reads (regardless of
+        ``quant``) from multi-mapped reads.
 
     Returns
     -------
@@ -696,33 +1061,37 @@ def run(bam, sites_unique, sites_multi, skipped, group_by='start', quant='cDNA',
 
     assert sites_unique.endswith(('.bed', '.bed.gz'))
     assert sites_multi.endswith(('.bed', '.bed.gz'))
+    assert sites_unique_reads is None or sites_unique_reads.endswith(('.bed', '.bed.gz'))
+    assert sites_multi_reads is None or sites_multi_reads.endswith(('.bed', '.bed.gz'))
     assert skipped.endswith(('.bam'))
     assert quant in ['cDNA', 'reads']
     assert group_by in ['start', 'middle', 'end']
+    if workers < 1:
+        raise ValueError('Parameter workers should be at least 1.')
 
     metrics = iCount.Metrics()
 
-    unique, multi = {}, {}
-    progress = 0
-    for (chrom, strand), new_progress, by_pos in _processs_bam_file(
-            bam, metrics, mapq_th, skipped, segmentation, gap_th):
-        if report_progress:
-            # pylint: disable=protected-access
-            progress = iCount._log_progress(new_progress, progress, LOGGER)
-
-        unique_by_pos = {}
-        multi_by_pos = {}
-        for xlink_pos, by_bc in by_pos.items():
-
-            _merge_similar_randomers(by_bc, mismatches, ratio_th=ratio_th)
+    if workers > 1:
+        unique, multi = _process_bam_file_parallel(
+            bam, metrics, mapq_th, skipped, segmentation=segmentation, gap_th=gap_th,
+            group_by=group_by, mismatches=mismatches, ratio_th=ratio_th, multimax=multimax,
+            workers=workers, sort_memory=sort_memory, tmp_dir=tmp_dir,
+            report_progress=report_progress)
+    else:
+        unique, multi = {}, {}
+        progress = 0
+        for (chrom, strand), new_progress, by_pos in _processs_bam_file(
+                bam, metrics, mapq_th, skipped, segmentation, gap_th, sort_memory=sort_memory,
+                tmp_dir=tmp_dir):
+            if report_progress:
+                # pylint: disable=protected-access
+                progress = iCount._log_progress(new_progress, progress, LOGGER)
 
-            # count uniquely mapped reads only
-            _update(unique_by_pos, _collapse(xlink_pos, by_bc, group_by, multimax=1))
-            # count all reads mapped les than multimax times
-            _update(multi_by_pos, _collapse(xlink_pos, by_bc, group_by, multimax=multimax))
+            unique_by_pos, multi_by_pos = _quantify(
+                by_pos, group_by, mismatches, ratio_th, multimax)
 
-        unique.setdefault((chrom, strand), {}).update(unique_by_pos)
-        multi.setdefault((chrom, strand), {}).update(multi_by_pos)
+            _update(unique.setdefault((chrom, strand), {}), unique_by_pos)
+            _update(multi.setdefault((chrom, strand), {}), multi_by_pos)
 
     # Write output
     val_index = ['cDNA', 'reads'].index(quant)
@@ -730,5 +1099,11 @@ def run(bam, sites_unique, sites_multi, skipped, group_by='start', quant='cDNA',
     LOGGER.info('Saved to BED file (uniquely mapped reads): %s', sites_unique)
     _save_dict(multi, sites_multi, val_index=val_index)
     LOGGER.info('Saved to BED file (multi-mapped reads): %s', sites_multi)
+    if sites_unique_reads:
+        _save_dict(unique, sites_unique_reads, val_index=1)
+        LOGGER.info('Saved number of reads to BED file (uniquely mapped reads): %s', sites_unique_reads)
+    if sites_multi_reads:
+        _save_dict(multi, sites_multi_reads, val_index=1)
+        LOGGER.info('Saved number of reads to BED file (multi-mapped reads): %s', sites_multi_reads)
 
     return metrics
@@ -0,0 +1,88 @@
+"""
+Compare analytic and permutation background in iCount.analysis.peaks.
+
+This script assigns FDR values to cross-links in simulated groups, once with
+the permutation background (``get_avg_rnd_distrib``) and once with the
+analytic one (``get_analytic_distrib``). For each group, the largest
+difference in FDR, the share of positions on which both modes agree whether
+position is significant and the time needed by each mode are printed.
+
+Groups under test:
+
+    * uniform: cross-links placed uniformly at random (no real peaks)
+    * clustered: part of cross-links concentrated in a few narrow peaks
+    * heavy: like clustered, but with highly variable scores per position
+
+By modifying the variables `self.groups`, `self.perms` and `self.fdr` user
+can determine the size of the problems put under test.
+"""
+# pylint: disable=missing-docstring, protected-access
+
+import random
+import time
+import unittest
+
+import numpy
+
+from iCount.analysis import peaks
+
+SEPARATOR = '-' * 80
+
+
+def uniform(rnd, size, hits):
+    positions = [rnd.randrange(size) for _ in range(hits)]
+    return sorted((pos, float(positions.count(pos))) for pos in set(positions))
+
+
+def clustered(rnd, size, hits, peaks_=5, width=10):
+    centers = [rnd.randrange(size) for _ in range(peaks_)]
+    positions = [rnd.randrange(size) for _ in range(hits // 2)]
+    positions += [min(size - 1, rnd.choice(centers) + rnd.randrange(width)) for _ in range(hits - len(positions))]
+    return sorted((pos, float(positions.count(pos))) for pos in set(positions))
+
+
+def heavy(rnd, size, hits):
+    pos_scores = clustered(rnd, size, hits // 4)
+    return [(pos, score * rnd.choice([1, 1, 2, 5])) for pos, score in pos_scores]
+
+
+class TestPeaksBackground(unittest.TestCase):
+
+    def setUp(self):
+        self.groups = [(1000, 200), (5000, 1000), (20000, 3000), (100000, 10000)]
+        self.distributions = [uniform, clustered, heavy]
+        self.perms = 100
+        self.fdr = 0.05
+        self.half_window = 3
+
+    def test_background(self):
+        print(SEPARATOR)
+        print('{:>8} {:>6} {:>10} {:>10} {:>10} {:>14} {:>14}'.format(
+            'size', 'hits', 'type', 'max dFDR', 'agreement', 'permutation[s]', 'analytic[s]'))
+        for size, hits in self.groups:
+            for distribution in self.distributions:
+                pos_scores = distribution(random.Random(size), size, hits)
+
+                peaks.PS_CACHE.clear()
+                numpy.random.seed(42)
+                start = time.time()
+                fdr_perm = [fdr for _, _, _, fdr in peaks._process_group(
+                    pos_scores, size, self.half_window, self.perms)]
+                time_perm = time.time() - start
+
+                start = time.time()
+                fdr_analytic = [fdr for _, _, _, fdr in peaks._process_group(
+                    pos_scores, size, self.half_window, self.perms, background='analytic')]
+                time_analytic = time.time() - start
+
+                max_diff = max(abs(first - second) for first, second in zip(fdr_perm, fdr_analytic))
+                agreement = numpy.mean([
+                    (first < self.fdr) == (second < self.fdr) for first, second in zip(fdr_perm, fdr_analytic)])
+                print('{:>8} {:>6} {:>10} {:>10.4f} {:>10.4f} {:>14.3f} {:>14.3f}'.format(
+                    size, hits, distribution.__name__, max_diff, agreement, time_perm, time_analytic))
+                self.assertGreater(agreement, 0.95)
+        print(SEPARATOR)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+"""
+Benchmark iCount.mapping.xlsites._merge_similar_randomers.
+
+This script compares merging of randomers with the reference (all-pairs)
+implementation of the algorithm on adversarial barcode distributions. Results
+of both implementations need to be identical, and the time needed by each of
+them is printed.
+
+Barcode distributions under test:
+
+    * uniform: many distinct randomers, each supported by a few reads
+    * skewed: few highly supported randomers with many sequencing-error
+      variants around them (typical for highly expressed snoRNA sites)
+    * chained: randomers forming long chains of single-mismatch neighbours
+    * ambiguous: large proportion of randomers with ``N`` nucleotides
+
+By modifying the variables `self.sizes` and `self.mismatches_list` user can
+determine the size of the problems put under test.
+"""
+# pylint: disable=missing-docstring, protected-access
+
+import math
+import random
+import time
+import unittest
+
+from iCount.mapping import xlsites
+
+SEPARATOR = '-' * 72
+
+
+def reference_merge(by_bc, mismatches, ratio_th=0.1):
+    """All-pairs implementation of randomer merging that is used as reference."""
+    nonambig_bcs = set()
+    ambig_bcs = []
+    for barcode in by_bc.keys():
+        undefined_nucleotides = barcode.count('N')
+        if undefined_nucleotides == 0:
+            nonambig_bcs.add(barcode)
+        else:
+            ambig_bcs.append((undefined_nucleotides, barcode))
+
+    for _, amb_bc in sorted(ambig_bcs):
+        matches = False
+        order_bcs = sorted([(len(hits), bc) for bc, hits in by_bc.items() if
+                            bc in nonambig_bcs], reverse=True)
+        for _, barcode in order_bcs:
+            if xlsites._match(barcode, amb_bc, mismatches):
+                matches = True
+                by_bc[barcode].extend(by_bc.pop(amb_bc))
+                break
+        if not matches:
+            nonambig_bcs.add(amb_bc)
+
+    order_bcs = sorted([(len(hits), bc) for bc, hits in by_bc.items()], reverse=True)
+    min_hit_count = max(1, math.floor(order_bcs[0][0] * ratio_th))
+
+    merged = True
+    while merged:
+        order_bcs = sorted([(len(hits), bc) for bc, hits in by_bc.items()], reverse=True)
+        merged = False
+        for i, (_, barcode) in enumerate(order_bcs):
+            for nhits2, barcode2 in order_bcs[i + 1:]:
+                if nhits2 >= min_hit_count:
+                    continue
+                if xlsites._match(barcode, barcode2, mismatches):
+                    merged = True
+                    by_bc[barcode].extend(by_bc.pop(barcode2))
+            if merged:
+                break
+
+
+def random_barcode(rnd, length, alphabet='ACGT'):
+    return ''.join(rnd.choice(alphabet) for _ in range(length))
+
+
+def mutate(rnd, barcode, changes, alphabet='ACGT'):
+    barcode = list(barcode)
+    for pos in rnd.sample(range(len(barcode)), changes):
+        barcode[pos] = rnd.choice(alphabet.replace(barcode[pos], ''))
+    return ''.join(barcode)
+
+
+def make_hits(counts):
+    by_bc, hit_id = {}, 0
+    for barcode, count in counts.items():
+        by_bc[barcode] = list(range(hit_id, hit_id + count))
+        hit_id += count
+    return by_bc
+
+
+def uniform(rnd, size, length=9):
+    return make_hits({random_barcode(rnd, length): rnd.randint(1, 3) for _ in range(size)})
+
+
+def skewed(rnd, size, length=9):
+    counts = {}
+    centers = [random_barcode(rnd, length) for _ in range(5)]
+    for center in centers:
+        counts[center] = rnd.randint(size // 2, size)
+    while len(counts) < size:
+        variant = mutate(rnd, rnd.choice(centers), rnd.randint(1, 2))
+        counts.setdefault(variant, rnd.randint(1, 2))
+    return make_hits(counts)
+
+
+def chained(rnd, size, length=9):
+    counts = {}
+    barcode = random_barcode(rnd, length)
+    while len(counts) < size:
+        counts.setdefault(barcode, rnd.randint(1, 4))
+        barcode = mutate(rnd, barcode, 1)
+    return make_hits(counts)
+
+
+def ambiguous(rnd, size, length=9):
+    counts = {}
+    while len(counts) < size:
+        barcode = random_barcode(rnd, length)
+        if rnd.random() < 0.2:
+            barcode = mutate(rnd, barcode, rnd.randint(1, 2), alphabet='ACGTN')
+        counts.setdefault(barcode, rnd.randint(1, 5))
+    return make_hits(counts)
+
+
+class TestRandomersMerging(unittest.TestCase):
+
+    def setUp(self):
+        self.sizes = [100, 500, 1000]
+        self.mismatches_list = [1, 2]
+        self.distributions = [uniform, skewed, chained, ambiguous]
+
+    def test_merging(self):
+        print(SEPARATOR)
+        print('{:>10} {:>6} {:>10} {:>12} {:>12}'.format(
+            'barcodes', 'mm', 'type', 'reference[s]', 'xlsites[s]'))
+        for size in self.sizes:
+            for mismatches in self.mismatches_list:
+                for distribution in self.distributions:
+                    by_bc = distribution(random.Random(size), size)
+                    by_bc_ref = {bc: list(hits) for bc, hits in by_bc.items()}
+
+                    start = time.time()
+                    reference_merge(by_bc_ref, mismatches)
+                    time_ref = time.time() - start
+
+                    start = time.time()
+                    xlsites._merge_similar_randomers(by_bc, mismatches)
+                    time_new = time.time() - start
+
+                    print('{:>10} {:>6} {:>10} {:>12.3f} {:>12.3f}'.format(
+                        size, mismatches, distribution.__name__, time_ref, time_new))
+                    self.assertEqual(by_bc, by_bc_ref)
+        print(SEPARATOR)
+
+
+if __name__ == '__main__':
+    unittest.main()
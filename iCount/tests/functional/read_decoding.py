@@ -0,0 +1,169 @@
+"""
+Benchmark iCount.mapping.xlsites._get_read_data.
+
+This script compares decoding of reads from aligned blocks with the reference
+implementation that builds the list of all aligned reference positions of a
+read. Results of both implementations need to be identical, and the number of
+reads decoded per second by each of them is printed.
+
+Read types under test:
+
+    * unspliced: single block reads, optionally soft clipped
+    * spliced: reads with one or more long ``N`` gaps, deletions and
+      insertions
+
+By modifying the variables `self.num_reads` and `self.read_lengths` user can
+determine the size of the problems put under test.
+"""
+# pylint: disable=missing-docstring, protected-access
+
+import random
+import time
+import unittest
+from unittest import mock
+
+import pysam
+
+from iCount.mapping import xlsites
+
+SEPARATOR = '-' * 72
+
+
+def reference_second_start(poss, strand, borders, holesize_th):
+    """Position-list implementation of ``_second_start`` used as reference."""
+    holes = [j - i - 1 for i, j in zip(poss, poss[1:])]
+    biggest_hole_size = max(holes) if holes else 0
+
+    second_start = 0
+    is_strange = False
+    if not borders:
+        if biggest_hole_size > holesize_th:
+            is_strange = True
+    else:
+        biggest_hole_size_index = holes.index(biggest_hole_size)
+        if strand == '+':
+            second_start = poss[biggest_hole_size_index + 1]
+        else:
+            second_start = poss[biggest_hole_size_index]
+        if second_start not in borders[strand] and biggest_hole_size != 0:
+            is_strange = True
+
+    return second_start, is_strange
+
+
+def reference_get_read_data(read, metrics, mapq_th, borders=None, gap_th=4):
+    """Position-list implementation of ``_get_read_data`` used as reference."""
+    num_mapped = read.get_tag('NH')
+    barcode = xlsites._get_random_barcode(read.query_name, metrics)
+    metrics.bc_cn[barcode] = metrics.bc_cn.get(barcode, 0) + 1
+
+    poss = read.get_reference_positions()
+    if read.is_reverse:
+        strand = '-'
+        xlink_pos = poss[-1] + 1
+        end_pos = poss[0]
+    else:
+        strand = '+'
+        xlink_pos = poss[0] - 1
+        xlink_pos = 1 if xlink_pos < 1 else xlink_pos
+        end_pos = poss[-1]
+
+    second_start, is_strange = reference_second_start(poss, strand, borders, gap_th)
+    if is_strange:
+        metrics.strange_recs += 1
+
+    idx = read.query_length // 2 - 1 if (strand == '-' and read.query_length % 2 == 0) \
+        else read.query_length // 2
+    middle_pos = poss[idx]
+
+    return (xlink_pos, barcode, is_strange, strand, middle_pos, end_pos, read.query_length,
+            num_mapped, second_start)
+
+
+def random_cigar(rnd, length, spliced):
+    """Return CIGAR tuples of a read with ``length`` query nucleotides."""
+    cigar = []
+    clip = rnd.choice([0, 0, 0, rnd.randint(1, 5)])
+    if clip:
+        cigar.append((4, clip))
+    remaining = length - clip
+    blocks = rnd.randint(2, 4) if spliced else 1
+    for i in range(blocks):
+        size = remaining if i == blocks - 1 else rnd.randint(1, remaining - (blocks - i - 1))
+        remaining -= size
+        if i:
+            gap = rnd.choice([(3, rnd.randint(100, 5000)), (2, rnd.randint(1, 3)),
+                              (1, 1), (3, rnd.randint(5, 50))])
+            if gap[0] == 1:
+                # Insertion consumes query - take it from the current block.
+                if size < 2:
+                    gap = (3, rnd.randint(100, 5000))
+                else:
+                    size -= 1
+            cigar.append(gap)
+        cigar.append((0, size))
+    return cigar
+
+
+def make_reads(rnd, num_reads, length, spliced):
+    header = pysam.AlignmentHeader.from_dict({'SQ': [{'SN': '1', 'LN': 10 ** 7}]})  # pylint: disable=no-member
+    reads = []
+    for i in range(num_reads):
+        read = pysam.AlignedSegment(header)  # pylint: disable=no-member
+        read.query_name = 'read{}:rbc:{}'.format(i, ''.join(rnd.choice('ACGT') for _ in range(5)))
+        read.reference_id = 0
+        read.reference_start = rnd.randint(0, 10 ** 6)
+        read.cigartuples = random_cigar(rnd, length, spliced)
+        read.query_sequence = 'A' * length
+        read.is_reverse = rnd.random() < 0.5
+        read.set_tag('NH', 1)
+        reads.append(read)
+    return reads
+
+
+def make_borders(reads):
+    borders = {'+': set(), '-': set()}
+    for read in reads[::2]:
+        blocks = read.get_blocks()
+        if len(blocks) > 1:
+            borders['+'].add(blocks[1][0])
+            borders['-'].add(blocks[0][1] - 1)
+    return borders
+
+
+def decode(function, reads, borders):
+    metrics = mock.MagicMock()
+    metrics.bc_cn = {}
+    metrics.strange_recs = 0
+    start = time.time()
+    results = [function(read, metrics, 0, borders=borders) for read in reads]
+    return results, time.time() - start
+
+
+class TestReadDecoding(unittest.TestCase):
+
+    def setUp(self):
+        self.num_reads = 100000
+        self.read_lengths = [50, 150]
+
+    def test_decoding(self):
+        print(SEPARATOR)
+        print('{:>10} {:>8} {:>12} {:>14} {:>14}'.format(
+            'type', 'length', 'segment', 'reference[r/s]', 'xlsites[r/s]'))
+        for spliced in [False, True]:
+            for length in self.read_lengths:
+                reads = make_reads(random.Random(length), self.num_reads, length, spliced)
+                for borders in [None, make_borders(reads)]:
+                    expected, time_ref = decode(reference_get_read_data, reads, borders)
+                    results, time_new = decode(xlsites._get_read_data, reads, borders)
+
+                    print('{:>10} {:>8} {:>12} {:>14.0f} {:>14.0f}'.format(
+                        'spliced' if spliced else 'unspliced', length,
+                        'yes' if borders else 'no',
+                        self.num_reads / time_ref, self.num_reads / time_new))
+                    self.assertEqual(results, expected)
+        print(SEPARATOR)
+
+
+if __name__ == '__main__':
+    unittest.main()
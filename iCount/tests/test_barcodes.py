@@ -0,0 +1,103 @@
+# pylint: disable=missing-docstring, protected-access
+
+import warnings
+import unittest
+
+import numpy
+
+from iCount.mapping import barcodes
+
+
+class TestMatch(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+
+    def test_match_basic(self):
+        self.assertFalse(barcodes._match('ACGT', 'ACGG', 0))
+        self.assertTrue(barcodes._match('ACGT', 'ACGG', 1))
+
+    def test_match_unequal_len(self):
+        self.assertFalse(barcodes._match('AAAAA', 'AGNN', 1))
+        self.assertTrue(barcodes._match('AGNN', 'AAAAA', 2))
+
+    def test_capital_letters(self):
+        self.assertTrue(barcodes._match('AAAA', 'aaaa', 0))
+        self.assertTrue(barcodes._match('AAAA', 'anna', 0))
+        self.assertFalse(barcodes._match('AAAG', 'aaaa', 0))
+        self.assertTrue(barcodes._match('AAAG', 'aaaa', 1))
+        self.assertTrue(barcodes._match('AANG', 'aaaa', 1))
+
+        self.assertFalse(barcodes._match('AACGG', 'NAAAN', 1))
+
+    def test_other_characters(self):
+        self.assertTrue(barcodes._match('AXA', 'AXA', 0))
+        self.assertFalse(barcodes._match('AXA', 'AAA', 0))
+
+
+class TestPackedBarcodes(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+
+    def test_pack_barcode(self):
+        self.assertEqual(barcodes._pack_barcode('CA'), (1, 15, 2))
+        self.assertEqual(barcodes._pack_barcode('cA'), (1, 15, 2))
+        self.assertEqual(barcodes._pack_barcode('NT'), (12, 12, 2))
+        self.assertEqual(barcodes._pack_barcode(''), (0, 0, 0))
+        self.assertIsNone(barcodes._pack_barcode('AXA'))
+
+    def test_count_mismatches(self):
+        def count(seq1, seq2):
+            return barcodes._count_mismatches(barcodes._pack_barcode(seq1), barcodes._pack_barcode(seq2))
+
+        self.assertEqual(count('ACGT', 'ACGT'), 0)
+        self.assertEqual(count('ACGT', 'TGCA'), 4)
+        self.assertEqual(count('ACGT', 'ANNA'), 1)
+        self.assertEqual(count('AAAAA', 'AGNN'), 2)
+
+    def test_batch(self):
+        seqs = ['ACGT', 'ACGG', 'NCGA', 'TTTT', 'ACG', 'A' * 32]
+        packed = barcodes._pack_barcodes(seqs)
+        self.assertEqual(
+            barcodes._count_mismatches_batch('ACGN', packed).tolist(), [0, 0, 0, 3, 1, 30])
+        self.assertEqual(
+            barcodes._match_batch('ACGT', packed, 1).tolist(), [True, True, True, False, True, False])
+
+        self.assertIsNone(barcodes._pack_barcodes(['ACGT', 'A' * 33]))
+        self.assertIsNone(barcodes._pack_barcodes(['ACGT', 'AXGT']))
+
+    def test_find_matches(self):
+        seqs = ['ACGT', 'ACGG', 'TTTT', 'ACGA']
+        selected = numpy.array([True, True, True, False])
+        packed = barcodes._pack_barcodes(seqs)
+        self.assertEqual(barcodes._find_matches('ACGT', seqs, packed, selected, 1), [0, 1])
+        self.assertEqual(barcodes._find_matches('ACGT', seqs, None, selected, 1), [0, 1])
+
+
+class TestHammingNeighbourhood(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+
+    def test_barcode_codes(self):
+        self.assertEqual(barcodes._barcode_codes(['AAAA', 'CA', 'AT', 'aca']), [0, 1, 12, 4])
+        self.assertEqual(barcodes._barcode_codes(['ANA', 'AXA']), [None, None])
+        # Barcodes that differ only in case share the code:
+        self.assertEqual(barcodes._barcode_codes(['aca', 'ACA', 'ACC']), [None, None, 20])
+
+    def test_neighbourhood(self):
+        code = barcodes._pack_barcode('ACGT')[0]
+        for mismatches in range(4):
+            neighbours = list(barcodes._hamming_neighbourhood(code, 4, mismatches))
+            self.assertEqual(len(neighbours), barcodes._neighbourhood_size(4, mismatches))
+            self.assertEqual(len(set(neighbours)), len(neighbours))
+            self.assertNotIn(code, neighbours)
+
+        neighbours = set(barcodes._hamming_neighbourhood(code, 4, 1))
+        self.assertIn(barcodes._pack_barcode('ACGA')[0], neighbours)
+        self.assertNotIn(barcodes._pack_barcode('ACAA')[0], neighbours)
+
+
+if __name__ == '__main__':
+    unittest.main()
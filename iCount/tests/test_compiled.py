@@ -0,0 +1,180 @@
+# pylint: disable=missing-docstring, protected-access
+import os
+import unittest
+import warnings
+
+import numpy
+
+from iCount.genomes import compiled
+from iCount.tests.utils import make_file_from_list
+
+
+class TestPrepareSegmentation(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+        self.seg = make_file_from_list(bedtool=False, data=[
+            ['1', '.', 'intergenic', '1', '9', '.', '+', '.', 'gene_id "."; transcript_id ".";'],
+            ['1', '.', 'gene', '10', '100', '.', '+', '.', 'gene_id "G1";'],
+            ['1', '.', 'transcript', '10', '100', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
+            ['1', '.', 'CDS', '10', '50', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
+            ['1', '.', 'intron', '51', '100', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
+            ['1', '.', 'intergenic', '1', '100', '.', '-', '.', 'gene_id "."; transcript_id ".";'],
+            ['2', '.', 'intergenic', '1', '100', '.', '+', '.', 'gene_id "."; transcript_id ".";'],
+        ])
+
+    def test_load(self):
+        records = compiled._load_segmentation(self.seg)
+        self.assertEqual(sorted(records), [('1', '+'), ('1', '-'), ('2', '+')])
+        self.assertEqual(len(records.rows('1', '+')), 5)
+        self.assertEqual(records.lines('1', '-'), [
+            '1\t.\tintergenic\t1\t100\t.\t-\t.\tgene_id "."; transcript_id ".";'])
+        # File is parsed only once, also when reading other files in between:
+        other = make_file_from_list(bedtool=False, data=[
+            ['2', '.', 'intergenic', '1', '100', '.', '+', '.', 'gene_id "."; transcript_id ".";'],
+        ])
+        other_records = compiled._load_segmentation(other)
+        self.assertIs(compiled._load_segmentation(self.seg), records)
+        self.assertIs(compiled._load_segmentation(other), other_records)
+
+        # ... unless it is modified:
+        make_file_from_list(bedtool=False, tfile=self.seg, data=[
+            ['3', '.', 'intergenic', '1', '100', '.', '+', '.', 'gene_id "."; transcript_id ".";'],
+        ])
+        os.utime(self.seg, ns=(0, 0))
+        self.assertEqual(list(compiled._load_segmentation(self.seg)), [('3', '+')])
+
+    def test_prepare(self):
+        segmentation = compiled._prepare_segmentation(self.seg, '1', '+')
+        self.assertEqual(sorted(segmentation), ['G1', 'G_1_+_0'])
+        self.assertEqual(segmentation['G1']['gene_segment'][2], 'gene')
+        self.assertEqual([seg[2] for seg in segmentation['G1']['T1']], ['transcript', 'CDS', 'intron'])
+        self.assertEqual(segmentation['G_1_+_0']['T_1_+_0'][0].stop, 9)
+
+        self.assertEqual(sorted(compiled._prepare_segmentation(self.seg, '1')), ['G1', 'G_1_+_0', 'G_1_-_0'])
+        self.assertEqual(compiled._prepare_segmentation(self.seg, '3'), {})
+
+
+class TestCompileSegmentation(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+        self.data = [
+            ['1', '.', 'intergenic', '1', '9', '.', '+', '.', 'gene_id "."; transcript_id ".";'],
+            ['1', '.', 'gene', '10', '100', '.', '+', '.', 'gene_id "G1"; biotype "A";'],
+            ['1', '.', 'CDS', '10', '50', '.', '+', '0', 'gene_id "G1"; transcript_id "T1"; biotype "A";'],
+            ['1', '.', 'intergenic', '1', '100', '.', '-', '.', 'gene_id "."; transcript_id ".";'],
+            ['1', '.', 'intergenic', '101', '200', '.', '+', '.', 'gene_id "."; transcript_id ".";'],
+        ]
+        self.seg = make_file_from_list(self.data, bedtool=False)
+
+    def test_compile(self):
+        cseg = compiled._compile_segmentation(self.seg)
+        self.assertEqual(cseg, self.seg + compiled.COMPILED_EXTENSION)
+
+        table = compiled._SegmentationTable.load(cseg)
+        self.assertIsInstance(table.start, numpy.memmap)
+        self.assertEqual(list(table), [('1', '+'), ('1', '-')])
+        self.assertEqual(table.start.tolist(), [0, 9, 9, 100, 0])
+        self.assertEqual(table.stop.tolist(), [9, 100, 50, 200, 100])
+        self.assertEqual([table.tables['gene_id'][code] for code in table.gene_id], ['.', 'G1', 'G1', '.', '.'])
+        self.assertEqual(
+            [table.tables['transcript_id'][code] for code in table.transcript_id], ['.', '', 'T1', '.', '.'])
+        self.assertEqual(table.lines('1', '+'), ['\t'.join(line) for line in self.data if line[6] == '+'])
+        self.assertEqual(table.lines('1', '-'), ['\t'.join(self.data[3])])
+        self.assertEqual(table.lines('2', '+'), [])
+
+    def test_load(self):
+        compiled._compile_segmentation(self.seg)
+        self.assertIsInstance(compiled._load_compiled_segmentation(self.seg), compiled._SegmentationTable)
+
+        # Same content with different modification time is still valid:
+        os.utime(self.seg, ns=(0, 0))
+        self.assertIsNotNone(compiled._load_compiled_segmentation(self.seg))
+
+        # Compiled file is ignored once segmentation changes:
+        make_file_from_list(self.data[:2], bedtool=False, tfile=self.seg)
+        self.assertIsNone(compiled._load_compiled_segmentation(self.seg))
+        records = compiled._load_segmentation(self.seg)
+        self.assertNotIsInstance(records.start, numpy.memmap)
+        self.assertEqual(len(records), 2)
+
+    def test_attribute_order(self):
+        seg = make_file_from_list(bedtool=False, data=[
+            ['1', '.', 'CDS', '10', '50', '.', '+', '0',
+             'biotype "A"; transcript_biotype "B"; gene_biotype "C"; transcript_id "T1"; gene_id "G1";'],
+        ])
+        table = compiled._SegmentationTable.from_gtf(seg)
+        self.assertEqual(table.values('biotype', [0]), ['A'])
+        self.assertEqual(table.values('gene_id', [0]), ['G1'])
+        self.assertEqual(table.values('transcript_id', [0]), ['T1'])
+
+    def test_invalid(self):
+        with open(self.seg + compiled.COMPILED_EXTENSION, 'wb') as handle:
+            handle.write(b'not compiled')
+        self.assertIsNone(compiled._load_compiled_segmentation(self.seg))
+        self.assertEqual(len(compiled._load_segmentation(self.seg)), 5)
+
+
+class TestSegmentationIndex(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+        self.seg = make_file_from_list(bedtool=False, data=[
+            ['1', '.', 'intergenic', '1', '9', '.', '+', '.', 'gene_id "."; transcript_id ".";'],
+            ['1', '.', 'gene', '10', '1000', '.', '+', '.', 'gene_id "G1";'],
+            ['1', '.', 'CDS', '10', '50', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
+            ['1', '.', 'intron', '51', '900', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
+            ['1', '.', 'CDS', '901', '1000', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
+            ['1', '.', 'intergenic', '1', '1000', '.', '-', '.', 'gene_id "."; transcript_id ".";'],
+        ])
+
+    def test_point(self):
+        index = compiled.SegmentationIndex(self.seg)
+        self.assertEqual(index.point('1', '+', 8).tolist(), [0])
+        self.assertEqual(index.point('1', '+', 9).tolist(), [1, 2])
+        self.assertEqual(index.point('1', '+', 50).tolist(), [1, 3])
+        self.assertEqual(index.point('1', '+', 1000).tolist(), [])
+        self.assertEqual(index.point('1', '-', 500).tolist(), [5])
+        self.assertEqual(index.point('2', '+', 500).tolist(), [])
+
+    def test_range(self):
+        index = compiled.SegmentationIndex(self.seg)
+        self.assertEqual(index.range('1', '+', 0, 1000).tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(index.range('1', '+', 45, 55).tolist(), [1, 2, 3])
+        self.assertEqual(index.range('1', '+', 9, 10).tolist(), [1, 2])
+        self.assertEqual(index.table.values('type', index.range('1', '+', 899, 901)), ['gene', 'intron', 'CDS'])
+
+    def test_batch(self):
+        index = compiled.SegmentationIndex(self.seg)
+        queries, records = index.batch('1', '+', [500, 0, 2000])
+        self.assertEqual(queries.tolist(), [0, 0, 1])
+        self.assertEqual(records.tolist(), [1, 3, 0])
+
+        queries, records = index.batch('1', '+', [0, 40], [1, 60])
+        self.assertEqual(list(zip(queries.tolist(), records.tolist())), [(0, 0), (1, 1), (1, 2), (1, 3)])
+
+    def test_types(self):
+        index = compiled.SegmentationIndex(self.seg, types=['gene', 'intergenic'])
+        self.assertEqual(index.records('1', '+').tolist(), [0, 1])
+        self.assertEqual(index.point('1', '+', 9).tolist(), [1])
+
+        index = compiled.SegmentationIndex(self.seg, excluded_types=['gene'])
+        self.assertEqual(index.records('1', '+').tolist(), [0, 2, 3, 4])
+        self.assertEqual(index.borders('1'), {'+': {0, 9, 50, 900}, '-': {9, 50, 900, 1000}})
+
+    def test_borders(self):
+        seg = make_file_from_list(bedtool=False, data=[
+            ['1', '.', 'gene', '1', '500', '.', '+', '.', 'gene_id "G1";'],
+            ['1', '.', 'transcript', '10', '400', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
+            ['1', '.', 'CDS', '10', '100', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
+            ['1', '.', 'intron', '101', '400', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
+        ])
+        index = compiled.SegmentationIndex(seg, excluded_types=['gene'])
+        # Gene segment borders are not included:
+        self.assertEqual(index.borders('1'), {'+': {9, 100}, '-': {100, 400}})
+        self.assertEqual(index.borders('2'), {'+': set(), '-': set()})
+
+
+if __name__ == '__main__':
+    unittest.main()
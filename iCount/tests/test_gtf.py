@@ -0,0 +1,195 @@
+# pylint: disable=missing-docstring, protected-access
+import unittest
+import warnings
+
+from pybedtools import create_interval_from_list
+
+from iCount.genomes import gtf
+from iCount.tests.utils import list_to_intervals, intervals_to_list, make_file_from_list
+
+
+class TestGtfRecord(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+
+    def test_from_fields(self):
+        fields = ['1', 'ens', 'exon', '10', '20', '.', '+', '.', 'gene_id "G1"; exon_number 2; key42: "A";']
+        record = gtf._GtfRecord.from_fields(fields)
+        self.assertEqual(record.start, 9)
+        self.assertEqual(record.stop, 20)
+        self.assertEqual(len(record), 11)
+        self.assertEqual(record.fields, fields)
+        self.assertEqual(record[2], 'exon')
+        self.assertEqual(str(record), '\t'.join(fields) + '\n')
+        self.assertEqual(record.attrs, {'gene_id': 'G1', 'exon_number': '2', 'key42:': 'A'})
+        self.assertIs(record.attrs, record.attrs)
+
+    def test_parse_attributes(self):
+        self.assertEqual(gtf._parse_attributes('.'), {})
+        self.assertEqual(gtf._parse_attributes(''), {})
+        self.assertEqual(gtf._parse_attributes('gene_id "G1"'), {'gene_id': 'G1'})
+        self.assertEqual(gtf._parse_attributes('tag "a";tag "b"; name "x y";'), {'tag': 'b', 'name': 'x y'})
+
+    def test_format_attributes(self):
+        self.assertEqual(gtf._format_attributes('gene_id "G1"; exon_number 2;  tag "a"; tag "b"'),
+                         'gene_id "G1";exon_number 2;tag "b";')
+        self.assertEqual(gtf._format_attributes('ID=G1; Name=A'), 'ID=G1;Name=A;')
+
+        # Column 9 is formatted once attributes are accessed:
+        record = gtf._GtfRecord.from_fields(['1', '.', 'gene', '10', '20', '.', '+', '.', 'gene_id "G1"; key "A";'])
+        self.assertEqual(record[8], 'gene_id "G1"; key "A";')
+        self.assertEqual(record.attrs['gene_id'], 'G1')
+        self.assertEqual(record[8], 'gene_id "G1";key "A";')
+        self.assertEqual(record[8], str(create_interval_from_list(record.fields).attrs))
+
+    def test_replace(self):
+        record = gtf._GtfRecord.from_fields(['1', '.', 'exon', '10', '20', '.', '+', '0', 'gene_id "G1";'])
+        attrs = record.attrs
+
+        utr = record.replace(type='UTR3', start=14, frame='.')
+        self.assertEqual(utr.fields, ['1', '.', 'UTR3', '15', '20', '.', '+', '.', 'gene_id "G1";'])
+        self.assertIs(utr.attrs, attrs)
+        self.assertEqual(record.fields, ['1', '.', 'exon', '10', '20', '.', '+', '0', 'gene_id "G1";'])
+
+        renamed = record.replace(col8='gene_id "G2";')
+        self.assertEqual(renamed.attrs, {'gene_id': 'G2'})
+
+    def test_filter_col8(self):
+        interval = gtf._GtfRecord.from_fields(
+            ['1', '.', 'CDS', '1', '2', '.', '+', '.', 'gene_name "B"; transcript_id "A"; key42 "A"; key43: "?";'])
+
+        expected = 'gene_name "B"; transcript_id "A";'
+        self.assertEqual(gtf._filter_col8(interval), expected)
+
+        expected = 'gene_name "B"; key42 "A";'
+        self.assertEqual(gtf._filter_col8(interval, keys=['gene_name', 'key42']), expected)
+
+    def test_read_gtf(self):
+        gtf_file = make_file_from_list([
+            ['#!genome-build GRCh38'],
+            ['1', '.', 'gene', '100', '300', '.', '+', '.', 'gene_id "G1";'],
+        ], bedtool=False)
+        records = list(gtf._read_gtf(gtf_file))
+        self.assertEqual([record.fields for record in records],
+                         [['1', '.', 'gene', '100', '300', '.', '+', '.', 'gene_id "G1";']])
+
+
+class TestGetGeneContent(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+
+    def test_all_good(self):
+        """
+        * second gene has no 'gene' interval - but it is present in output as it should
+        * last interval is on chromosome 2, but it is not in the output
+        """
+        gtf_data = list_to_intervals([
+            ['1', '.', 'gene', '100', '300', '.', '+', '.', 'gene_id "G1";'],
+            ['1', '.', 'transcript', '100', '250', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
+            ['1', '.', 'exon', '100', '150', '.', '+', '.', 'gene_id "G1"; transcript_id "T1"; exon_number "1";'],
+            ['1', '.', 'exon', '200', '250', '.', '+', '.', 'gene_id "G1"; transcript_id "T1"; exon_number "2";'],
+            ['1', '.', 'transcript', '150', '300', '.', '+', '.', 'gene_id "G1"; transcript_id "T2";'],
+            ['1', '.', 'exon', '150', '200', '.', '+', '.', 'gene_id "G1"; transcript_id "T2"; exon_number "1";'],
+            ['1', '.', 'exon', '250', '300', '.', '+', '.', 'gene_id "G1"; transcript_id "T2"; exon_number "2";'],
+            ['1', '.', 'transcript', '400', '500', '.', '+', '.', 'gene_id "G2"; transcript_id "T3";'],
+            ['1', '.', 'exon', '400', '430', '.', '+', '.', 'gene_id "G2"; transcript_id "T3"; exon_number "1"'],
+            ['1', '.', 'CDS', '410', '430', '.', '+', '.', 'gene_id "G2"; transcript_id "T3";'],
+            ['1', '.', 'exon', '470', '500', '.', '+', '.', 'gene_id "G2"; transcript_id "T3"; exon_number "2"'],
+            ['1', '.', 'CDS', '470', '490', '.', '+', '.', 'gene_id "G2"; transcript_id "T3";'],
+            ['2', '.', 'CDS', '470', '490', '.', '+', '.', 'gene_id "G3"; transcript_id "T4";'],
+        ])
+        gtf_file = make_file_from_list(intervals_to_list(gtf_data))
+
+        gene1, gene2 = list(gtf._get_gene_content(gtf_file, ['1', 'MT'], report_progress=True))
+
+        expected1 = {
+            'gene': gtf_data[0],
+            'T1': gtf_data[1:4],
+            'T2': gtf_data[4:7],
+        }
+
+        extra_gene = create_interval_from_list(['1', '.', 'gene', '400', '500', '.', '+', '.', 'gene_id "G2";'])
+        expected2 = {
+            'gene': extra_gene,
+            'T3': gtf_data[7:-1],
+        }
+
+        self.assertEqual(gene1, expected1)
+        self.assertEqual(gene2, expected2)
+
+    def test_noncontiguous_transcript(self):
+        """
+        Group lines of transcript that are not contiguous.
+        """
+        gtf_data = [
+            ['1', '.', 'gene', '100', '300', '.', '+', '.', 'gene_id "G1";'],
+            ['1', '.', 'transcript', '100', '250', '.', '+', '.', 'gene_id "G1";transcript_id "T1";'],
+            ['1', '.', 'transcript', '150', '300', '.', '+', '.', 'gene_id "G1";transcript_id "T2";'],
+            ['1', '.', 'exon', '150', '200', '.', '+', '.', 'gene_id "G1";transcript_id "T1";exon_number "1";'],
+        ]
+        gtf_file = make_file_from_list(gtf_data)
+
+        with self.assertLogs(gtf.LOGGER, level='WARNING') as logs:
+            genes = list(gtf._get_gene_content(gtf_file, ['1', 'MT']))
+        self.assertIn('Lines of 1 transcripts are not contiguous in annotation: T1', logs.output[0])
+
+        self.assertEqual(len(genes), 1)
+        self.assertEqual({id_: intervals_to_list(content) if id_ != 'gene' else content.fields
+                          for id_, content in genes[0].items()},
+                         {'gene': gtf_data[0], 'T1': [gtf_data[1], gtf_data[3]], 'T2': [gtf_data[2]]})
+
+    def test_noncontiguous_gene(self):
+        """
+        Group lines of genes that are not contiguous, also in compressed file.
+        """
+        gtf_data = [
+            ['1', '.', 'gene', '100', '300', '.', '+', '.', 'gene_id "G1";'],
+            ['1', '.', 'transcript', '100', '250', '.', '+', '.', 'gene_id "G1";transcript_id "T1";'],
+            ['1', '.', 'gene', '500', '700', '.', '+', '.', 'gene_id "G2";'],
+            ['2', '.', 'gene', '500', '700', '.', '+', '.', 'gene_id "G3";'],
+            ['1', '.', 'transcript', '200', '300', '.', '+', '.', 'gene_id "G1";transcript_id "T3";'],
+            ['1', '.', 'transcript', '500', '600', '.', '+', '.', 'gene_id "G2";transcript_id "T4";'],
+            ['1', '.', 'exon', '100', '250', '.', '+', '.', 'gene_id "G1";transcript_id "T1";'],
+        ]
+        expected = [
+            {'gene': gtf_data[0], 'T1': [gtf_data[1], gtf_data[6]], 'T3': [gtf_data[4]]},
+            {'gene': gtf_data[2], 'T4': [gtf_data[5]]},
+        ]
+
+        for gtf_file in [make_file_from_list(gtf_data), make_file_from_list(gtf_data, compress=True)]:
+            with self.assertLogs(gtf.LOGGER, level='WARNING') as logs:
+                genes = list(gtf._get_gene_content(gtf_file, ['1', 'MT']))
+            self.assertIn('Lines of 2 genes are not contiguous in annotation, grouping them by gene: G1, G2',
+                          logs.output[1])
+            self.assertEqual([{id_: intervals_to_list(content) if id_ != 'gene' else content.fields
+                               for id_, content in gene.items()} for gene in genes], expected)
+
+    def test_transcript_in_many_genes(self):
+        """
+        Raise error if transcript is found in more than one gene.
+        """
+        gtf_file = make_file_from_list([
+            ['1', '.', 'transcript', '100', '250', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
+            ['1', '.', 'transcript', '500', '600', '.', '+', '.', 'gene_id "G2"; transcript_id "T1";'],
+        ])
+
+        with self.assertRaisesRegex(ValueError, 'Transcript T1 is in genes G1 and G2.'):
+            list((gtf._get_gene_content(gtf_file, ['1', 'MT'])))
+
+    def test_no_required_attributes(self):
+        """
+        Raise error if transcript_id attribute is not present.
+        """
+        gtf_file = make_file_from_list([
+            ['1', '.', 'transcript', '500', '600', '.', '+', '.', 'gene_id "G1";'],
+        ])
+
+        message = "First element in gene content is neither gene or transcript!"
+        with self.assertRaisesRegex(Exception, message):
+            list((gtf._get_gene_content(gtf_file, ['1', 'MT'])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+# pylint: disable=missing-docstring, protected-access
+
+import warnings
+import unittest
+
+import numpy
+
+from iCount.mapping import hits
+
+
+class TestHits(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+
+    def test_append_split(self):
+        store = hits._Hits(['AAA', 'CCC'])
+        store.append(10, 0, (1, 2, 3, 1, 0))
+        store.append(5, 1, (4, 5, 6, 2, 0))
+        store.append(10, 1, (7, 8, 9, 1, 20))
+        store.append(20, 0, (1, 2, 3, 1, 0))
+        self.assertEqual(len(store), 4)
+
+        complete = store.split(11)
+        self.assertEqual(complete.by_position(), {
+            5: {'CCC': [(4, 5, 6, 2, 0)]},
+            10: {'AAA': [(1, 2, 3, 1, 0)], 'CCC': [(7, 8, 9, 1, 20)]},
+        })
+        self.assertEqual(list(complete.by_position()), [5, 10])
+        self.assertEqual(store.rows.tolist(), [[20, 0, 1, 2, 3, 1, 0]])
+
+        rest = store.split()
+        self.assertEqual(len(rest), 1)
+        self.assertEqual(len(store), 0)
+
+    def test_group_rows(self):
+        groups, first_rows = hits._group_rows(
+            numpy.array([5, 3, 5, 3, 5]), numpy.array([1, 1, 0, 1, 1]))
+        self.assertEqual(groups.tolist(), [2, 0, 1, 0, 2])
+        self.assertEqual(first_rows.tolist(), [1, 2, 0])
+
+    def test_count_sites(self):
+        rows = numpy.array([
+            [10, 0, 15, 20, 10, 2, 0],
+            [10, 1, 15, 20, 10, 2, 0],
+            [12, 0, 15, 20, 20, 4, 0],
+        ])
+        self.assertEqual(hits._count_sites(rows, 'start', 1), ({}, {}))
+        self.assertEqual(hits._count_sites(rows, 'start', 2), ({}, {10: (1.0, 2)}))
+        self.assertEqual(hits._count_sites(rows, 'end', 4), ({}, {20: (1.25, 3)}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,15 @@
 # pylint: disable=missing-docstring, protected-access
 
+import os
 import unittest
 import warnings
+from collections import Counter
+from unittest.mock import patch
+
+import numpy
 
 from iCount.analysis import peaks
-from iCount.tests.utils import get_temp_file_name, make_file_from_list, \
+from iCount.tests.utils import get_temp_dir, get_temp_file_name, make_file_from_list, \
     make_list_from_file
 
 
@@ -79,6 +84,120 @@ class TestPeaks(unittest.TestCase):
         for res, exp, in zip(result, expected):
             self.assertAlmostEqual(res, exp, delta=0.02)
 
+    def test_rnd_cumulative_probs(self):
+        """
+        Each row gives the same result as cumulative_prob of SWW scores of its hits.
+        """
+        numpy.random.seed(0)
+        total_hits = 50
+        rnd_hits = numpy.random.randint(30, size=(20, total_hits))
+
+        result = peaks._rnd_cumulative_probs(rnd_hits, 2)
+        for row, hits in zip(result, rnd_hits):
+            scores_cww = peaks._sum_within_window_nopos(Counter(hits).items(), half_window=2)
+            expected = peaks.cumulative_prob(scores_cww, total_hits)
+            # Result is truncated after the largest score in all rows:
+            numpy.testing.assert_array_equal(row, expected[:result.shape[1]])
+            self.assertFalse(expected[result.shape[1]:].any())
+
+    def test_get_avg_rnd_distrib_chunks(self):
+        """
+        Result does not depend on the number of permutations drawn at once.
+        """
+        numpy.random.seed(0)
+        expected = peaks.get_avg_rnd_distrib(100, 40, 3, perms=50)
+        peaks.PS_CACHE.clear()
+        with patch('iCount.analysis.peaks.RND_CHUNK_HITS', 100):
+            numpy.random.seed(0)
+            result = peaks.get_avg_rnd_distrib(100, 40, 3, perms=50)
+        peaks.PS_CACHE.clear()
+        numpy.testing.assert_allclose(result, expected, rtol=1e-12)
+
+    def test_rnd_distrib_disk_cache(self):
+        """
+        Seeded background does not depend on global random state and is reused from disk.
+        """
+        cache_dir = get_temp_dir()
+        cache = peaks._BackgroundCache(cache_dir)
+        numpy.random.seed(0)
+        expected = peaks.get_avg_rnd_distrib(100, 40, 3, perms=50, rnd_seed=42, disk_cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+        # New process (empty memory cache) reads background from disk:
+        peaks.PS_CACHE.clear()
+        cache = peaks._BackgroundCache(cache_dir)
+        numpy.random.seed(1)
+        result = peaks.get_avg_rnd_distrib(100, 40, 3, perms=50, rnd_seed=42, disk_cache=cache)
+        self.assertEqual(result, expected)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+        # Without cache, the same background is drawn again:
+        peaks.PS_CACHE.clear()
+        self.assertEqual(peaks.get_avg_rnd_distrib(100, 40, 3, perms=50, rnd_seed=42), expected)
+        self.assertNotEqual(peaks.get_avg_rnd_distrib(100, 40, 3, perms=50, rnd_seed=43), expected)
+        peaks.PS_CACHE.clear()
+
+    def test_background_cache_eviction(self):
+        cache_dir = get_temp_dir()
+        cache = peaks._BackgroundCache(cache_dir)
+        cache.put((1,), [1.0] * 100)
+        entry_size = os.path.getsize(cache._fname((1,)))
+
+        # Room for 2 entries, least recently used is evicted:
+        cache = peaks._BackgroundCache(cache_dir, max_size=2.5 * entry_size)
+        cache.put((2,), [1.0] * 100)
+        os.utime(cache._fname((1,)), (0, 0))
+        os.utime(cache._fname((2,)), (1, 1))
+        self.assertEqual(cache.get((1,)), [1.0] * 100)
+        cache.put((3,), [1.0] * 100)
+        self.assertIsNone(cache.get((2,)))
+        self.assertEqual(cache.get((1,)), [1.0] * 100)
+        self.assertEqual(cache.get((3,)), [1.0] * 100)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_process_groups(self):
+        """
+        Result does not depend on the order and chunks in which groups are processed.
+        """
+        rnd = numpy.random.RandomState(0)  # pylint: disable=no-member
+        groups = [
+            (('1', '+', str(i), 'A'), [(pos, float(rnd.randint(1, 5))) for pos in range(0, size, 3)], size)
+            for i, size in enumerate([30, 30, 60, 90, 60, 300])
+        ]
+        chunks = list(peaks._group_chunks(groups, 3))
+        self.assertEqual(sorted(group for chunk in chunks for group in chunk), sorted(groups))
+        # Largest groups come first:
+        self.assertEqual(chunks[0][0], groups[-1])
+
+        options = dict(half_window=3, perms=20, background='permutation', rnd_seed=42)
+        expected, _, _ = peaks._process_groups(groups, **options)
+        result = []
+        for chunk in reversed(chunks):
+            peaks.PS_CACHE.clear()
+            numpy.random.seed(len(chunk))
+            result.extend(peaks._process_groups(chunk, **options)[0])
+        peaks.PS_CACHE.clear()
+        self.assertEqual(sorted(result), sorted(expected))
+
+    def test_get_analytic_distrib(self):
+        """
+        Analytic distribution is close to the permutation one for large groups.
+        """
+        numpy.random.seed(0)
+        expected = peaks.get_avg_rnd_distrib(2000, 500, 3, perms=500)
+        result = peaks.get_analytic_distrib(2000, 500, 3)
+        # Repeat the same call, so also lines that use cache are executed:
+        result = peaks.get_analytic_distrib(2000, 500, 3)
+
+        self.assertEqual(result[:2], [1.0, 1.0])
+        self.assertTrue(all(first >= second for first, second in zip(result, result[1:])))
+        for res, exp in zip(result, expected + [0.0] * len(result)):
+            self.assertAlmostEqual(res, exp, delta=0.02)
+
+    def test_run_invalid_background(self):
+        with self.assertRaisesRegex(ValueError, 'Background should be'):
+            peaks.run('annotation.gtf', 'sites.bed', 'peaks.bed', background='uniform')
+
     def test_run(self):
         fin_annotation = make_file_from_list([
             ['1', '.', 'gene', '10', '20', '.', '+', '.', 'gene_name "A"; gene_id "1";'],
@@ -103,19 +222,71 @@ class TestPeaks(unittest.TestCase):
         # Remove header:
         out_scores = out_scores[1:]
 
+        # No cross-link is significant at the default FDR in such a short gene:
+        expected_peaks = []
+        expected_scores = [
+            ['1', '14', '+', 'A', '1', '3', '8', '0.105043'],
+            ['1', '16', '+', 'A', '1', '5', '8', '0.105043'],
+            ['2', '16', '+', 'not_annotated', 'not_annotated', '5', 'not_calculated', '1'],
+        ]
+
+        self.assertEqual(out_peaks, expected_peaks)
+        self.assertEqual(out_scores, expected_scores)
+
+    def test_run_significant(self):
+        fin_annotation = make_file_from_list([
+            ['1', '.', 'gene', '10', '60', '.', '+', '.', 'gene_name "A"; gene_id "1";'],
+            ['1', '.', 'transcript', '10', '60', '.', '+', '.', 'gene_name "B"; gene_id "1";'],
+        ])
+
+        fin_sites = make_file_from_list([
+            ['1', '14', '15', '.', '3', '+'],
+            ['1', '16', '17', '.', '5', '+'],
+            ['1', '40', '41', '.', '1', '+'],
+        ])
+
+        fout_peaks = get_temp_file_name(extension='.bed.gz')
+        fout_scores = get_temp_file_name(extension='.tsv.gz')
+
+        peaks.run(fin_annotation, fin_sites, fout_peaks,
+                  scores=fout_scores)
+
+        out_peaks = make_list_from_file(fout_peaks, fields_separator='\t')
+        out_scores = make_list_from_file(fout_scores, fields_separator='\t')[1:]
+
         expected_peaks = [
             ['1', '14', '15', 'A-1', '3', '+'],
             ['1', '16', '17', 'A-1', '5', '+'],
         ]
         expected_scores = [
-            ['1', '14', '+', 'A', '1', '3', '8', '0.036198'],
-            ['1', '16', '+', 'A', '1', '5', '8', '0.036198'],
-            ['2', '16', '+', 'not_annotated', 'not_annotated', '5', 'not_calculated', '1'],
+            ['1', '14', '+', 'A', '1', '3', '8', '0'],
+            ['1', '16', '+', 'A', '1', '5', '8', '0'],
+            ['1', '40', '+', 'A', '1', '1', '1', '1'],
         ]
 
         self.assertEqual(out_peaks, expected_peaks)
         self.assertEqual(out_scores, expected_scores)
 
+    def test_run_workers(self):
+        fin_annotation = make_file_from_list([
+            ['1', '.', 'gene', '10', '200', '.', '+', '.', 'gene_name "A"; gene_id "1";'],
+            ['1', '.', 'gene', '300', '320', '.', '+', '.', 'gene_name "B"; gene_id "2";'],
+            ['1', '.', 'gene', '400', '450', '.', '-', '.', 'gene_name "C"; gene_id "3";'],
+        ])
+        fin_sites = make_file_from_list(
+            [['1', str(pos), str(pos + 1), '.', str(pos % 7 + 1), '+'] for pos in range(20, 320, 3)] +
+            [['1', str(pos), str(pos + 1), '.', str(pos % 5 + 1), '-'] for pos in range(400, 440, 2)]
+        )
+
+        outputs = []
+        for workers in [1, 2]:
+            fout_scores = get_temp_file_name(extension='.tsv.gz')
+            peaks.run(fin_annotation, fin_sites, get_temp_file_name(extension='.bed.gz'), scores=fout_scores,
+                      workers=workers)
+            outputs.append(make_list_from_file(fout_scores, fields_separator='\t'))
+            peaks.PS_CACHE.clear()
+        self.assertEqual(outputs[0], outputs[1])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -7,11 +7,16 @@ from unittest.mock import patch  # pylint: disable=unused-import
 from pybedtools import create_interval_from_list, BedTool
 
 import iCount  # pylint: disable=unused-import
-from iCount.genomes import segment
+from iCount.genomes import compiled, gtf, segment
 from iCount.tests.utils import list_to_intervals, intervals_to_list, reverse_strand, make_file_from_list, \
     make_list_from_file, get_temp_file_name, get_temp_dir
 
 
+def list_to_records(data):
+    """Transform list of lists to list of GTF records."""
+    return [gtf._GtfRecord.from_fields(list_) for list_ in data]
+
+
 class TestConstructBorders(unittest.TestCase):
 
     def setUp(self):
@@ -281,6 +286,48 @@ class TestMakeRegionsFile(unittest.TestCase):
                 ';'.join(sorted(exp[8].split(';'))),
             )
 
+    def test_strands_and_templates(self):
+        """
+        Regions of both strands are sorted by start, templates are made from regions.
+        """
+        segmentation_file = make_file_from_list([
+            ['1', '.', 'gene', '11', '30', '.', '-', '.', 'biotype "TEC"; gene_name "B"; gene_id "Y";'],
+            ['1', '.', 'transcript', '11', '30', '.', '-', '.', 'biotype "TEC"; gene_name "B"; gene_id "Y";'],
+            ['1', '.', 'ncRNA', '11', '20', '.', '-', '.', 'biotype "TEC"; gene_name "B"; gene_id "Y";'],
+            ['1', '.', 'ncRNA', '21', '30', '.', '-', '.', 'biotype "TEC"; gene_name "B"; gene_id "Y";'],
+            ['1', '.', 'gene', '21', '40', '.', '+', '.', 'biotype "miRNA"; gene_name "A"; gene_id "X";'],
+            ['1', '.', 'transcript', '21', '40', '.', '+', '.', 'biotype "miRNA"; gene_name "A"; gene_id "X";'],
+            ['1', '.', 'ncRNA', '21', '40', '.', '+', '.', 'biotype "miRNA"; gene_name "A"; gene_id "X";'],
+            ['1', '.', 'intergenic', '1', '20', '.', '+', '.', 'gene_id ".";'],
+            ['1', '.', 'intergenic', '1', '10', '.', '-', '.', 'gene_id ".";'],
+            ['1', '.', 'intergenic', '31', '40', '.', '-', '.', 'gene_id ".";'],
+            ['2', '.', 'intergenic', '1', '40', '.', '+', '.', 'gene_id ".";'],
+        ], bedtool=False)
+        segment.make_regions(segmentation_file, self.dir)
+
+        self.assertEqual(make_list_from_file(os.path.join(self.dir, segment.REGIONS_FILE), fields_separator='\t'), [
+            ['1', '.', 'intergenic', '1', '20', '.', '+', '.', 'gene_id ".";gene_name "None";biotype "";'],
+            ['1', '.', 'intergenic', '1', '10', '.', '-', '.', 'gene_id ".";gene_name "None";biotype "";'],
+            ['1', '.', 'ncRNA', '11', '30', '.', '-', '.', 'gene_id "Y";gene_name "B";biotype "lncRNA";'],
+            ['1', '.', 'ncRNA', '21', '40', '.', '+', '.', 'gene_id "X";gene_name "A";biotype "miRNA";'],
+            ['1', '.', 'intergenic', '31', '40', '.', '-', '.', 'gene_id ".";gene_name "None";biotype "";'],
+            ['2', '.', 'intergenic', '1', '40', '.', '+', '.', 'gene_id ".";gene_name "None";biotype "";'],
+        ])
+        self.assertEqual(make_list_from_file(os.path.join(self.dir, segment.TEMPLATE_TYPE), '\t'), [
+            ['ncRNA', '40'],
+            ['intergenic', '80'],
+        ])
+        self.assertEqual(make_list_from_file(os.path.join(self.dir, segment.TEMPLATE_SUBTYPE), '\t'), [
+            ['ncRNA lncRNA', '20'],
+            ['ncRNA miRNA', '20'],
+            ['intergenic', '80'],
+        ])
+        self.assertEqual(make_list_from_file(os.path.join(self.dir, segment.TEMPLATE_GENE), '\t'), [
+            ['.', 'None', '80'],
+            ['X', 'A', '20'],
+            ['Y', 'B', '20'],
+        ])
+
 
 class TestOtherFunctions(unittest.TestCase):
 
@@ -311,40 +358,49 @@ class TestOtherFunctions(unittest.TestCase):
         self.assertFalse(segment._a_in_b(first, second))
 
     def test_get_biotype(self):
-        transcript_ensembl = create_interval_from_list(
+        transcript_ensembl = gtf._GtfRecord.from_fields(
             ['1', '.', 'gene', '1', '200', '.', '+', '.', 'transcript_biotype "T";'])
-        transcript_gencode = create_interval_from_list(
+        transcript_gencode = gtf._GtfRecord.from_fields(
             ['1', '.', 'gene', '1', '200', '.', '+', '.', 'transcript_type "T";'])
         self.assertEqual(segment._get_biotype(transcript_ensembl), 'T')
         self.assertEqual(segment._get_biotype(transcript_gencode), 'T')
 
-        gene_ensembl = create_interval_from_list(
+        gene_ensembl = gtf._GtfRecord.from_fields(
             ['1', '.', 'gene', '1', '200', '.', '+', '.', 'gene_biotype "G";'])
-        gene_gencode = create_interval_from_list(
+        gene_gencode = gtf._GtfRecord.from_fields(
             ['1', '.', 'gene', '1', '200', '.', '+', '.', 'gene_type "G";'])
         self.assertEqual(segment._get_biotype(gene_ensembl), 'G')
         self.assertEqual(segment._get_biotype(gene_gencode), 'G')
 
-        gene_ensembl_old = create_interval_from_list(
+        gene_ensembl_old = gtf._GtfRecord.from_fields(
             ['1', 'Q', 'gene', '1', '200', '.', '+', '.', 'gene_id "1";'])
         self.assertEqual(segment._get_biotype(gene_ensembl_old), 'Q')
 
     def test_add_biotype_value(self):
-        interval = create_interval_from_list(['1', '.', 'gene', '1', '200', '.', '+', '.', 'gene_id "1";'])
+        interval = gtf._GtfRecord.from_fields(['1', '.', 'gene', '1', '200', '.', '+', '.', 'gene_id "1";'])
         interval_new = segment._add_biotype_value(interval, 'my_biotype')
         self.assertEqual(interval_new.attrs['biotype'], 'my_biotype')
 
+        # Column 9 is written as by pybedtools in previous versions:
+        interval = gtf._GtfRecord.from_fields(
+            ['1', '.', 'CDS', '1', '200', '.', '+', '.', 'gene_id "1"; transcript_biotype "T";'])
+        self.assertEqual(segment._add_biotype_value(interval, 'T')[8],
+                         'gene_id "1"; transcript_biotype "T"; biotype "T";')
+        self.assertEqual(segment._get_biotype(interval), 'T')
+        self.assertEqual(segment._add_biotype_value(interval, 'T')[8],
+                         'gene_id "1";transcript_biotype "T"; biotype "T";')
+
     def test_add_biotype_attribute1(self):
         gene_content = {
-            'gene': create_interval_from_list(
+            'gene': gtf._GtfRecord.from_fields(
                 ['1', '.', 'gene', '1', '200', '.', '+', '.', 'gene_biotype "G";']
             ),
-            'transcript1': list_to_intervals([
+            'transcript1': list_to_records([
                 ['1', '.', 'CDS', '1', '5', '.', '+', '.', 'gene_biotype "G"; transcript_biotype "A";'],
                 ['1', '.', 'ncRNA', '1', '5', '.', '+', '.', 'gene_biotype "G"; transcript_biotype "A";'],
                 ['1', '.', 'intron', '1', '5', '.', '+', '.', '.'],
             ]),
-            'transcript2': list_to_intervals([
+            'transcript2': list_to_records([
                 ['1', '.', 'ncRNA', '1', '5', '.', '+', '.', 'gene_biotype "G"; transcript_biotype "B";'],
                 ['1', '.', 'intron', '1', '5', '.', '+', '.', '.'],
             ]),
@@ -364,7 +420,7 @@ class TestOtherFunctions(unittest.TestCase):
                     self.assertEqual(interval.attrs['biotype'], 'B')
 
     def test_check_consistency_pass(self):  # pylint: disable=no-self-use
-        intervals = list_to_intervals([
+        intervals = list_to_records([
             ['1', '.', 'transcript', '1', '100', '.', '+', '.', '.'],
             ['1', '.', 'UTR5', '1', '9', '.', '+', '.', '.'],
             ['1', '.', 'CDS', '10', '49', '.', '+', '.', '.'],
@@ -381,7 +437,7 @@ class TestOtherFunctions(unittest.TestCase):
         """
         No transcript interval.
         """
-        intervals = [create_interval_from_list(['1', '.', 'UTR5', '1', '9', '.', '+', '.', '.'])]
+        intervals = [gtf._GtfRecord.from_fields(['1', '.', 'UTR5', '1', '9', '.', '+', '.', '.'])]
 
         message = "No transcript interval in list of intervals."
         with self.assertRaisesRegex(ValueError, message):
@@ -391,7 +447,7 @@ class TestOtherFunctions(unittest.TestCase):
         """
         Overlaping intervals.
         """
-        intervals = list_to_intervals([
+        intervals = list_to_records([
             ['1', '.', 'transcript', '1', '100', '.', '+', '.', '.'],
             ['1', '.', 'UTR5', '1', '50', '.', '+', '.', '.'],
             ['1', '.', 'CDS', '50', '100', '.', '+', '.', '.'],
@@ -404,7 +460,7 @@ class TestOtherFunctions(unittest.TestCase):
         """
         Unallowed order of types.
         """
-        intervals = list_to_intervals([
+        intervals = list_to_records([
             ['1', '.', 'transcript', '1', '100', '.', '+', '.', '.'],
             ['1', '.', 'UTR3', '1', '49', '.', '+', '.', '.'],
             ['1', '.', 'CDS', '50', '100', '.', '+', '.', '.'],
@@ -413,29 +469,18 @@ class TestOtherFunctions(unittest.TestCase):
         with self.assertRaises(AssertionError):
             segment._check_consistency(intervals)
 
-    def test_filter_col8(self):
-        interval = list_to_intervals([
-            ['1', '.', 'CDS', '1', '2', '.', '+', '.', 'gene_name "B"; transcript_id "A"; key42 "A"; key43: "?";'],
-        ])[0]
-
-        expected = 'gene_name "B"; transcript_id "A";'
-        self.assertEqual(segment._filter_col8(interval), expected)
-
-        expected = 'gene_name "B"; key42 "A";'
-        self.assertEqual(segment._filter_col8(interval, keys=['gene_name', 'key42']), expected)
-
     def test_get_introns(self):
-        exons = list_to_intervals([
+        exons = list_to_records([
             ['1', '.', 'exon', '1', '10', '.', '+', '.', 'transcript_id "42"; exon_number "1"'],
             ['1', '.', 'exon', '20', '30', '.', '+', '.', 'gene_name "42"; '],
             ['1', '.', 'exon', '40', '50', '.', '+', '.', 'gene_id "FHIT"; useless_data "3"'],
         ])
 
-        expected = list_to_intervals([
-            ['1', '.', 'exon', '11', '19', '.', '+', '.', 'transcript_id "42";'],
-            ['1', '.', 'exon', '31', '39', '.', '+', '.', 'gene_id "FHIT";'],
-        ])
-        self.assertEqual(segment._get_introns(exons), expected)
+        expected = [
+            ['1', '.', 'intron', '11', '19', '.', '+', '.', 'transcript_id "42";'],
+            ['1', '.', 'intron', '31', '39', '.', '+', '.', 'transcript_id "42";'],
+        ]
+        self.assertEqual(intervals_to_list(segment._get_introns(exons)), expected)
 
 
 class TestGetNonCdsExons(unittest.TestCase):
@@ -452,17 +497,17 @@ class TestGetNonCdsExons(unittest.TestCase):
             * 1 exons shared by UTR5 and CDS
             * 1 exons shared by UTR3 and CDS
         """
-        intervals = list_to_intervals([
+        intervals = list_to_records([
             # for this test no more than one interval is needed...
             ['1', '.', 'transcript', '20', '90', '.', '+', '.', '.'],
         ])
-        exons = list_to_intervals([
+        exons = list_to_records([
             ['1', '.', 'exon', '20', '30', '.', '+', '.', '.'],
             ['1', '.', 'exon', '40', '50', '.', '+', '.', '.'],
             ['1', '.', 'exon', '60', '70', '.', '+', '.', '.'],
             ['1', '.', 'exon', '80', '90', '.', '+', '.', '.'],
         ])
-        cdses = list_to_intervals([
+        cdses = list_to_records([
             ['1', '.', 'CDS', '45', '50', '.', '+', '.', '.'],
             ['1', '.', 'CDS', '60', '65', '.', '+', '.', '.'],
         ])
@@ -483,7 +528,7 @@ class TestGetNonCdsExons(unittest.TestCase):
         self.assertEqual(expeted_utrs, utrs)
 
         # Also test for negative strand:
-        intervals, exons, cdses = map(reverse_strand, [intervals, exons, cdses])
+        intervals, exons, cdses = [list_to_records(reverse_strand(data)) for data in [intervals, exons, cdses]]
 
         expeted_new_cdses = reverse_strand(expeted_new_cdses)
         expeted_utrs = [
@@ -503,16 +548,16 @@ class TestGetNonCdsExons(unittest.TestCase):
         Situation:
             * stop codon and CDS completely overlap
         """
-        intervals = list_to_intervals([
+        intervals = list_to_records([
             # for this test no more than is needed...
             ['1', '.', 'transcript', '20', '62', '.', '+', '.', '.'],
             ['1', '.', 'stop_codon', '60', '62', '.', '+', '.', '.'],
         ])
-        exons = list_to_intervals([
+        exons = list_to_records([
             ['1', '.', 'exon', '20', '40', '.', '+', '.', '.'],
             ['1', '.', 'exon', '60', '62', '.', '+', '.', '.'],
         ])
-        cdses = list_to_intervals([
+        cdses = list_to_records([
             ['1', '.', 'CDS', '20', '40', '.', '+', '.', '.'],
             ['1', '.', 'CDS', '60', '62', '.', '+', '.', '.'],
         ])
@@ -528,16 +573,16 @@ class TestGetNonCdsExons(unittest.TestCase):
         self.assertEqual(expeted_utrs, utrs)
 
         # Negative strand:
-        intervals = list_to_intervals([
+        intervals = list_to_records([
             # for this test no more than is needed...
             ['1', '.', 'transcript', '20', '80', '.', '-', '.', '.'],
             ['1', '.', 'stop_codon', '20', '22', '.', '-', '.', '.'],
         ])
-        exons = list_to_intervals([
+        exons = list_to_records([
             ['1', '.', 'exon', '20', '22', '.', '+', '.', '.'],
             ['1', '.', 'exon', '60', '80', '.', '+', '.', '.'],
         ])
-        cdses = list_to_intervals([
+        cdses = list_to_records([
             ['1', '.', 'CDS', '20', '22', '.', '-', '.', '.'],
             ['1', '.', 'CDS', '60', '80', '.', '-', '.', '.'],
         ])
@@ -557,15 +602,15 @@ class TestGetNonCdsExons(unittest.TestCase):
         Situation:
             * 1 stop codon given on same exon as CDS
         """
-        intervals = list_to_intervals([
+        intervals = list_to_records([
             # for this test no more than one interval is needed...
             ['1', '.', 'transcript', '60', '70', '.', '+', '.', '.'],
             ['1', '.', 'stop_codon', '63', '65', '.', '+', '.', '.'],
         ])
-        exons = list_to_intervals([
+        exons = list_to_records([
             ['1', '.', 'exon', '60', '70', '.', '+', '.', '.'],
         ])
-        cdses = list_to_intervals([
+        cdses = list_to_records([
             ['1', '.', 'CDS', '60', '62', '.', '+', '.', '.'],
         ])
 
@@ -581,15 +626,15 @@ class TestGetNonCdsExons(unittest.TestCase):
         self.assertEqual(expeted_utrs, utrs)
 
         # Negative strand:
-        intervals = list_to_intervals([
+        intervals = list_to_records([
             # for this test no more than one interval is needed...
             ['1', '.', 'transcript', '60', '70', '.', '-', '.', '.'],
             ['1', '.', 'stop_codon', '63', '65', '.', '-', '.', '.'],
         ])
-        exons = list_to_intervals([
+        exons = list_to_records([
             ['1', '.', 'exon', '60', '70', '.', '-', '.', '.'],
         ])
-        cdses = list_to_intervals([
+        cdses = list_to_records([
             ['1', '.', 'CDS', '66', '70', '.', '-', '.', '.'],
         ])
 
@@ -609,15 +654,15 @@ class TestGetNonCdsExons(unittest.TestCase):
         Situation:
             * 1 stop codon given on same exon as CDS, bit inside CDS!
         """
-        intervals = list_to_intervals([
+        intervals = list_to_records([
             # for this test no more than one interval is needed...
             ['1', '.', 'transcript', '60', '70', '.', '+', '.', '.'],
             ['1', '.', 'stop_codon', '63', '65', '.', '+', '.', '.'],
         ])
-        exons = list_to_intervals([
+        exons = list_to_records([
             ['1', '.', 'exon', '60', '70', '.', '+', '.', '.'],
         ])
-        cdses = list_to_intervals([
+        cdses = list_to_records([
             ['1', '.', 'CDS', '60', '65', '.', '+', '.', '.'],
         ])
 
@@ -633,15 +678,15 @@ class TestGetNonCdsExons(unittest.TestCase):
         self.assertEqual(expeted_utrs, utrs)
 
         # Negative strand:
-        intervals = list_to_intervals([
+        intervals = list_to_records([
             # for this test no more than one interval is needed...
             ['1', '.', 'transcript', '60', '70', '.', '-', '.', '.'],
             ['1', '.', 'stop_codon', '65', '67', '.', '-', '.', '.'],
         ])
-        exons = list_to_intervals([
+        exons = list_to_records([
             ['1', '.', 'exon', '60', '70', '.', '-', '.', '.'],
         ])
-        cdses = list_to_intervals([
+        cdses = list_to_records([
             ['1', '.', 'CDS', '65', '70', '.', '-', '.', '.'],
         ])
 
@@ -661,17 +706,17 @@ class TestGetNonCdsExons(unittest.TestCase):
         Situation:
             * 1 stop codon split in two exons
         """
-        intervals = list_to_intervals([
+        intervals = list_to_records([
             # for this test no more than one interval is needed...
             ['1', '.', 'transcript', '20', '70', '.', '+', '.', '.'],
             ['1', '.', 'stop_codon', '40', '40', '.', '+', '.', '.'],
             ['1', '.', 'stop_codon', '60', '61', '.', '+', '.', '.'],
         ])
-        exons = list_to_intervals([
+        exons = list_to_records([
             ['1', '.', 'exon', '20', '40', '.', '+', '.', '.'],
             ['1', '.', 'exon', '60', '70', '.', '+', '.', '.'],
         ])
-        cdses = list_to_intervals([
+        cdses = list_to_records([
             ['1', '.', 'CDS', '30', '39', '.', '+', '.', '.'],
         ])
 
@@ -689,17 +734,17 @@ class TestGetNonCdsExons(unittest.TestCase):
         self.assertEqual(expeted_utrs, utrs)
 
         # Negative strand:
-        intervals = list_to_intervals([
+        intervals = list_to_records([
             # for this test no more than one interval is needed...
             ['1', '.', 'transcript', '20', '80', '.', '-', '.', '.'],
             ['1', '.', 'stop_codon', '39', '40', '.', '-', '.', '.'],
             ['1', '.', 'stop_codon', '60', '60', '.', '-', '.', '.'],
         ])
-        exons = list_to_intervals([
+        exons = list_to_records([
             ['1', '.', 'exon', '20', '40', '.', '-', '.', '.'],
             ['1', '.', 'exon', '60', '80', '.', '-', '.', '.'],
         ])
-        cdses = list_to_intervals([
+        cdses = list_to_records([
             ['1', '.', 'CDS', '61', '65', '.', '-', '.', '.'],
         ])
 
@@ -726,7 +771,7 @@ class TestProcessTranscriptGroup(unittest.TestCase):
         """
         Fail if no exons are given.
         """
-        intervals = list_to_intervals([
+        intervals = list_to_records([
             ['1', '.', 'transcript', '1', '100', '.', '+', '.', '.'],
         ])
 
@@ -738,7 +783,7 @@ class TestProcessTranscriptGroup(unittest.TestCase):
         If not transcript interval is given, it is determined by function
         Also this is the case if no CDS are given - all exons turn to ncRNA.
         """
-        intervals = list_to_intervals([
+        intervals = list_to_records([
             ['1', '.', 'exon', '1', '30', '.', '+', '.', 'exon_number "1";'],
             ['1', '.', 'exon', '60', '100', '.', '+', '.', 'exon_number "2";'],
         ])
@@ -753,143 +798,54 @@ class TestProcessTranscriptGroup(unittest.TestCase):
         output = intervals_to_list(segment._process_transcript_group(intervals))
         self.assertEqual(output, expected)
 
-    @unittest.mock.patch('builtins.print')
-    def test_fail_validating(self, print_mock):
+    def test_fail_validating(self):
         """
-        Fail on validation.
-
-        Mock the print function to suppress the actual printing during test.
+        Fail on validation, input and segmentation of transcript are logged.
         """
-        intervals = list_to_intervals([
+        intervals = list_to_records([
             ['1', '.', 'transcript', '1', '200', '.', '+', '.', 'transcript_id "42";'],
             ['1', '.', 'exon', '1', '30', '.', '+', '.', 'exon_number "1";'],
             ['1', '.', 'exon', '60', '100', '.', '+', '.', 'exon_number "2";'],
         ])
 
-        with self.assertRaises(AssertionError):
+        with self.assertLogs('iCount.genomes.segment', level='ERROR') as logs, self.assertRaises(AssertionError):
             segment._process_transcript_group(intervals)
-        self.assertEqual(print_mock.call_count, 8)
-
-
-class TestComplement(unittest.TestCase):
-
-    def setUp(self):
-        warnings.simplefilter("ignore", ResourceWarning)
-
-    def test_complement(self):
-
-        genome_file = make_file_from_list(
-            [
-                ['1', '2000'],
-                ['2', '1000'],
-                ['MT', '500'],
-            ], bedtool=False)
-
-        genes = list_to_intervals([
-            ['1', '.', 'gene1', '200', '400', '.', '+', '.', '.'],
-            ['1', '.', 'gene2', '300', '600', '.', '+', '.', '.'],
-            ['1', '.', 'gene3', '200', '500', '.', '+', '.', '.'],
-            ['2', '.', 'gene4', '100', '200', '.', '+', '.', '.'],
-            ['2', '.', 'gene5', '100', '300', '.', '-', '.', '.'],
-        ])
-
-        complement = make_list_from_file(segment._complement(genes, genome_file, '+'), fields_separator='\t')
-
-        empty_col8 = 'ID "inter%s"; gene_id "."; transcript_id ".";'
-        expected = [
-            ['1', '.', 'intergenic', '1', '199', '.', '+', '.', empty_col8 % "P00000"],
-            ['1', '.', 'intergenic', '601', '2000', '.', '+', '.', empty_col8 % "P00001"],
-            ['2', '.', 'intergenic', '1', '99', '.', '+', '.', empty_col8 % "P00002"],
-            ['2', '.', 'intergenic', '201', '1000', '.', '+', '.', empty_col8 % "P00003"],
-            ['MT', '.', 'intergenic', '1', '500', '.', '+', '.', empty_col8 % "P00004"],
-        ]
-
-        self.assertEqual(complement, expected)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('transcript_id "42";', logs.output[0])
 
 
-class TestGetGeneContent(unittest.TestCase):
+class TestSegmentGenes(unittest.TestCase):
 
     def setUp(self):
         warnings.simplefilter("ignore", ResourceWarning)
 
-    def test_all_good(self):
-        """
-        * second gene has no 'gene' interval - but it is present in output as it should
-        * last interval is on chromosome 2, but it is not in the output
-        """
-        gtf_data = list_to_intervals([
-            ['1', '.', 'gene', '100', '300', '.', '+', '.', 'gene_id "G1";'],
-            ['1', '.', 'transcript', '100', '250', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
-            ['1', '.', 'exon', '100', '150', '.', '+', '.', 'gene_id "G1"; transcript_id "T1"; exon_number "1";'],
-            ['1', '.', 'exon', '200', '250', '.', '+', '.', 'gene_id "G1"; transcript_id "T1"; exon_number "2";'],
-            ['1', '.', 'transcript', '150', '300', '.', '+', '.', 'gene_id "G1"; transcript_id "T2";'],
-            ['1', '.', 'exon', '150', '200', '.', '+', '.', 'gene_id "G1"; transcript_id "T2"; exon_number "1";'],
-            ['1', '.', 'exon', '250', '300', '.', '+', '.', 'gene_id "G1"; transcript_id "T2"; exon_number "2";'],
-            ['1', '.', 'transcript', '400', '500', '.', '+', '.', 'gene_id "G2"; transcript_id "T3";'],
-            ['1', '.', 'exon', '400', '430', '.', '+', '.', 'gene_id "G2"; transcript_id "T3"; exon_number "1"'],
-            ['1', '.', 'CDS', '410', '430', '.', '+', '.', 'gene_id "G2"; transcript_id "T3";'],
-            ['1', '.', 'exon', '470', '500', '.', '+', '.', 'gene_id "G2"; transcript_id "T3"; exon_number "2"'],
-            ['1', '.', 'CDS', '470', '490', '.', '+', '.', 'gene_id "G2"; transcript_id "T3";'],
-            ['2', '.', 'CDS', '470', '490', '.', '+', '.', 'gene_id "G3"; transcript_id "T4";'],
-        ])
-        gtf = make_file_from_list(intervals_to_list(gtf_data))
-
-        gene1, gene2 = list(segment._get_gene_content(gtf, ['1', 'MT'], report_progress=True))
-
-        expected1 = {
-            'gene': gtf_data[0],
-            'T1': gtf_data[1:4],
-            'T2': gtf_data[4:7],
-        }
-
-        extra_gene = create_interval_from_list(['1', '.', 'gene', '400', '500', '.', '+', '.', 'gene_id "G2";'])
-        expected2 = {
-            'gene': extra_gene,
-            'T3': gtf_data[7:-1],
-        }
-
-        self.assertEqual(gene1, expected1)
-        self.assertEqual(gene2, expected2)
-
-    def test_already_processed(self):
-        """
-        Raise error if member of already processed transcript is found.
-        """
-        gtf = make_file_from_list([
-            ['1', '.', 'gene', '100', '300', '.', '+', '.', 'gene_id "G1";'],
-            ['1', '.', 'transcript', '100', '250', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
-            ['1', '.', 'transcript', '150', '300', '.', '+', '.', 'gene_id "G1"; transcript_id "T2";'],
-            ['1', '.', 'exon', '150', '200', '.', '+', '.', 'gene_id "G1"; transcript_id "T1"; exon_number "1";'],
-        ])
-
-        with self.assertRaises(AssertionError):
-            next((segment._get_gene_content(gtf, ['1', 'MT'])))
-
-    def test_already_processed_gene(self):
+    def test_parallel(self):
         """
-        Raise error if member of already processed gene is found.
+        Genes are processed in the same way and yielded in the same order for
+        any number of workers, also if chromosomes are interleaved.
         """
-        gtf = make_file_from_list([
-            ['1', '.', 'gene', '100', '300', '.', '+', '.', 'gene_id "G1";'],
-            ['1', '.', 'transcript', '100', '250', '.', '+', '.', 'gene_id "G1"; transcript_id "T1";'],
-            ['1', '.', 'gene', '500', '700', '.', '+', '.', 'gene_id "G2";'],
-            ['1', '.', 'transcript', '500', '600', '.', '+', '.', 'gene_id "G1"; transcript_id "T3";'],
-        ])
+        data = []
+        for i, chrom in enumerate(['1', '2', '1', 'MT', '2', '1']):
+            gid, tid, start = 'G{}'.format(i), 'T{}'.format(i), 100 * i + 1
+            data.extend([
+                [chrom, '.', 'transcript', start, start + 60, '.', '+', '.',
+                 'gene_id "{}"; transcript_id "{}"; gene_biotype "protein_coding";'.format(gid, tid)],
+                [chrom, '.', 'exon', start, start + 20, '.', '+', '.',
+                 'gene_id "{}"; transcript_id "{}"; exon_number "1";'.format(gid, tid)],
+                [chrom, '.', 'CDS', start + 10, start + 20, '.', '+', '.',
+                 'gene_id "{}"; transcript_id "{}";'.format(gid, tid)],
+                [chrom, '.', 'exon', start + 40, start + 60, '.', '+', '.',
+                 'gene_id "{}"; transcript_id "{}"; exon_number "2";'.format(gid, tid)],
+            ])
+        gtf_file = make_file_from_list([list(map(str, line)) for line in data])
+        chromosomes = ['1', '2', 'MT']
 
-        with self.assertRaises(AssertionError):
-            list((segment._get_gene_content(gtf, ['1', 'MT'])))
+        expected = list(segment._segment_genes(gtf._get_gene_content(gtf_file, chromosomes)))
+        self.assertEqual([gene_id for gene_id, _ in expected], ['G0', 'G1', 'G2', 'G3', 'G4', 'G5'])
+        self.assertEqual(expected[0][1][-1][2], 'gene')
 
-    def test_no_required_attributes(self):
-        """
-        Raise error if transcript_id attribute is not present.
-        """
-        gtf = make_file_from_list([
-            ['1', '.', 'transcript', '500', '600', '.', '+', '.', 'gene_id "G1";'],
-        ])
-
-        message = "First element in gene content is neither gene or transcript!"
-        with self.assertRaisesRegex(Exception, message):
-            list((segment._get_gene_content(gtf, ['1', 'MT'])))
+        result = list(segment._segment_genes(gtf._get_gene_content(gtf_file, chromosomes), workers=2, chunk_size=1))
+        self.assertEqual(result, expected)
 
 
 class TestGetRegions(unittest.TestCase):
@@ -937,6 +893,82 @@ class TestGetRegions(unittest.TestCase):
 
         self.assertEqual(expected, gtf_out_data)
 
+    def test_cache(self):
+        """
+        Outputs are computed once and linked from cache on repeated calls.
+        """
+        gtf_in_file = make_file_from_list([
+            ['1', '.', 'transcript', '400', '500', '.', '+', '.', 'gene_id "G2"; transcript_id "T3";'],
+            ['1', '.', 'exon', '400', '500', '.', '+', '.', 'gene_id "G2"; transcript_id "T3"; exon_number "1";'],
+        ], bedtool=False)
+        genome_file = make_file_from_list([['1', '2000']], bedtool=False)
+        cache_dir = get_temp_dir()
+
+        expected_dir = get_temp_dir()
+        expected = segment.get_segments(gtf_in_file, os.path.join(expected_dir, 'seg.gtf'), genome_file)
+
+        for _ in range(2):
+            out_dir = get_temp_dir()
+            metrics = segment.get_segments(
+                gtf_in_file, os.path.join(out_dir, 'seg.gtf'), genome_file, cache=True, cache_dir=cache_dir)
+            self.assertEqual(metrics.genes, expected.genes)
+            for fname in ['seg.gtf', segment.REGIONS_FILE, segment.TEMPLATE_TYPE, segment.TEMPLATE_GENE]:
+                self.assertEqual(make_list_from_file(os.path.join(out_dir, fname)),
+                                 make_list_from_file(os.path.join(expected_dir, fname)))
+            self.assertTrue(os.path.isfile(os.path.join(out_dir, 'seg.gtf' + compiled.COMPILED_EXTENSION)))
+
+            # Cached outputs are not computed again:
+            with patch('iCount.genomes.segment._get_gene_content', side_effect=AssertionError):
+                segment.get_segments(
+                    gtf_in_file, os.path.join(out_dir, 'seg.gtf'), genome_file, cache=True, cache_dir=cache_dir)
+
+        # Writing (not cached) outputs does not change cached files:
+        segment.get_segments(gtf_in_file, os.path.join(out_dir, 'seg.gtf'),
+                             make_file_from_list([['1', '1000']], bedtool=False))
+        self.assertNotEqual(make_list_from_file(os.path.join(out_dir, 'seg.gtf')),
+                            make_list_from_file(os.path.join(expected_dir, 'seg.gtf')))
+        segment.get_segments(gtf_in_file, os.path.join(out_dir, 'seg.gtf'), genome_file, cache=True,
+                             cache_dir=cache_dir)
+        self.assertEqual(make_list_from_file(os.path.join(out_dir, 'seg.gtf')),
+                         make_list_from_file(os.path.join(expected_dir, 'seg.gtf')))
+
+    def test_incremental(self):
+        """
+        Only changed genes are processed, result is the same as for full segmentation.
+        """
+        def gene(gene_id, chrom, start, stop, strand='+'):
+            attrs = 'gene_id "{0}"; transcript_id "T{0}"; exon_number "1";'.format(gene_id)
+            return [
+                [chrom, '.', 'transcript', str(start), str(stop), '.', strand, '.', attrs],
+                [chrom, '.', 'exon', str(start), str(stop), '.', strand, '.', attrs],
+            ]
+
+        base_gtf = make_file_from_list(
+            gene('G1', '1', 100, 200) + gene('G2', '1', 150, 300, '-') + gene('G3', '1', 500, 600) +
+            gene('G4', 'MT', 100, 200), bedtool=False)
+        # G2 changes, G3 is removed and G5 is added:
+        new_gtf = make_file_from_list(
+            gene('G1', '1', 100, 200) + gene('G2', '1', 150, 400, '-') + gene('G5', '1', 700, 800) +
+            gene('G4', 'MT', 100, 200), bedtool=False)
+        genome_file = make_file_from_list([['1', '2000'], ['MT', '500']], bedtool=False)
+
+        expected_dir = get_temp_dir()
+        segment.get_segments(new_gtf, os.path.join(expected_dir, 'seg.gtf'), genome_file)
+
+        out_dir = get_temp_dir()
+        segmentation = os.path.join(out_dir, 'seg.gtf')
+        segment.get_segments(base_gtf, segmentation, genome_file)
+        with patch('iCount.genomes.segment._process_gene', wraps=segment._process_gene) as process_gene:
+            metrics = segment.get_segments(new_gtf, segmentation, genome_file, base_annotation=base_gtf)
+        self.assertEqual(sorted(call[0][0]['gene'].attrs['gene_id'] for call in process_gene.call_args_list),
+                         ['G2', 'G5'])
+        self.assertEqual(metrics.genes, 4)
+        self.assertEqual(metrics.genes_changed, 2)
+
+        for fname in ['seg.gtf', segment.REGIONS_FILE, segment.TEMPLATE_SUBTYPE, segment.TEMPLATE_GENE]:
+            self.assertEqual(make_list_from_file(os.path.join(out_dir, fname)),
+                             make_list_from_file(os.path.join(expected_dir, fname)))
+
 
 if __name__ == '__main__':
     unittest.main()
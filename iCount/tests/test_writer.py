@@ -0,0 +1,116 @@
+# pylint: disable=missing-docstring, protected-access
+import itertools
+import os
+import unittest
+import warnings
+
+from iCount.genomes import writer
+from iCount.tests.utils import list_to_intervals, make_file_from_list, make_list_from_file, get_temp_file_name
+
+
+class TestComplement(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+
+    def test_complement(self):
+
+        genome_file = make_file_from_list(
+            [
+                ['1', '2000'],
+                ['2', '1000'],
+                ['MT', '500'],
+            ], bedtool=False)
+
+        genes = list_to_intervals([
+            ['1', '.', 'gene1', '200', '400', '.', '+', '.', '.'],
+            ['1', '.', 'gene2', '300', '600', '.', '+', '.', '.'],
+            ['1', '.', 'gene3', '200', '500', '.', '+', '.', '.'],
+            ['2', '.', 'gene4', '100', '200', '.', '+', '.', '.'],
+            ['2', '.', 'gene5', '100', '300', '.', '-', '.', '.'],
+        ])
+
+        complement = make_list_from_file(writer._complement(genes, genome_file, '+'), fields_separator='\t')
+
+        empty_col8 = 'ID "inter%s"; gene_id "."; transcript_id ".";'
+        expected = [
+            ['1', '.', 'intergenic', '1', '199', '.', '+', '.', empty_col8 % "P00000"],
+            ['1', '.', 'intergenic', '601', '2000', '.', '+', '.', empty_col8 % "P00001"],
+            ['2', '.', 'intergenic', '1', '99', '.', '+', '.', empty_col8 % "P00002"],
+            ['2', '.', 'intergenic', '201', '1000', '.', '+', '.', empty_col8 % "P00003"],
+            ['MT', '.', 'intergenic', '1', '500', '.', '+', '.', empty_col8 % "P00004"],
+        ]
+
+        self.assertEqual(complement, expected)
+
+
+class TestSegmentationWriter(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+        self.genes = [
+            [
+                ['1', '.', 'transcript', '100', '300', '.', '+', '.', 'gene_id "G1";'],
+                ['1', '.', 'gene', '100', '300', '.', '+', '.', 'gene_id "G1";'],
+            ],
+            [
+                ['1', '.', 'transcript', '200', '250', '.', '-', '.', 'gene_id "G2";'],
+                ['1', '.', 'gene', '200', '250', '.', '-', '.', 'gene_id "G2";'],
+            ],
+            [
+                ['1', '.', 'gene', '301', '400', '.', '+', '.', 'gene_id "G3";'],
+            ],
+            [
+                ['2', '.', 'gene', '10', '20', '.', '-', '.', 'gene_id "G4";'],
+            ],
+        ]
+        self.chromosomes = [('2', 100), ('1', 1000), ('MT', 50)]
+        empty_col8 = 'ID "inter%s"; gene_id "."; transcript_id ".";'
+        self.expected = [
+            ['1', '.', 'intergenic', '1', '99', '.', '+', '.', empty_col8 % 'P00001'],
+            ['1', '.', 'intergenic', '1', '199', '.', '-', '.', empty_col8 % 'N00002'],
+            ['1', '.', 'transcript', '100', '300', '.', '+', '.', 'gene_id "G1";'],
+            ['1', '.', 'gene', '100', '300', '.', '+', '.', 'gene_id "G1";'],
+            ['1', '.', 'transcript', '200', '250', '.', '-', '.', 'gene_id "G2";'],
+            ['1', '.', 'gene', '200', '250', '.', '-', '.', 'gene_id "G2";'],
+            ['1', '.', 'intergenic', '251', '1000', '.', '-', '.', empty_col8 % 'N00003'],
+            ['1', '.', 'gene', '301', '400', '.', '+', '.', 'gene_id "G3";'],
+            ['1', '.', 'intergenic', '401', '1000', '.', '+', '.', empty_col8 % 'P00002'],
+            ['2', '.', 'intergenic', '1', '100', '.', '+', '.', empty_col8 % 'P00000'],
+            ['2', '.', 'intergenic', '1', '9', '.', '-', '.', empty_col8 % 'N00000'],
+            ['2', '.', 'gene', '10', '20', '.', '-', '.', 'gene_id "G4";'],
+            ['2', '.', 'intergenic', '21', '100', '.', '-', '.', empty_col8 % 'N00001'],
+            ['MT', '.', 'intergenic', '1', '50', '.', '+', '.', empty_col8 % 'P00003'],
+            ['MT', '.', 'intergenic', '1', '50', '.', '-', '.', empty_col8 % 'N00004'],
+        ]
+
+    def write(self, genes, **kwargs):
+        out_file = get_temp_file_name(extension='gtf')
+        with writer._SegmentationWriter(**kwargs) as seg_writer:
+            for fields in genes:
+                seg_writer.add(fields)
+            seg_writer.write(out_file, self.chromosomes)
+            runs = [run[0] for run in itertools.chain.from_iterable(seg_writer.runs.values())]
+        self.assertFalse(any(os.path.isfile(run) for run in runs))
+        return seg_writer, make_list_from_file(out_file, fields_separator='\t')
+
+    def test_sorted(self):
+        seg_writer, result = self.write(self.genes)
+        self.assertTrue(seg_writer.sorted)
+        self.assertEqual(result, self.expected)
+
+    def test_unsorted(self):
+        # Chromosome 1 is split and genes are not sorted by start:
+        genes = [self.genes[2], self.genes[3], self.genes[0], self.genes[1]]
+        seg_writer, result = self.write(genes, buffer_size=2)
+        self.assertFalse(seg_writer.sorted)
+        self.assertEqual(result, self.expected)
+
+    def test_gaps(self):
+        self.assertEqual(list(writer._gaps([], 10)), [(0, 10)])
+        self.assertEqual(list(writer._gaps([[5, 7], [0, 3], [2, 4], [7, 10]], 10)), [(4, 5)])
+        self.assertEqual(list(writer._gaps([[2, 4]], 4)), [(0, 2)])
+
+
+if __name__ == '__main__':
+    unittest.main()
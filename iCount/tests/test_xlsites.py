@@ -1,13 +1,17 @@
 # pylint: disable=missing-docstring, protected-access
 
+import os
 import warnings
 import unittest
 from unittest import mock
 
-import pybedtools
+import pysam
 
+from iCount import Metrics
+from iCount.genomes import compiled
 from iCount.mapping import xlsites
-from iCount.tests.utils import get_temp_file_name, make_bam_file
+from iCount.tests.utils import get_temp_dir, get_temp_file_name, make_bam_file, make_file_from_list, \
+    make_list_from_file
 
 
 class TestGetRandomBarcode(unittest.TestCase):
@@ -39,29 +43,6 @@ class TestGetRandomBarcode(unittest.TestCase):
         self.assertEqual(metrics.norandomer_recs, 1)
 
 
-class TestMatch(unittest.TestCase):
-
-    def setUp(self):
-        warnings.simplefilter("ignore", ResourceWarning)
-
-    def test_match_basic(self):
-        self.assertFalse(xlsites._match('ACGT', 'ACGG', 0))
-        self.assertTrue(xlsites._match('ACGT', 'ACGG', 1))
-
-    def test_match_unequal_len(self):
-        self.assertFalse(xlsites._match('AAAAA', 'AGNN', 1))
-        self.assertTrue(xlsites._match('AGNN', 'AAAAA', 2))
-
-    def test_capital_letters(self):
-        self.assertTrue(xlsites._match('AAAA', 'aaaa', 0))
-        self.assertTrue(xlsites._match('AAAA', 'anna', 0))
-        self.assertFalse(xlsites._match('AAAG', 'aaaa', 0))
-        self.assertTrue(xlsites._match('AAAG', 'aaaa', 1))
-        self.assertTrue(xlsites._match('AANG', 'aaaa', 1))
-
-        self.assertFalse(xlsites._match('AACGG', 'NAAAN', 1))
-
-
 class TestUpdate(unittest.TestCase):
 
     def setUp(self):
@@ -131,6 +112,37 @@ class TestMergeSimilarRandomers(unittest.TestCase):
         xlsites._merge_similar_randomers(by_bc, mismatches=1, ratio_th=0.4)  # 2/5
         self.assertEqual(by_bc, expected)
 
+    def test_merge_weak(self):
+        # Weak barcodes can absorb other weak barcodes with less support.
+        by_bc = {
+            'AAAAA': ['hit1', 'hit2', 'hit3', 'hit4', 'hit5', 'hit6', 'hit7', 'hit8', 'hit9', 'hit10'],
+            'CCCCC': ['hit11'],
+            'CCCCA': ['hit12'],
+            'CCCAA': ['hit13', 'hit14'],
+        }
+        expected = {
+            'AAAAA': ['hit1', 'hit2', 'hit3', 'hit4', 'hit5', 'hit6', 'hit7', 'hit8', 'hit9', 'hit10'],
+            'CCCAA': ['hit13', 'hit14', 'hit12'],
+            'CCCCC': ['hit11'],
+        }
+        xlsites._merge_similar_randomers(by_bc, mismatches=1, ratio_th=0.3)  # 3/10
+        self.assertEqual(by_bc, expected)
+
+    def test_merge_lowercase(self):
+        # Letter case is ignored, as in ``_match``:
+        by_bc = {
+            'AAAAA': ['hit1', 'hit2', 'hit3', 'hit4', 'hit5', 'hit6', 'hit7', 'hit8', 'hit9', 'hit10'],
+            'cccca': ['hit11', 'hit12'],
+            'CCCCC': ['hit13'],
+            'ccccc': ['hit14'],
+        }
+        expected = {
+            'AAAAA': ['hit1', 'hit2', 'hit3', 'hit4', 'hit5', 'hit6', 'hit7', 'hit8', 'hit9', 'hit10'],
+            'cccca': ['hit11', 'hit12', 'hit14', 'hit13'],
+        }
+        xlsites._merge_similar_randomers(by_bc, mismatches=1, ratio_th=0.3)  # 3/10
+        self.assertEqual(by_bc, expected)
+
     @unittest.skip
     def test_todo(self):
         """
@@ -249,37 +261,20 @@ class TestCollapse(unittest.TestCase):
         self.assertEqual(result2, expected2)
 
 
-class TestIntersectsWithAnnotaton(unittest.TestCase):
+class TestPositionAt(unittest.TestCase):
 
     def setUp(self):
         warnings.simplefilter("ignore", ResourceWarning)
 
-    def test_pos_strand(self):
-        segmentation = {
-            'gene_id_001': {
-                'tr_id_0001': [
-                    mock.MagicMock(start=100),
-                ],
-                'gene_segment': [],
-            }
-        }
-        self.assertTrue(
-            xlsites._intersects_with_annotaton(100, segmentation, 1, '+'))
-        self.assertFalse(
-            xlsites._intersects_with_annotaton(101, segmentation, 1, '+'))
-
-    def test_neg_strand(self):
-        segmentation = {
-            'gene_id_002': {
-                'tr_id_0003': [
-                    mock.MagicMock(stop=100),
-                ]
-            },
-        }
-        self.assertTrue(
-            xlsites._intersects_with_annotaton(100, segmentation, 2, '-'))
-        self.assertFalse(
-            xlsites._intersects_with_annotaton(101, segmentation, 2, '-'))
+    def test_position_at(self):
+        blocks = [(10, 13), (20, 22)]
+        positions = [10, 11, 12, 20, 21]
+        for idx in range(-5, 5):
+            self.assertEqual(xlsites._position_at(blocks, idx), positions[idx])
+        with self.assertRaises(IndexError):
+            xlsites._position_at(blocks, 5)
+        with self.assertRaises(IndexError):
+            xlsites._position_at(blocks, -6)
 
 
 class TestSecondStart(unittest.TestCase):
@@ -290,54 +285,95 @@ class TestSecondStart(unittest.TestCase):
         warnings.simplefilter("ignore", ResourceWarning)
 
     def test_second_start_segmentation(self):
-        segmentation = {
-            'G001': {
-                'gene_segment': [],
-                'T0001': [
-                    pybedtools.create_interval_from_list(
-                        ['1', '.', 'exon', '100', '200', '.', '+', '.',
-                         'gene_id: "G001"', 'transcript_id: "T0001"']),
-                ],
-            },
-            'G002': {
-                'gene_segment': [],
-                'T0002': [
-                    pybedtools.create_interval_from_list(
-                        ['1', '.', 'exon', '50', '100', '.', '-', '.',
-                         'gene_id: "G001"', 'transcript_id: "T0001"']),
-                ],
-            },
-        }
-
-        second_start, _ = xlsites._second_start(
-            read=0, poss=(1, 2, 99, 100), strand='+', chrom=1,
-            segmentation=segmentation, holesize_th=4)
+        seg = make_file_from_list(bedtool=False, data=[
+            ['1', '.', 'CDS', '100', '200', '.', '+', '.', 'gene_id "G001"; transcript_id "T0001";'],
+            ['1', '.', 'CDS', '50', '100', '.', '-', '.', 'gene_id "G002"; transcript_id "T0002";'],
+        ])
+        borders = compiled.SegmentationIndex(seg, excluded_types=['gene']).borders('1')
+
+        second_start, is_strange = xlsites._second_start(
+            read=0, blocks=[(1, 3), (99, 101)], strand='+', chrom=1,
+            borders=borders, holesize_th=4)
         self.assertEqual(second_start, 99)
+        self.assertFalse(is_strange)
 
-        second_start, _ = xlsites._second_start(
-            read=0, poss=(99, 100, 199, 200), strand='-', chrom=1,
-            segmentation=segmentation, holesize_th=4)
+        second_start, is_strange = xlsites._second_start(
+            read=0, blocks=[(99, 101), (199, 201)], strand='-', chrom=1,
+            borders=borders, holesize_th=4)
         self.assertEqual(second_start, 100)
+        self.assertFalse(is_strange)
 
-        second_start, _ = xlsites._second_start(
-            read=0, poss=(1, 2, 4, 5), strand='-', chrom=1,
-            segmentation=segmentation, holesize_th=4)
+        second_start, is_strange = xlsites._second_start(
+            read=0, blocks=[(1, 3), (4, 6)], strand='-', chrom=1,
+            borders=borders, holesize_th=4)
         self.assertEqual(second_start, 2)
+        self.assertTrue(is_strange)
+
+        # Blocks split by insertion only are adjacent - there is no hole:
+        second_start, is_strange = xlsites._second_start(
+            read=0, blocks=[(1, 3), (3, 5)], strand='+', chrom=1,
+            borders=borders, holesize_th=4)
+        self.assertEqual(second_start, 2)
+        self.assertFalse(is_strange)
 
     def test_second_start_no_seg(self):
         # If hole size is lower than holesize_th, strange should be empty:
         _, is_strange = xlsites._second_start(
-            read='the_read', poss=(1, 2, 5, 6), strand='+', chrom=1,
-            segmentation=None, holesize_th=1)
+            read='the_read', blocks=[(1, 3), (5, 7)], strand='+', chrom=1,
+            borders=None, holesize_th=1)
         self.assertTrue(is_strange)
 
         # If hole size is lower than holesize_th, strange should be empty:
         _, is_strange = xlsites._second_start(
-            read='the_read', poss=(1, 2, 5, 6), strand='+', chrom=1,
-            segmentation=None, holesize_th=2)
+            read='the_read', blocks=[(1, 3), (5, 7)], strand='+', chrom=1,
+            borders=None, holesize_th=2)
         self.assertFalse(is_strange)
 
 
+class TestPrepareBamFile(unittest.TestCase):
+
+    def setUp(self):
+        self.data = {
+            'chromosomes': [('chr1', 3000)],
+            'segments': [
+                ('_:rbc:AAA', 0, 0, 500, 255, [(0, 100)], {'NH': 1}),
+                ('_:rbc:CCC', 0, 0, 50, 255, [(0, 100)], {'NH': 1}),
+            ]}
+        warnings.simplefilter("ignore", ResourceWarning)
+
+    def make_sorted_bam(self):
+        bam_fname = make_bam_file(self.data, rnd_seed=0)
+        sorted_fname = get_temp_file_name(extension='bam')
+        pysam.sort('-o', sorted_fname, bam_fname)  # pylint: disable=no-member
+        return sorted_fname
+
+    def test_unsorted(self):
+        bam_fname = make_bam_file(self.data, rnd_seed=0)
+        bam_sorted, bam_index, tmp_files = xlsites._prepare_bam_file(bam_fname, threads=2)
+        self.assertNotEqual(bam_sorted, bam_fname)
+        self.assertEqual(tmp_files, [bam_sorted, bam_index])
+        with pysam.AlignmentFile(bam_sorted, index_filename=bam_index) as bamfile:  # pylint: disable=no-member
+            self.assertEqual([read.reference_start for read in bamfile.fetch('chr1')], [50, 500])
+
+    def test_sorted_and_indexed(self):
+        sorted_fname = self.make_sorted_bam()
+        pysam.index(sorted_fname)  # pylint: disable=no-member
+        with mock.patch('iCount.mapping.xlsites.pysam') as pysam_mock:
+            result = xlsites._prepare_bam_file(sorted_fname)
+            self.assertFalse(pysam_mock.sort.called)
+            self.assertFalse(pysam_mock.index.called)
+        self.assertEqual(result, (sorted_fname, sorted_fname + '.bai', []))
+
+    def test_sorted_not_indexed(self):
+        sorted_fname = self.make_sorted_bam()
+        with mock.patch('iCount.mapping.xlsites.pysam.sort') as sort_mock:
+            bam_sorted, bam_index, tmp_files = xlsites._prepare_bam_file(sorted_fname)
+            self.assertFalse(sort_mock.called)
+        self.assertEqual(bam_sorted, sorted_fname)
+        self.assertEqual(tmp_files, [bam_index])
+        self.assertTrue(os.path.isfile(bam_index))
+
+
 class TestProcessBamFile(unittest.TestCase):
 
     def setUp(self):
@@ -345,6 +381,10 @@ class TestProcessBamFile(unittest.TestCase):
         self.tmp = get_temp_file_name(extension='bam.gz')
         warnings.simplefilter("ignore", ResourceWarning)
 
+    def process(self, bam_fname, **kwargs):
+        return [(chrom_strand, progress, hits.by_position()) for chrom_strand, progress, hits in
+                xlsites._processs_bam_file(bam_fname, self.metrics, 10, self.tmp, **kwargs)]
+
     def test_unmapped(self):
         """
         Unmapped read (FLAG=4):
@@ -401,10 +441,10 @@ class TestProcessBamFile(unittest.TestCase):
                 ('_:rbc:CCC', 0, 0, 50, 255, [(0, 101)], {'NH': 1}),
             ],
         }, rnd_seed=0)
-        grouped = list(xlsites._processs_bam_file(bam_fname, self.metrics, 10, self.tmp))
+        grouped = self.process(bam_fname)
 
         expected = [
-            (('chr1', '+'), 0.0167, {49: {'CCC': [(100, 150, 101, 1, 0)]}}),
+            (('chr1', '+'), 1.0, {49: {'CCC': [(100, 150, 101, 1, 0)]}}),
             (('chr1', '-'), 1.0, {150: {'AAA': [(99, 50, 100, 1, 0)]}}),
         ]
         self.assertEqual(grouped, expected)
@@ -423,10 +463,10 @@ class TestProcessBamFile(unittest.TestCase):
                 ('_:rbc:GGG', 0, 0, 50, 255, [(0, 101)], {'NH': 1}),
             ],
         }, rnd_seed=0)
-        grouped = list(xlsites._processs_bam_file(bam_fname, self.metrics, 10, self.tmp))
+        grouped = self.process(bam_fname)
 
         expected = [
-            (('chr1', '+'), 0.0167, {
+            (('chr1', '+'), 1.0, {
                 49: {
                     'AAA': [(100, 150, 101, 1, 0)],
                     'CCC': [(100, 150, 101, 1, 0), (100, 150, 101, 1, 0)],
@@ -436,6 +476,217 @@ class TestProcessBamFile(unittest.TestCase):
         ]
         self.assertEqual(grouped, expected)
 
+    def test_streaming(self):
+        """
+        Complete positions are yielded when there are enough pending hits.
+        """
+        bam_fname = make_bam_file({
+            'chromosomes': [('chr1', 1000)],
+            'segments': [
+                # (qname, flag, refname, pos, mapq, cigar, tags)
+                ('_:rbc:AAA', 0, 0, 100, 255, [(0, 50)], {'NH': 1}),
+                ('_:rbc:CCC', 16, 0, 100, 255, [(0, 50)], {'NH': 1}),
+                ('_:rbc:GGG', 0, 0, 101, 255, [(0, 50)], {'NH': 1}),
+                ('_:rbc:TTT', 16, 0, 149, 255, [(0, 50)], {'NH': 1}),
+                ('_:rbc:AAA', 0, 0, 151, 255, [(0, 50)], {'NH': 1}),
+                ('_:rbc:CCC', 0, 0, 500, 255, [(0, 50)], {'NH': 1}),
+            ],
+        }, rnd_seed=0)
+        grouped = self.process(bam_fname, batch_size=1)
+
+        expected = [
+            (('chr1', '+'), 0.101, {99: {'AAA': [(125, 149, 50, 1, 0)]}}),
+            (('chr1', '+'), 0.149, {100: {'GGG': [(126, 150, 50, 1, 0)]}}),
+            (('chr1', '-'), 0.151, {150: {'CCC': [(124, 100, 50, 1, 0)]}}),
+            (('chr1', '+'), 0.5, {150: {'AAA': [(176, 200, 50, 1, 0)]}}),
+            # One hit remained on "-" strand after last flush, so next flush needs two:
+            (('chr1', '+'), 1.0, {499: {'CCC': [(525, 549, 50, 1, 0)]}}),
+            (('chr1', '-'), 1.0, {199: {'TTT': [(173, 149, 50, 1, 0)]}}),
+        ]
+        self.assertEqual(grouped, expected)
+
+
+class TestProcessBamFileParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.data = {
+            'chromosomes': [('chr1', 3000), ('chr2', 2000), ('chr3', 1000)],
+            'segments': [
+                # (qname, flag, refname, pos, mapq, cigar, tags)
+                ('name1:rbc:AAAA', 0, 0, 100, 255, [(0, 100)], {'NH': 1}),
+                ('name2:rbc:AAAT', 0, 0, 100, 255, [(0, 100)], {'NH': 1}),
+                ('name3:rbc:CCCC', 16, 0, 100, 255, [(0, 50), (3, 20), (0, 50)], {'NH': 1}),
+                ('name4:rbc:GGGG', 16, 0, 400, 255, [(0, 80)], {'NH': 3}),
+                ('name5:rbc:ACGT', 0, 1, 300, 255, [(0, 200)], {'NH': 2}),
+                ('name6:rbc:TTTT', 0, 1, 300, 255, [(0, 200)], {'NH': 1}),
+                ('name7', 16, 1, 500, 255, [(0, 60)], {'NH': 1}),
+                ('name8:ABC', 0, 2, 10, 255, [(0, 40)], {'NH': 1}),
+            ]}
+        self.tmp = get_temp_file_name(extension='bam')
+        warnings.simplefilter("ignore", ResourceWarning)
+
+    def serial(self, bam_fname, metrics, skipped):
+        unique, multi = {}, {}
+        for (chrom, strand), _, by_pos in xlsites._processs_bam_file(
+                bam_fname, metrics, 0, skipped):
+            unique_by_pos, multi_by_pos = xlsites._quantify(by_pos, 'start', 1, 0.1, 50)
+            xlsites._update(unique.setdefault((chrom, strand), {}), unique_by_pos)
+            xlsites._update(multi.setdefault((chrom, strand), {}), multi_by_pos)
+        return unique, multi
+
+    def test_same_as_serial(self):
+        bam_fname = make_bam_file(self.data, rnd_seed=0)
+        metrics_serial = Metrics(context='serial')
+        metrics_parallel = Metrics(context='parallel')
+        skipped_parallel = get_temp_file_name(extension='bam')
+
+        expected = self.serial(bam_fname, metrics_serial, self.tmp)
+        result = xlsites._process_bam_file_parallel(
+            bam_fname, metrics_parallel, 0, skipped_parallel, workers=2)
+
+        self.assertEqual(result, expected)
+        for name in ['all_recs', 'used_recs', 'invalidrandomer_recs', 'norandomer_recs',
+                     'strange_recs']:
+            self.assertEqual(getattr(metrics_parallel, name), getattr(metrics_serial, name))
+        self.assertEqual(list(metrics_parallel.bc_cn.items()), list(metrics_serial.bc_cn.items()))
+
+        # pylint: disable=no-member
+        with pysam.AlignmentFile(self.tmp) as serial_bam, \
+                pysam.AlignmentFile(skipped_parallel) as parallel_bam:
+            self.assertEqual(
+                [read.query_name for read in serial_bam.fetch(until_eof=True)],
+                [read.query_name for read in parallel_bam.fetch(until_eof=True)],
+            )
+
+    def test_tmp_dir(self):
+        bam_fname = make_bam_file(self.data, rnd_seed=0)
+        tmp_dir = get_temp_dir()
+        bam_sorted, bam_index, _ = xlsites._prepare_bam_file(bam_fname, tmp_dir=tmp_dir)
+
+        # Strange reads of each chromosome are stored in ``tmp_dir``:
+        result = xlsites._process_chromosome_worker(
+            (bam_sorted, bam_index, 'chr2', 0, None, 4, 'start', 1, 0.1, 50, tmp_dir))
+        self.assertEqual(os.path.dirname(result[4]), tmp_dir)
+
+        # ... and are removed after they are merged:
+        files = sorted(os.listdir(tmp_dir))
+        xlsites._process_bam_file_parallel(
+            bam_fname, Metrics(context='parallel'), 0, get_temp_file_name(extension='bam'), workers=2,
+            tmp_dir=tmp_dir)
+        self.assertEqual(sorted(os.listdir(tmp_dir)), files)
+
+    def test_merge_metrics(self):
+        metrics = Metrics(context='test')
+        xlsites._init_metrics(metrics)
+        metrics.used_recs = 3
+        metrics.bc_cn = {'AAA': 1, 'CCC': 2}
+        other = Metrics(context='test')
+        xlsites._init_metrics(other)
+        other.used_recs = 2
+        other.bc_cn = {'GGG': 5, 'AAA': 1}
+
+        xlsites._merge_metrics(metrics, other)
+        self.assertEqual(metrics.used_recs, 5)
+        self.assertEqual(list(metrics.bc_cn.items()), [('AAA', 2), ('CCC', 2), ('GGG', 5)])
+
+
+class TestCollapseByMultimax(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+
+    def test_same_as_collapse(self):
+        by_bc = {
+            'AAAAA': [
+                (5, 10, 10, 1, 0),
+                (5, 10, 10, 1, 0),
+                (40, 80, 80, 8, 0),
+                (5, 30, 20, 2, 20),
+            ],
+            'CCCCC': [
+                (5, 10, 10, 1, 0),
+                (25, 30, 10, 10, 0),
+                (25, 30, 30, 100, 0),
+            ],
+        }
+        for group_by in ['start', 'middle', 'end']:
+            for multimax in [1, 10, 50]:
+                result = xlsites._collapse_by_multimax(1, by_bc, group_by, multimax)
+                expected = (xlsites._collapse(1, by_bc, group_by, multimax=1),
+                            xlsites._collapse(1, by_bc, group_by, multimax=multimax))
+                self.assertEqual(result, expected)
+
+
+class TestQuantify(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+
+    def test_same_as_by_position(self):
+        barcodes = ['AAAA', 'AAAT', 'CCCC', 'NCCC', 'GGGG']
+        hits = xlsites._Hits(barcodes)
+        data = [
+            (10, 0, (15, 20, 10, 1, 0)),
+            (10, 1, (15, 20, 10, 1, 0)),
+            (10, 0, (18, 30, 20, 3, 25)),
+            (4, 2, (15, 20, 17, 1, 0)),
+            (10, 0, (15, 20, 10, 1, 0)),
+            (4, 3, (15, 25, 21, 2, 0)),
+            (4, 4, (15, 21, 10, 60, 0)),
+            (12, 4, (18, 30, 20, 3, 0)),
+        ]
+        for xlink_pos, barcode, read_data in data:
+            hits.append(xlink_pos, barcode, read_data)
+
+        for group_by in ['start', 'middle', 'end']:
+            expected_unique, expected_multi = {}, {}
+            for xlink_pos, by_bc in hits.by_position().items():
+                xlsites._merge_similar_randomers(by_bc, 1, ratio_th=0.1)
+                unique, multi = xlsites._collapse_by_multimax(xlink_pos, by_bc, group_by, 50)
+                xlsites._update(expected_unique, unique)
+                xlsites._update(expected_multi, multi)
+
+            unique, multi = xlsites._quantify(hits, group_by, 1, 0.1, 50)
+            self.assertEqual({pos: list(vals) for pos, vals in unique.items()}, expected_unique)
+            self.assertEqual({pos: list(vals) for pos, vals in multi.items()}, expected_multi)
+
+
+class TestSaveDict(unittest.TestCase):
+
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+        self.bed = {
+            ('chr2', '+'): {5: [1.0, 2], 1: [0.33333, 1]},
+            ('chr1', '-'): {10: [0.5, 1], 3: [2.25, 3]},
+            ('chr1', '+'): {10: [0.123456, 1]},
+        }
+        self.expected = [
+            ['chr1', '3', '4', '.', '2.25', '-'],
+            ['chr1', '10', '11', '.', '0.1235', '+'],
+            ['chr1', '10', '11', '.', '0.5', '-'],
+            ['chr2', '1', '2', '.', '0.3333', '+'],
+            ['chr2', '5', '6', '.', '1', '+'],
+        ]
+
+    def test_save(self):
+        fname = get_temp_file_name(extension='bed')
+        xlsites._save_dict(self.bed, fname, val_index=0)
+        self.assertEqual(make_list_from_file(fname, fields_separator='\t'), self.expected)
+
+        xlsites._save_dict(self.bed, fname, val_index=1)
+        self.assertEqual([line[4] for line in make_list_from_file(fname)], ['3', '1', '1', '1', '2'])
+
+    def test_save_gz(self):
+        fname = get_temp_file_name(extension='bed.gz')
+        xlsites._save_dict(self.bed, fname, val_index=0)
+        self.assertEqual(make_list_from_file(fname, fields_separator='\t'), self.expected)
+
+    def test_format_values(self):
+        self.assertEqual(
+            xlsites._format_values([1, 1.0, 0.5, 0.00004, 0.00005, 12.34567, 0.5]),
+            ['1', '1', '0.5', '0', '0.0001', '12.3457', '0.5'],
+        )
+
 
 class TestRun(unittest.TestCase):
 
@@ -493,6 +744,43 @@ class TestRun(unittest.TestCase):
         # Strange counter:
         self.assertEqual(result.strange_recs, 1)
 
+        self.assertEqual(make_list_from_file(unique_fname), [])
+        self.assertEqual(make_list_from_file(multi_fname), [
+            ['chr1', '99', '100', '.', '0.1429', '+'],
+            ['chr2', '299', '300', '.', '0.1818', '+'],
+        ])
+
+    def test_run_workers(self):
+        bam_fname = make_bam_file(self.data, rnd_seed=0)
+        outputs = []
+        for workers in [1, 2]:
+            unique_fname = get_temp_file_name(extension='bed')
+            multi_fname = get_temp_file_name(extension='bed')
+            strange_fname = get_temp_file_name(extension='bam')
+            result = xlsites.run(
+                bam_fname, unique_fname, multi_fname, strange_fname, mapq_th=5, workers=workers)
+            with open(unique_fname, encoding='utf-8') as unique, open(multi_fname, encoding='utf-8') as multi:
+                outputs.append((unique.read(), multi.read(), result.used_recs, result.bc_cn))
+
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_run_reads_outputs(self):
+        bam_fname = make_bam_file(self.data, rnd_seed=0)
+        unique_reads = get_temp_file_name(extension='bed')
+        multi_reads = get_temp_file_name(extension='bed')
+        outputs = []
+        for quant, kwargs in [
+                ('reads', {}),
+                ('cDNA', {'sites_unique_reads': unique_reads, 'sites_multi_reads': multi_reads})]:
+            unique_fname = get_temp_file_name(extension='bed')
+            multi_fname = get_temp_file_name(extension='bed')
+            strange_fname = get_temp_file_name(extension='bam')
+            xlsites.run(bam_fname, unique_fname, multi_fname, strange_fname, quant=quant, **kwargs)
+            outputs.append((make_list_from_file(unique_fname), make_list_from_file(multi_fname)))
+
+        self.assertEqual(outputs[0], (make_list_from_file(unique_reads), make_list_from_file(multi_reads)))
+        self.assertNotEqual(outputs[0], outputs[1])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,8 @@
 """Utility functions for testing."""
 # pylint: disable=protected-access
+import gzip
 import os
+import shutil
 import tempfile
 
 import pysam
@@ -29,8 +31,8 @@ def get_temp_dir(tmp_dir=None):
     return tempfile.mkdtemp()
 
 
-def make_file_from_list(data, bedtool=True, extension='', tmp_dir=None, tfile=None, sort=False):
-    """Return path to file with the content from `data` (list of lists)."""
+def make_file_from_list(data, bedtool=True, extension='', tmp_dir=None, tfile=None, sort=False, compress=False):
+    """Return path to file with the content from `data` (list of lists), gzipped if `compress`."""
     if tfile is None:
         tfile = get_temp_file_name(extension=extension, tmp_dir=tmp_dir)
     if bedtool:
@@ -44,6 +46,11 @@ def make_file_from_list(data, bedtool=True, extension='', tmp_dir=None, tfile=No
         with open(tfile, 'wt') as file_:
             for list_ in data:
                 file_.write('\t'.join(map(str, list_)) + '\n')
+    if compress:
+        with open(tfile, 'rb') as handle, gzip.open(tfile + '.gz', 'wb') as handle_gz:
+            shutil.copyfileobj(handle, handle_gz)
+        os.remove(tfile)
+        tfile += '.gz'
     return os.path.abspath(tfile)
 
 